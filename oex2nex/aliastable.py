@@ -0,0 +1,74 @@
+#!python
+""" Scoped symbol table for the identifiers that alias the Opera extension
+globals (window, opera, widget, opera.extension, widget.preferences)"""
+
+from jsbackend import get_backend
+
+
+class AliasTable(object):
+    """
+    Maps identifiers to the kind of object they alias. Every JS function
+    gets its own table chained to the enclosing one, so a local declaration
+    shadows an outer alias of the same name. Aliases are resolved by walking
+    the AST of an expression, e.g. with
+    var w = window, o = w.opera;
+    var prefs = w.widget.preferences;
+    both `prefs.foo` and `window.widget.preferences.foo` resolve to an access
+    on "preferences".
+    """
+    KINDS = ("window", "opera", "widget", "extension", "preferences")
+
+    # member name -> {kind of the object: kind of the member}
+    _members = {
+        "window": {"window": "window", "opera": "opera", "widget": "widget"},
+        "opera": {"extension": "extension"},
+        "widget": {"preferences": "preferences"},
+    }
+
+    def __init__(self, parent=None, backend=None):
+        self._parent = parent
+        self._symbols = {}
+        if parent is not None:
+            self._ast = parent._ast
+        else:
+            # the node types of the jsbackend the expressions come from
+            self._ast = (backend or get_backend()).ast
+            for kind in ("window", "opera", "widget"):
+                self._symbols[kind] = kind
+
+    def child(self):
+        """Returns a new table for a nested (function) scope"""
+        return AliasTable(self)
+
+    def define(self, name, kind=None):
+        """
+        Declares name in this scope. A kind of None declares a local which
+        shadows any alias of the same name in the enclosing scopes.
+        """
+        self._symbols[name] = kind
+
+    def lookup(self, name):
+        """Returns the kind aliased by name or None"""
+        table = self
+        while table is not None:
+            if name in table._symbols:
+                return table._symbols[name]
+            table = table._parent
+        return None
+
+    def resolve(self, node):
+        """Returns the kind of object the expression node refers to or None"""
+        ast = self._ast
+        if isinstance(node, ast.Identifier):
+            return self.lookup(node.value)
+        elif isinstance(node, ast.DotAccessor):
+            member = node.identifier.value
+        elif (isinstance(node, ast.BracketAccessor)
+                and isinstance(node.expr, ast.String)):
+            member = node.expr.value[1:-1]
+        else:
+            return None
+        kind = self.resolve(node.node)
+        if kind is None:
+            return None
+        return self._members.get(kind, {}).get(member)
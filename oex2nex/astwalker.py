@@ -2,19 +2,11 @@
 """ Walks JavaScript AST and does some fixes for adapting the code to be used
 with Opera Extension shims"""
 
-import sys
-import re
-try:
-    from slimit.parser import Parser
-    from slimit import ast
-    from slimit.visitors.nodevisitor import NodeVisitor
-except ImportError:
-    sys.exit("ERROR: Could not import slimit module\nIf the module is not"
-             "installed please install it.\ne.g. by running the command "
-             "'easy_install slimit'.")
+from aliastable import AliasTable
+from jsbackend import get_backend
 
 
-class ASTWalker(NodeVisitor):
+class ASTWalker(object):
     """
     Walk a javascript AST and return some interesting nodes
     """
@@ -31,107 +23,101 @@ class ASTWalker(NodeVisitor):
     #   to window or opera or window.widget or window.opera
     # - look for widget.preferences, window.widget.preferences
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, minify=False, backend=None):
         self._debug = debug
+        self._minify = minify
+        # the jsbackend the trees come from
+        self._js = backend or get_backend()
+        self._ast = self._js.ast
 
-    def _get_replacements(self, node=None, aliases={}, scope=0):
+    def to_ecma(self, node):
+        """
+        Serializes node, minified if the walker was created with minify. The
+        replacements from _get_replacements use the same serialization.
+        """
+        if self._minify:
+            return self._js.minify(node)
+        return self._js.to_ecma(node)
+
+    def _get_replacements(self, node=None, aliases=None, scope=0):
         debug = self._debug
+        ast = self._ast
         expr_root = False
         if not isinstance(node, ast.Node):
             return
+        if aliases is None:
+            aliases = AliasTable(backend=self._js)
         try:
             expr_root = isinstance(node, ast.ExprStatement)
             # if debug:
             #     print(">>>--- root is expression statement? :", node, expr_root)
-            for child in node:
-                if isinstance(child, ast.Node):
-                    ce = child.to_ecma()
-                else:
+            for child in self._js.children(node):
+                if not isinstance(child, ast.Node):
                     return
                 if debug:
-                    yield ['reg:', scope, child, child.to_ecma()]
+                    yield ['reg:', scope, child, self._js.to_ecma(child)]
                 # if debug:
                 #     print(">>>--- child under exprstatement node? :", expr_root, node, child)
                 # The replacements need to be done at VarStatement level
                 if isinstance(child, ast.VarStatement):
-                    ve = vef = child.to_ecma()
-                    for vd in child:
+                    ve = vef = self.to_ecma(child)
+                    for vd in self._js.children(child):
                         if isinstance(vd, ast.VarDecl):
-                            if vd.initializer is not None:
-                                cie = vd.initializer.to_ecma()
-                                if cie == "window":
-                                    aliases["window"].append(vd.identifier.value)
-                                elif cie == "opera":
-                                    aliases["opera"].append(vd.identifier.value)
-                                elif (cie == "widget") or (cie == "window.widget"):
-                                    aliases["widget"].append(vd.identifier.value)
-                                # In the following case we also need to handle declarations like
-                                # var op = opera; ...; var exx = op.extension;
-                                elif (cie.find(".extension") > -1):
-                                    aliases["extension"].append(vd.identifier.value)
-                                elif (cie.find(".preferences") > -1):
-                                    aliases["preferences"].append(vd.identifier.value)
+                            # In the following case we also need to handle declarations like
+                            # var op = opera; ...; var exx = op.extension;
+                            # A declaration of anything else shadows an
+                            # alias from an enclosing scope
+                            aliases.define(vd.identifier.value,
+                                           aliases.resolve(vd.initializer))
                             # top level variable declarations
                             if (scope == 0):
                                 # export on to window object
                                 vd.identifier.value += (' = window["' + vd.identifier.value + '"]')
                     if (scope == 0):
                         # the new source text
-                        vef = child.to_ecma()
+                        vef = self.to_ecma(child)
                         yield [{"topvar": {"scope": scope, "node": child,
                                 "text": ve, "textnew": vef,
                                 "aliases": aliases}}]
                     if debug:
-                        yield ['check:var:', scope, 'aliases:', aliases, 'child:', child, child.to_ecma()]
+                        yield ['check:var:', scope, 'aliases:', aliases, 'child:', child, self._js.to_ecma(child)]
                 # assignments for widget.preferences
-                if isinstance(node, ast.ExprStatement) and isinstance(child, ast.Assign):
-                    # also need to check for things like;
-                    # var prefs = widget.preferences; ...; prefs.foo = 34;
-                    # (we need to convert the .foo to setItem('foo', 34)
-#                    if debug:
-#                        print ('children:', child.children())
-                    for label in aliases["preferences"]:
-                        # DON't touch things like:
-                        # document.getElementById("category").options[Number(widget.preferences.select)].selected = 42;
-                        # document.getElementById(widget.preferences.type).checked = true;
-                        # document.getElementById("speed").value = widget.preferences.interval;
-                        if (ce.find(label) > -1) and re.search(label + '(?:.\s*\w+|\[\w+\])\s*=', ce):
-                            if debug:
-                                print('pref label:', label)
-                            datf = dada = daid = val = None
-                            for da in child:
-                                # Handle the following:
-                                # widget.preferences.token = event.data.token;
-                                # widget.preferences.secret = event.data.secret;
-                                # widget.preferences["foo"] = bar;
-                                # var prefs = widget.preferences;
-                                # prefs.cat = meow;
-                                # prefs["coo"] = ceow;
-                                if (isinstance(da, ast.DotAccessor) or isinstance(da, ast.BracketAccessor)) and da.to_ecma().find(label) > -1:
-                                    for dac in da:
-                                        if isinstance(dac, ast.Identifier) and dac.to_ecma() != label:
-                                            daid = dac.to_ecma()
-                                            daid = "'" + daid + "'"
-                                        elif isinstance(dac, ast.String):
-                                            daid = dac.to_ecma()
-                                        else:
-                                            dada = dac.to_ecma()
-                                else:
-                                    val = da.to_ecma()
-
-                            if dada and daid and val:
-                                datf = dada + '.setItem(' + daid + ', ' + val + ')'
-                                yield [{"prefs": {"scope": scope,
-                                        "node": child, "text": child.to_ecma(),
-                                        "textnew": datf, "aliases": aliases}}]
-                            elif debug:
-                                print("Entered preferences finder but failed to find one; code: prefix:", dada, ", key:", daid, ":value:", val, child.to_ecma())
-                            # not much chance that we would again match at the same place
-                            break
+                # also need to check for things like;
+                # var prefs = widget.preferences; ...; prefs.foo = 34;
+                # (we need to convert the .foo to setItem('foo', 34)
+                # DON't touch things like:
+                # document.getElementById("category").options[Number(widget.preferences.select)].selected = 42;
+                # document.getElementById(widget.preferences.type).checked = true;
+                # document.getElementById("speed").value = widget.preferences.interval;
+                if (isinstance(node, ast.ExprStatement)
+                        and isinstance(child, ast.Assign) and child.op == "="
+                        and isinstance(child.left, (ast.DotAccessor,
+                                                    ast.BracketAccessor))
+                        and aliases.resolve(child.left.node) == "preferences"):
+                    # Handle the following:
+                    # widget.preferences.token = event.data.token;
+                    # widget.preferences.secret = event.data.secret;
+                    # widget.preferences["foo"] = bar;
+                    # var prefs = widget.preferences;
+                    # prefs.cat = meow;
+                    # prefs["coo"] = ceow;
+                    da = child.left
+                    dada = self.to_ecma(da.node)
+                    if isinstance(da, ast.DotAccessor):
+                        daid = "'" + da.identifier.value + "'"
+                    else:
+                        daid = self.to_ecma(da.expr)
+                    val = self.to_ecma(child.right)
+                    datf = dada + '.setItem(' + daid + ', ' + val + ')'
+                    if debug:
+                        print('pref alias:', dada)
+                    yield [{"prefs": {"scope": scope,
+                            "node": child, "text": self.to_ecma(child),
+                            "textnew": datf, "aliases": aliases}}]
 
                 if isinstance(child, ast.FunctionCall):
-                    ce = child.to_ecma()
-                    cie = child.identifier.to_ecma()
+                    ce = self.to_ecma(child)
+                    cie = self._js.to_ecma(child.identifier)
                     if cie == "eval" or cie.endswith(".eval"):
                         # change eval to eval.call to fix the scope of the call
                         # Various cases that we are looking at:
@@ -144,11 +130,11 @@ class ASTWalker(NodeVisitor):
                         # cef = cef.replace(cie, "%s['call']" % (cie), 1)
                         if debug:
                             print ("Found eval call: attempting to fix that.")
-                        chs = child.children()
-                        if len(chs) == 2 and chs[1] is not None:
-                            cief = chs[0].to_ecma() #identifier part
+                        args = self._js.arguments(child)
+                        if len(args) == 1 and args[0] is not None:
+                            cief = self.to_ecma(child.identifier) #identifier part
                             cief = "%s['call']" % cief # change to window.eval.call
-                            cref = chs[1].to_ecma()
+                            cref = self.to_ecma(args[0])
                             cef = '%s (window, %s)' % (cief, cref)
                             print 'eval fixed:', cef
                             yield [{"eval": {"scope": scope, "node": child,
@@ -157,7 +143,7 @@ class ASTWalker(NodeVisitor):
                 if (scope == 0) and isinstance(child, ast.FuncDecl):
                     # replace as follows -
                     # function foo() {} -> var foo = window['foo'] = function () { }
-                    fe = child.to_ecma()
+                    fe = self.to_ecma(child)
                     if debug:
                         print ('Top level func decl:', fe)
                     # Replace only the first (else risk removing function identifiers inside the main function)
@@ -171,14 +157,85 @@ class ASTWalker(NodeVisitor):
                     yield [{"function-id": {"scope": scope, "node": child,
                             "text": fe, "textnew": fef}}]
 
-                # Descend
-                for subchild in self._get_replacements(child, aliases, scope + 1):
+                # Descend; functions get their own scope for aliases
+                child_aliases = aliases
+                if isinstance(child, (ast.FuncDecl, ast.FuncExpr)):
+                    # a declaration binds its name in the enclosing scope,
+                    # a named function expression only in its own
+                    if isinstance(child, ast.FuncDecl):
+                        aliases.define(child.identifier.value)
+                    child_aliases = aliases.child()
+                    if (isinstance(child, ast.FuncExpr)
+                            and child.identifier is not None):
+                        child_aliases.define(child.identifier.value)
+                    for param in child.parameters:
+                        child_aliases.define(param.value)
+                for subchild in self._get_replacements(child, child_aliases,
+                                                       scope + 1):
                     yield subchild
 
         except Exception as e:
             print("ERROR: Threw exception in script fixer. The scripts in the"
                   "nex package might not work correctly.", e)
 
+    def count_nodes(self, node, limit=None):
+        """
+        Counts the nodes in the tree below node. Stops counting as soon as
+        the count goes over limit.
+        """
+        ast = self._ast
+        count = 0
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            count += 1
+            if limit and count > limit:
+                break
+            stack.extend(c for c in self._js.children(current)
+                         if isinstance(c, ast.Node))
+        return count
+
+    def api_calls(self, node):
+        """
+        Returns the set of Opera extension API methods called in the tree
+        below node, as dotted names like "opera.contexts.toolbar.addItem".
+        Calls through aliases (var w = window; w.opera.postError()) are
+        resolved with one AliasTable for the whole script, good enough for
+        an inventory.
+        """
+        ast = self._ast
+        aliases = AliasTable(backend=self._js)
+        prefixes = {"opera": "opera", "widget": "widget",
+                    "extension": "opera.extension",
+                    "preferences": "widget.preferences"}
+        calls = set()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if isinstance(current, ast.VarDecl):
+                kind = aliases.resolve(current.initializer)
+                if kind is not None:
+                    aliases.define(current.identifier.value, kind)
+            elif (isinstance(current, ast.FunctionCall)
+                    and isinstance(current.identifier, ast.DotAccessor)):
+                accessor = current.identifier
+                members = [accessor.identifier.value]
+                target = accessor.node
+                # the longest prefix of the chain that is an API object
+                while True:
+                    kind = aliases.resolve(target)
+                    if kind in prefixes:
+                        calls.add(".".join([prefixes[kind]]
+                                           + members[::-1]))
+                        break
+                    if not isinstance(target, ast.DotAccessor):
+                        break
+                    members.append(target.identifier.value)
+                    target = target.node
+            stack.extend(c for c in reversed(self._js.children(current))
+                         if isinstance(c, ast.Node))
+        return calls
+
     def find_apicall(self, node, *apicalls):
         """
         Traverses JS source and looks for hints about what APIs are being used.
@@ -220,26 +277,20 @@ class ASTWalker(NodeVisitor):
         None if nothing is found.
         """
         debug = self._debug
+        ast = self._ast
         found = False
 
-        #lhs is probably actually a parent object or container
-        def lhs_finder(node, lh_object):
-            """
-            For a given node, determines if it contains a "lh_object", which
-            should be an ancestor object to an API method call.
-            """
-            # var is either a VarStatement or VarDecl (which
-            # could be an implicit global declaration)
-            var = node.to_ecma()
-            if lh_object in var:
-                if debug:
-                    print('Aliased API call found (maybe)', node.to_ecma())
-                return True
-
+        # lhs is probably actually a parent object or container. A call on
+        # any other object counts if the object is named in the last var or
+        # expression statement of the tree (var is either a VarStatement or
+        # VarDecl, which could be an implicit global declaration). Its text
+        # is found on the first such call; the search used to be repeated
+        # for every call, keeping only the last result.
+        last_statement = []
         try:
-            for child in self.visit(node):
+            for child in self._js.walk(node):
                 if isinstance(child, ast.FunctionCall) and isinstance(child.identifier, ast.DotAccessor):
-                    method_call = child.identifier.to_ecma()
+                    method_call = self._js.to_ecma(child.identifier)
                     object_chain = method_call.split('.')
                     lh_object = object_chain[-2]
                     if object_chain[-1] == apicall:
@@ -249,14 +300,23 @@ class ASTWalker(NodeVisitor):
                                 print('API call found (maybe):', method_call)
                             found = True
                         else:
-                            for child in self.visit(node):
-                                if isinstance(child, ast.VarStatement):
-                                    found = lhs_finder(child, lh_object)
-
-                                elif isinstance(child, ast.ExprStatement):
-                                    found = lhs_finder(child, lh_object)
+                            if not last_statement:
+                                statement = None
+                                for candidate in self._js.walk(node):
+                                    if isinstance(candidate, (ast.VarStatement,
+                                                              ast.ExprStatement)):
+                                        statement = candidate
+                                last_statement.append(None if statement is None
+                                        else self._js.to_ecma(statement))
+                            var = last_statement[0]
+                            if var is not None:
+                                found = None
+                                if lh_object in var:
+                                    if debug:
+                                        print('Aliased API call found (maybe)', var)
+                                    found = True
 
                 if found:
                     return found
         except Exception as e:
-            print('ERROR: Exception thrown in api call finder.', e, child.to_ecma())
+            print('ERROR: Exception thrown in api call finder.', e)
@@ -0,0 +1,383 @@
+#!python
+""" Converts many packages in worker processes, with per package time and
+memory limits and a journal to resume interrupted runs """
+
+import os
+import sys
+import json
+import time
+import hashlib
+import multiprocessing
+from collections import deque
+try:
+    import resource
+except ImportError:
+    # no rlimits on this platform, the memory limit is not enforced
+    resource = None
+from convertor import Oex2Nex
+from metrics import BatchMetrics, package_metrics
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_TIMEOUT = "timeout"
+STATUS_CRASHED = "crashed"
+
+
+def _package_name(in_file):
+    """ The name of a package file or directory, without the extension """
+    return os.path.splitext(os.path.basename(in_file.rstrip(os.sep)))[0]
+
+
+def _convert_one(in_file, out_file, options):
+    """ Converts one package, returns its journal record """
+    record = {"file": in_file, "out": out_file, "warnings": [],
+              "error": None}
+    start = time.time()
+    # the worker process only converts, its memory peak can be reset
+    options = dict({"reset_peaks": True}, **options)
+    try:
+        convertor = Oex2Nex(in_file, out_file, **options)
+        convertor.convert()
+        record["status"] = STATUS_OK
+        record["warnings"] = convertor.warnings
+        record["metrics"] = package_metrics(convertor, in_file, out_file)
+    except MemoryError:
+        record["status"] = STATUS_FAILED
+        record["error"] = "Out of memory"
+    except Exception as e:
+        # e.g. InvalidPackage or slimit recursing too deep
+        record["status"] = STATUS_FAILED
+        record["error"] = "%s: %s" % (type(e).__name__, e)
+    record["seconds"] = round(time.time() - start, 3)
+    return record
+
+
+def _work(conn, max_memory, max_tasks, options):
+    """ Worker process main loop. Converts the (in_file, out_file) tasks
+    received on conn until it gets None or has done max_tasks of them """
+    if max_memory and resource is not None:
+        (_soft, hard) = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            max_memory = min(max_memory, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, hard))
+    done = 0
+    while not max_tasks or done < max_tasks:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        conn.send(_convert_one(task[0], task[1], options))
+        done += 1
+    conn.close()
+
+
+class _Worker(object):
+    """ A worker process and the task it is working on """
+    def __init__(self, runner):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_work,
+                args=(child_conn, runner.max_memory, runner.tasks_per_worker,
+                      runner.options))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = None
+        self.done = 0
+
+    def start(self, task):
+        self.task = task
+        self.started = time.time()
+        self.conn.send(task)
+
+    def result(self, timeout=None):
+        """ Returns the journal record of the current task once it is done,
+        or None while it is still running. A worker that went over timeout
+        seconds is killed """
+        (in_file, out_file) = self.task
+        record = None
+        if self.conn.poll():
+            try:
+                record = self.conn.recv()
+            except (EOFError, IOError):
+                pass
+        if record is None:
+            seconds = time.time() - self.started
+            if not self.process.is_alive():
+                # e.g. killed by the kernel or a crash in C code
+                record = {"status": STATUS_CRASHED,
+                          "error": "Worker exited with code %s"
+                          % self.process.exitcode}
+            elif timeout and seconds > timeout:
+                self.process.terminate()
+                self.process.join()
+                record = {"status": STATUS_TIMEOUT,
+                          "error": "Took more than %s seconds" % timeout}
+            else:
+                return None
+            record.update({"file": in_file, "out": out_file,
+                           "warnings": [], "seconds": round(seconds, 3)})
+        self.task = None
+        self.done += 1
+        return record
+
+    def usable(self, max_tasks):
+        """ Whether the worker can take another task """
+        return (self.process.is_alive()
+                and (not max_tasks or self.done < max_tasks))
+
+    def stop(self):
+        if self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except IOError:
+                pass
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.conn.close()
+
+
+class BatchRunner(object):
+    """
+    Converts packages into out_dir with jobs worker processes. Each package
+    may take timeout seconds and each worker max_memory bytes of address
+    space; workers are replaced after tasks_per_worker packages, or when one
+    is killed. Every finished package is appended to the journal (JSON
+    lines), and a new run with the same journal skips the packages already
+    in it, so an interrupted run can be resumed. options are passed to
+    Oex2Nex. The packages started and finished are recorded in metrics, a
+    BatchMetrics, if it is given.
+    """
+    def __init__(self, out_dir, journal=None, jobs=None, timeout=300,
+                 max_memory=1024 * 1024 * 1024, tasks_per_worker=50,
+                 options=None, metrics=None):
+        self.out_dir = out_dir
+        self.journal = journal or os.path.join(out_dir, "batch-journal.jsonl")
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.tasks_per_worker = tasks_per_worker
+        self.options = options or {}
+        self.metrics = metrics
+
+    def load_journal(self):
+        """ Returns a dict of the last journal record of each package """
+        records = {}
+        try:
+            fh = open(self.journal, "r")
+        except IOError:
+            return records
+        for line in fh:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line of a run that was killed while writing it
+                continue
+            records[record["file"]] = record
+        fh.close()
+        return records
+
+    def out_file(self, in_file, unique=True):
+        """ Returns the output package of in_file in out_dir, named like the
+        input. A name that is not unique among the packages converted gets
+        a suffix from a hash of the input path, so a/ext.oex and b/ext.oex
+        do not overwrite each other """
+        name = _package_name(in_file)
+        if not unique:
+            path = os.path.abspath(in_file.rstrip(os.sep))
+            name += "-" + hashlib.sha1(path).hexdigest()[:8]
+        return os.path.join(self.out_dir, name + ".nex")
+
+    def out_files(self, in_files, journaled=None):
+        """ Returns the output package of each of in_files, by input file.
+        A package in the journaled records keeps the out file of its
+        record, so a resumed or later run writes the same file. The others
+        get out_file(), with the hash suffix when their name is also the
+        name of another of in_files or of an output in the journal """
+        journaled = journaled or {}
+        # case insensitive, for the file systems that are
+        paths = {}
+        for in_file in in_files:
+            paths.setdefault(_package_name(in_file).lower(), set()).add(
+                    os.path.abspath(in_file.rstrip(os.sep)))
+        taken = set(_package_name(record["out"]).lower()
+                    for record in journaled.values() if record.get("out"))
+        outs = {}
+        for in_file in in_files:
+            record = journaled.get(in_file)
+            if record is not None and record.get("out"):
+                outs[in_file] = record["out"]
+                continue
+            name = _package_name(in_file).lower()
+            outs[in_file] = self.out_file(in_file, len(paths[name]) == 1
+                                          and name not in taken)
+        return outs
+
+    def run(self, in_files, retry_failed=False, progress=None):
+        """
+        Converts the packages in in_files that are not in the journal yet
+        (or did not convert, with retry_failed). Calls progress with each
+        journal record. Returns a dict of the number of packages per status
+        in this run.
+        """
+        if not os.path.isdir(self.out_dir):
+            os.makedirs(self.out_dir)
+        journaled = self.load_journal()
+        out_files = self.out_files(in_files, journaled)
+        queue = deque()
+        for in_file in in_files:
+            record = journaled.get(in_file)
+            if record is None or (retry_failed
+                                  and record["status"] != STATUS_OK):
+                queue.append((in_file, out_files[in_file]))
+        counts = {}
+        journal = open(self.journal, "a")
+
+        def next_task():
+            return queue.popleft() if queue else None
+
+        def finished(record):
+            journal.write(json.dumps(record) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+            if progress:
+                progress(record)
+
+        try:
+            self.process_tasks(next_task, finished)
+        finally:
+            journal.close()
+        return counts
+
+    def process_tasks(self, next_task, finished, tick=None):
+        """
+        Runs the (in_file, out_file) tasks returned by next_task() on the
+        worker processes until it returns None and the running tasks are
+        done. next_task is only called when a worker is free to start the
+        task. finished is called with the journal record of each task, tick
+        with the list of running tasks every time the workers are checked.
+        """
+        metrics = self.metrics
+        workers = []
+        exhausted = False
+        try:
+            while True:
+                for worker in list(workers):
+                    if worker.task is not None:
+                        record = worker.result(self.timeout)
+                        if record is None:
+                            continue
+                        if metrics is not None:
+                            metrics.finished(record)
+                        finished(record)
+                    if not worker.usable(self.tasks_per_worker):
+                        worker.stop()
+                        workers.remove(worker)
+                    elif not exhausted:
+                        task = next_task()
+                        if task is None:
+                            exhausted = True
+                        else:
+                            worker.start(task)
+                            if metrics is not None:
+                                metrics.started(task[0])
+                while not exhausted and len(workers) < self.jobs:
+                    task = next_task()
+                    if task is None:
+                        exhausted = True
+                        break
+                    worker = _Worker(self)
+                    worker.start(task)
+                    if metrics is not None:
+                        metrics.started(task[0])
+                    workers.append(worker)
+                running = [w.task for w in workers if w.task is not None]
+                if not running:
+                    if exhausted:
+                        break
+                    continue
+                if tick:
+                    tick(running)
+                if metrics is not None:
+                    metrics.tick()
+                time.sleep(0.01)
+        finally:
+            for worker in workers:
+                worker.stop()
+            if metrics is not None:
+                metrics.write()
+
+
+def main(args=None):
+    import argparse
+    argparser = argparse.ArgumentParser(description="Convert many Opera OEX "
+            "extensions into NEX extensions. Packages already in the journal "
+            "of an earlier run are skipped.")
+    argparser.add_argument('out_dir', help="Directory for the .nex files")
+    argparser.add_argument('in_files', nargs='+', metavar='in_file',
+            help="Path to an .oex file or an extracted extension")
+    argparser.add_argument('-j', '--jobs', type=int, default=None,
+            metavar='N', help="Number of worker processes (default: number "
+                "of CPUs)")
+    argparser.add_argument('--timeout', type=float, default=300,
+            metavar='SECONDS', help="Time a single package may take before "
+                "its worker is killed (0 for no limit)")
+    argparser.add_argument('--max-memory', type=int, default=1024,
+            metavar='MB', help="Address space limit of a worker process "
+                "(0 for no limit)")
+    argparser.add_argument('--tasks-per-worker', type=int, default=50,
+            metavar='N', help="Replace a worker process after it converted "
+                "this many packages (0 for never)")
+    argparser.add_argument('--journal', default=None,
+            help="Journal file (default: out_dir/batch-journal.jsonl)")
+    argparser.add_argument('--retry-failed', default=False,
+            action='store_true', help="Convert the packages that failed in "
+                "an earlier run again")
+    argparser.add_argument('-t', '--trim-shims', default=False,
+            action='store_true', help="See convertor.py --trim-shims")
+    argparser.add_argument('-m', '--minify', default=False,
+            action='store_true', help="See convertor.py --minify")
+    argparser.add_argument('-b', '--bundle-inline', default=False,
+            action='store_true', help="See convertor.py --bundle-inline")
+    argparser.add_argument('-r', '--reproducible', default=False,
+            action='store_true', help="See convertor.py --reproducible")
+    argparser.add_argument('--metrics', default=None, metavar='FILE',
+            help="Keep the throughput metrics of the run in FILE, in the "
+                "Prometheus text format")
+    argparser.add_argument('--events', default=None, metavar='FILE',
+            help="Append a JSON line to FILE when a package is started and "
+                "when it is finished")
+    args = argparser.parse_args(args)
+
+    # the workers already run in parallel, one compression thread each
+    options = {"trim_shims": args.trim_shims, "minify": args.minify,
+               "bundle_inline": args.bundle_inline,
+               "reproducible": args.reproducible, "jobs": 1}
+    metrics = None
+    if args.metrics or args.events:
+        metrics = BatchMetrics(args.metrics, args.events)
+    runner = BatchRunner(args.out_dir, args.journal, args.jobs, args.timeout,
+                         args.max_memory * 1024 * 1024, args.tasks_per_worker,
+                         options, metrics)
+
+    def progress(record):
+        print("%s %s%s" % (record["status"], record["file"],
+                           ": " + record["error"] if record["error"] else ""))
+    try:
+        counts = runner.run(args.in_files, args.retry_failed, progress)
+    finally:
+        if metrics is not None:
+            metrics.close()
+    print(", ".join("%d %s" % (n, status)
+                    for (status, n) in sorted(counts.items()))
+          or "Nothing to convert")
+    if counts.get(STATUS_OK, 0) != sum(counts.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+#!python
+"""
+An index of the config.xml metadata and the API usage of a corpus of
+packages in SQLite, so questions like "which extensions use
+opera.contexts.toolbar.addItem and opera:share-cookies" do not need the
+packages converted again. Packages are indexed again only when their content
+or the converter code changed.
+"""
+
+import os
+import time
+import hashlib
+import sqlite3
+import zipfile
+import multiprocessing
+import html5lib
+import jsbackend
+from astwalker import ASTWalker
+from convertor import (parse_config, classify, unicoder, feature_permissions,
+                       vendor_library, script_limits, InvalidPackage,
+                       UnicodingError, ScriptLimitExceeded, _Deadline,
+                       FILE_HTML, FILE_JS, FILE_USERSCRIPT)
+from resultcache import code_version, _update_from_file
+
+schema = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS packages (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    sha1 TEXT NOT NULL,
+    size INTEGER,
+    indexed REAL,
+    name TEXT,
+    description TEXT,
+    version TEXT,
+    author TEXT,
+    index_file TEXT,
+    speeddial TEXT,
+    default_locale TEXT,
+    scripts INTEGER,
+    parse_failures INTEGER,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS features (package INTEGER, name TEXT);
+CREATE TABLE IF NOT EXISTS access (package INTEGER, origin TEXT,
+                                   subdomains TEXT);
+CREATE TABLE IF NOT EXISTS preferences (package INTEGER, name TEXT,
+                                        value TEXT);
+CREATE TABLE IF NOT EXISTS icons (package INTEGER, size TEXT, src TEXT);
+CREATE TABLE IF NOT EXISTS api_calls (package INTEGER, api TEXT, file TEXT);
+CREATE TABLE IF NOT EXISTS permissions (package INTEGER, permission TEXT);
+CREATE INDEX IF NOT EXISTS features_name ON features (name, package);
+CREATE INDEX IF NOT EXISTS api_calls_api ON api_calls (api, package);
+CREATE INDEX IF NOT EXISTS permissions_permission
+    ON permissions (permission, package);
+"""
+
+# tables with one row per package property, by the package id
+detail_tables = ("features", "access", "preferences", "icons", "api_calls",
+                 "permissions")
+
+
+def file_digest(path):
+    """ Returns the SHA-1 of the content of the file path """
+    digest = hashlib.sha1()
+    _update_from_file(digest, path)
+    return digest.hexdigest()
+
+
+def _inline_scripts(html):
+    """ Returns the text of the inline scripts of an HTML document """
+    doc = html5lib.HTMLParser(
+            tree=html5lib.treebuilders.getTreeBuilder("dom")).parse(html)
+    scripts = []
+    for script in doc.getElementsByTagName(u"script"):
+        if not script.getAttribute(u"src"):
+            text = u"".join(node.nodeValue for node in script.childNodes)
+            if text.strip():
+                scripts.append(text)
+    return scripts
+
+
+def _scan_script(js, walker, script, found):
+    """ Adds the API calls and permissions of script to found. Returns False
+    if the script could not be parsed """
+    if script_limits["size"] and len(script) > script_limits["size"]:
+        return False
+    try:
+        with _Deadline(script_limits["parse_time"]):
+            tree = js.parse(script)
+            calls = walker.api_calls(tree)
+            # the same checks that add permissions when converting
+            perms = [walker.find_apicall(tree, 'create', 'getAll',
+                                         'getFocused', 'getSelected'),
+                     walker.find_apicall(tree, 'add', 'remove')]
+            if walker.find_button(tree):
+                calls.add("opera.contexts.toolbar.addItem")
+    except (SyntaxError, ScriptLimitExceeded, RuntimeError):
+        # RuntimeError: slimit recursing too deep
+        return False
+    found["api_calls"].update(calls)
+    for perm in perms:
+        if isinstance(perm, basestring):
+            found["permissions"].add(perm)
+        elif perm:
+            found["permissions"].update(perm)
+    return True
+
+
+def scan_package(path):
+    """
+    Reads the config.xml metadata and the API usage of the package file
+    path. Returns a dict of the config (see convertor.parse_config), the api_calls as (api,
+    file) pairs, the permissions the conversion would add, the number of
+    scripts and parse_failures, and error, the reason the package could not
+    be read, or None. The scripts of known libraries (see
+    convertor.vendor_library()) are skipped, like in the conversion.
+    """
+    record = {"path": path, "size": os.path.getsize(path),
+              "sha1": file_digest(path), "config": None, "api_calls": [],
+              "permissions": [], "scripts": 0, "parse_failures": 0,
+              "error": None}
+    try:
+        oex = zipfile.ZipFile(path, "r")
+    except (zipfile.BadZipfile, IOError) as e:
+        record["error"] = "Not a zip file: %s" % e
+        return record
+    try:
+        config = parse_config(oex)
+    except InvalidPackage as e:
+        oex.close()
+        record["error"] = str(e)
+        return record
+    record["config"] = config
+    permissions = set(feature_permissions[feature]
+                      for feature in config["features"]
+                      if feature in feature_permissions)
+    js = jsbackend.get_backend()
+    walker = ASTWalker(backend=js)
+    api_calls = set()
+    for filename in oex.namelist():
+        if filename.startswith("__MACOSX/"):
+            continue
+        try:
+            data = oex.read(filename)
+        except (zipfile.BadZipfile, IOError, RuntimeError) as e:
+            record["error"] = "Could not read %s: %s" % (filename, e)
+            continue
+        file_class = classify(filename, data)
+        if file_class not in (FILE_HTML, FILE_JS, FILE_USERSCRIPT):
+            continue
+        if file_class != FILE_HTML and vendor_library(filename, data):
+            # not fixed by the conversion either
+            continue
+        try:
+            data = unicoder(data)
+        except UnicodingError:
+            continue
+        if file_class == FILE_HTML:
+            scripts = _inline_scripts(data)
+        else:
+            scripts = [data]
+        for script in scripts:
+            found = {"api_calls": set(), "permissions": permissions}
+            record["scripts"] += 1
+            if not _scan_script(js, walker, script, found):
+                record["parse_failures"] += 1
+            api_calls.update((api, filename) for api in found["api_calls"])
+    oex.close()
+    record["api_calls"] = sorted(api_calls)
+    record["permissions"] = sorted(permissions)
+    return record
+
+
+def _scan_or_fail(path):
+    """ scan_package for the worker pool, a package that breaks the scanner
+    gets an error record instead of stopping the run """
+    try:
+        return scan_package(path)
+    except Exception as e:
+        return {"path": path, "error": "%s: %s" % (type(e).__name__, e)}
+
+
+def _text(value):
+    if isinstance(value, str):
+        return value.decode("utf-8", "replace")
+    return value
+
+
+class Catalogue(object):
+    """
+    The SQLite database at path. index() adds or updates packages. The
+    tables can be queried directly with query().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(schema)
+
+    def close(self):
+        self.db.close()
+
+    def _known(self):
+        """ Returns the SHA-1 of the indexed packages by path, without the
+        ones indexed by another scanner version """
+        version = code_version()
+        row = self.db.execute("SELECT value FROM meta WHERE key = "
+                              "'scanner'").fetchone()
+        if row is None or row[0] != version:
+            self.db.execute("UPDATE packages SET sha1 = ''")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES "
+                            "('scanner', ?)", (version,))
+            self.db.commit()
+        return dict(self.db.execute("SELECT path, sha1 FROM packages"))
+
+    def index(self, paths, jobs=1, progress=None):
+        """
+        Indexes the package files in paths that are new or changed since
+        they were last indexed, scanning them on jobs processes. Calls
+        progress with the scan record of each indexed package. Returns a
+        dict with the number of indexed, unchanged and failed packages.
+        """
+        known = self._known()
+        counts = {"indexed": 0, "unchanged": 0, "failed": 0}
+        todo = []
+        for path in paths:
+            path = os.path.abspath(path)
+            if known.get(path) == file_digest(path):
+                counts["unchanged"] += 1
+            else:
+                todo.append(path)
+        if jobs > 1 and len(todo) > 1:
+            pool = multiprocessing.Pool(jobs)
+            records = pool.imap_unordered(_scan_or_fail, todo)
+        else:
+            pool = None
+            records = (_scan_or_fail(path) for path in todo)
+        try:
+            for record in records:
+                if record.get("sha1") is None:
+                    # the scanner itself failed, try again next time
+                    record["sha1"] = ""
+                self._store(record)
+                counts["failed" if record["error"] else "indexed"] += 1
+                if progress:
+                    progress(record)
+        finally:
+            self.db.commit()
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return counts
+
+    def _store(self, record):
+        db = self.db
+        row = db.execute("SELECT id FROM packages WHERE path = ?",
+                         (record["path"],)).fetchone()
+        if row is not None:
+            for table in detail_tables:
+                db.execute("DELETE FROM %s WHERE package = ?" % table, row)
+            db.execute("DELETE FROM packages WHERE id = ?", row)
+        config = record.get("config") or {}
+        author = config.get("author")
+        cursor = db.execute("INSERT INTO packages (path, sha1, size, indexed,"
+                " name, description, version, author, index_file, speeddial,"
+                " default_locale, scripts, parse_failures, error) VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (record["path"], record["sha1"], record.get("size"),
+                 time.time(), _text(config.get("name")),
+                 _text(config.get("description")), config.get("version"),
+                 author and author["name"], config.get("index"),
+                 config.get("speeddial"), config.get("default_locale"),
+                 record.get("scripts"), record.get("parse_failures"),
+                 record["error"]))
+        package = cursor.lastrowid
+        details = {
+            "features": [(name,) for name in config.get("features", [])],
+            "access": config.get("access", []),
+            "preferences": sorted(config.get("preferences", {}).items()),
+            "icons": sorted(config.get("icons", {}).items()),
+            "api_calls": record.get("api_calls", []),
+            "permissions": [(p,) for p in record.get("permissions", [])],
+        }
+        for table in detail_tables:
+            for values in details[table]:
+                db.execute("INSERT INTO %s VALUES (?%s)"
+                           % (table, ", ?" * len(values)),
+                           (package,) + tuple(values))
+
+    def remove_missing(self):
+        """ Drops the packages whose file is gone. Returns their number """
+        gone = [(package, ) for (package, path)
+                in self.db.execute("SELECT id, path FROM packages")
+                if not os.path.isfile(path)]
+        for table in detail_tables:
+            self.db.executemany("DELETE FROM %s WHERE package = ?" % table,
+                                gone)
+        self.db.executemany("DELETE FROM packages WHERE id = ?", gone)
+        self.db.commit()
+        return len(gone)
+
+    def query(self, sql, params=()):
+        """ Returns the rows of an SQL query on the catalogue """
+        return self.db.execute(sql, params).fetchall()
+
+    def find(self, apis=(), features=(), permissions=()):
+        """ Returns (path, name) of the packages using all of the given API
+        methods, features and permissions, sorted by path """
+        sql = "SELECT path, name FROM packages p WHERE error IS NULL"
+        params = []
+        for (table, column, values) in (("api_calls", "api", apis),
+                                        ("features", "name", features),
+                                        ("permissions", "permission",
+                                         permissions)):
+            for value in values:
+                sql += (" AND EXISTS (SELECT 1 FROM %s WHERE package = p.id"
+                        " AND %s = ?)" % (table, column))
+                params.append(value)
+        return self.query(sql + " ORDER BY path", params)
+
+
+def find_packages(paths):
+    """ Returns the .oex files in paths, directories are searched
+    recursively """
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+        for top, dirns, fnames in os.walk(path):
+            dirns.sort()
+            found.extend(os.path.join(top, fname) for fname in sorted(fnames)
+                         if fname.lower().endswith(".oex"))
+    return found
+
+
+def main(args=None):
+    import argparse
+    argparser = argparse.ArgumentParser(description="Index the metadata and "
+            "API usage of Opera OEX extensions in an SQLite database")
+    argparser.add_argument('database', help="Path to the SQLite database")
+    commands = argparser.add_subparsers(dest='command')
+    index = commands.add_parser('index', help="Add new and changed packages")
+    index.add_argument('paths', nargs='+', metavar='path',
+            help="An .oex file or a directory searched for them")
+    index.add_argument('-j', '--jobs', type=int,
+            default=multiprocessing.cpu_count(), metavar='N',
+            help="Number of processes scanning packages (default: number of "
+                "CPUs)")
+    index.add_argument('--prune', default=False, action='store_true',
+            help="Also drop the packages whose file is gone")
+    find = commands.add_parser('find', help="List the packages using all of "
+            "the given APIs, features and permissions")
+    find.add_argument('--api', action='append', default=[],
+            help="API method, e.g. opera.contexts.toolbar.addItem")
+    find.add_argument('--feature', action='append', default=[],
+            help="config.xml feature, e.g. opera:share-cookies")
+    find.add_argument('--permission', action='append', default=[],
+            help="Permission the converted extension gets, e.g. tabs")
+    query = commands.add_parser('query', help="Run an SQL query")
+    query.add_argument('sql')
+    args = argparser.parse_args(args)
+
+    catalogue = Catalogue(args.database)
+    try:
+        if args.command == 'index':
+            def progress(record):
+                if record["error"]:
+                    print("failed %s: %s" % (record["path"], record["error"]))
+            counts = catalogue.index(find_packages(args.paths), args.jobs,
+                                     progress)
+            if args.prune:
+                counts["removed"] = catalogue.remove_missing()
+            print(", ".join("%d %s" % (n, state)
+                            for (state, n) in sorted(counts.items())))
+        elif args.command == 'find':
+            for (path, name) in catalogue.find(args.api, args.feature,
+                                               args.permission):
+                print((u"%s\t%s" % (path, name)).encode("utf-8"))
+        else:
+            for row in catalogue.query(args.sql):
+                print((u"\t".join(unicode(value) for value in row))
+                      .encode("utf-8"))
+    finally:
+        catalogue.close()
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,18 @@ import sys
 import re
 import zipfile
 import codecs
+import shutil
+import hashlib
 import json
+import time
+import signal
+import struct
+import fnmatch
+import zlib
+import threading
+import subprocess
+import urllib2
+from io import BytesIO
 import xml.etree.ElementTree as etree
 
 try:
@@ -24,13 +35,24 @@ except ImportError:
         "installation.")
 
 try:
-    from slimit.parser import Parser as JSParser
+    # the parser of jsbackend
+    import slimit
 except ImportError:
     sys.exit("ERROR: Could not import slimit module\nIf the module is not"
         "installed. Please install it.\ne.g. by running the command"
         "'easy_install slimit'.")
 
 from astwalker import ASTWalker
+from aliastable import AliasTable
+import jsbackend
+from jstokens import export_globals
+from userscript import parse_metadata, content_script_matches
+from nexmanifest import Manifest
+from nexwriter import NexWriter
+from resultcache import ResultCache
+from memusage import MemoryMeter
+from shimsync import ShimSync, ShimSyncError, ShimAuthRequired
+import shims
 
 #BEGIN
 debug = False
@@ -42,7 +64,7 @@ indexdoc = u"index.html"
 popupdoc = u"popup.html"
 optionsdoc = u"options.html"
 shim_dirname = u"oex_shim"
-shim_fs_path = os.path.dirname(__file__)
+shim_fs_path = os.path.dirname(os.path.abspath(__file__))
 #"http://addons.opera.com/tools/oex_shim/"
 shim_fetch_from = (u"https://cgit.oslo.osa/"
         "cgi-bin/cgit.cgi/desktop/extensions/oex_shim/plain/build/")
@@ -51,8 +73,61 @@ oex_anypage_shim = u"%s/operaextensions_popup.js" % shim_dirname
 oex_injscr_shim = u"%s/operaextensions_injectedscript.js" % shim_dirname
 oex_resource_loader = u"%s/popup_resourceloader" % shim_dirname
 # TODO: add a smart way of adding these following default permissions
-permissions = [u"http://*/*", u"https://*/*", u"storage"]
+default_permissions = (u"http://*/*", u"https://*/*", u"storage")
+permissions = list(default_permissions)
 has_button = False
+# Minified shims and other cached data go here
+cache_dir = os.environ.get("OEX2NEX_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "oex2nex"))
+# Permissions needed for the features a config.xml can request
+feature_permissions = {
+    "opera:contextmenus": "contextMenus",
+    "opera:share-cookies": "cookies",
+}
+# Limits of the packages check_package() lets through. A limit of None
+# disables it.
+package_limits = {
+    "size": 256 * 1024 * 1024,  # bytes, of all files uncompressed
+    "entries": 20000,           # files
+}
+# Libraries whose scripts need no scope fixes. They are copied as they are,
+# without parsing or the opera.isReady() wrapper, see vendor_library().
+# globs: fnmatch patterns of package paths, hashes: the SHA-1 of a script to
+# the name of its library, from known_libraries.sha1 by default, banners:
+# (name, regular expression) pairs, see library_banners. Scripts matching
+# any of these are copied without scope fixes.
+vendor_libraries = {
+    "globs": [],
+    "hashes": {},
+    "banners": [],
+}
+# The name of a library and a regular expression matching a line of the
+# license comment its scripts start with, which covers all its releases.
+# Not used by default: a banner is also at the start of a library bundled
+# with other code, or of a plugin, which do need the fixes.
+library_banners = [
+    ("jQuery UI", r"jQuery UI\b"),
+    ("jQuery", r"jQuery (?:JavaScript Library )?v?\d+\.\d+"),
+    ("Prototype", r"Prototype JavaScript framework, version \d"),
+    ("script.aculo.us", r"script\.aculo\.us \w+\.js v?\d"),
+    ("MooTools", r"(?:MooTools\b|description: The (?:heart|core) of "
+                 r"MooTools)"),
+    ("Underscore", r"Underscore\.js \d"),
+    ("Backbone", r"Backbone\.js \d"),
+    ("Zepto", r"Zepto v?\d"),
+    ("json2", r"json2\.js\s"),
+]
+# Per script resource limits. Scripts going over any of these only get the
+# token level scope fixes from jstokens. A limit of None disables it.
+script_limits = {
+    "size": 1024 * 1024,  # characters
+    "parse_time": 60,     # seconds to parse and fix a script
+    "nodes": 500000,      # AST nodes
+}
+
+# Put between the inline scripts bundled into one file, to split them again
+# after the fixes. A statement, as comments do not survive the serializer.
+inline_boundary = u'"oex2nex:inline-script";'
 
 #Header for Chrome 24(?) compatible .crx package
 crxheader = "\x43\x72\x32\x34\x02\x00\x00\x00"
@@ -65,6 +140,93 @@ class InvalidPackage(Exception):
     pass
 
 
+class ScriptLimitExceeded(Exception):
+    """
+    Raised when a script goes over one of the per script resource limits.
+    """
+    def __init__(self, limit, maximum):
+        Exception.__init__(self, "%s limit of %s exceeded" % (limit, maximum))
+        self.limit = limit
+        self.maximum = maximum
+
+
+class _Deadline(object):
+    """
+    Context manager enforcing the parse_time limit. Where possible (POSIX,
+    main thread) a timer signal interrupts a long running parse, otherwise
+    the limit is only checked through check().
+    """
+    def __init__(self, seconds):
+        self._seconds = seconds
+        self._start = None
+        self._old_handler = None
+
+    def _expired(self, signum=None, frame=None):
+        raise ScriptLimitExceeded("parse_time", self._seconds)
+
+    def check(self):
+        if self._seconds and time.time() - self._start > self._seconds:
+            self._expired()
+
+    def __enter__(self):
+        self._start = time.time()
+        if (self._seconds and hasattr(signal, "setitimer")
+                and threading.current_thread().name == "MainThread"):
+            self._old_handler = signal.signal(signal.SIGALRM, self._expired)
+            signal.setitimer(signal.ITIMER_REAL, self._seconds)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._old_handler is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._old_handler)
+            self._old_handler = None
+        return False
+
+
+class _ScriptText(object):
+    """
+    The text of a script with the replacements of the walker applied. They
+    come in the order of their nodes, which is the order of their text, and
+    the new text of a node keeps the text of the nodes below it. So the
+    search for a replacement starts where the last one was made, and the
+    text before that is final. Text that is not found from there is
+    replaced throughout the whole script, as it used to be.
+    """
+    def __init__(self, text):
+        self._done = []
+        # pieces of text still to search as (text, start, end), the next
+        # one last, so nothing is copied until it is final
+        self._todo = [(text, 0, len(text))]
+
+    def replace(self, old, new):
+        """ Replaces the next old with new """
+        if not old:
+            return
+        for index in range(len(self._todo) - 1, -1, -1):
+            (text, start, end) = self._todo[index]
+            found = text.find(old, start, end)
+            if found >= 0:
+                break
+        else:
+            whole = self.text().replace(old, new)
+            self._done = []
+            self._todo = [(whole, 0, len(whole))]
+            return
+        for (text_before, start_before, end_before) in reversed(
+                self._todo[index + 1:]):
+            self._done.append(text_before[start_before:end_before])
+        del self._todo[index:]
+        self._done.append(text[start:found])
+        self._todo.append((text, found + len(old), end))
+        self._todo.append((new, 0, len(new)))
+
+    def text(self):
+        """ Returns the text with the replacements so far """
+        return "".join(self._done + [text[start:end] for (text, start, end)
+                                     in reversed(self._todo)])
+
+
 class Oex2Nex:
     """
     Converts an Opera extension packaged as .oex to an equivalent .nex file.
@@ -83,34 +245,101 @@ class Oex2Nex:
     - add manifest to .nex file
     - sign the .nex file if key is provided (also needs openssl installed)
     """
-    def __init__(self, in_file, out_file, key_file=None, out_dir=False):
+    def __init__(self, in_file, out_file, key_file=None, out_dir=False,
+                 limits=None, trim_shims=False, minify=False,
+                 bundle_inline=False, compress_level=6, jobs=None,
+                 reproducible=False, result_cache=None,
+                 package_limits=None, vendor=None, reset_peaks=False):
         if (in_file == None or out_file == None):
             raise ValueError("You should provide input file and output file")
 
         # in_file could also be a file-like object
+        self._in_dir = None
         if isinstance(in_file, basestring) and os.path.isdir(in_file):
-            # A directory is given, let us make a zipfile for our use
-            base = os.path.join(in_file, "")
-            if not os.path.exists(os.path.join(base, "config.xml")):
-                raise InvalidPackage("Did not find config.xml in the input "
-                        "directory " + base + ". Is this an Opera extension?")
+            # A directory is given, it is checked and zipped for our use by
+            # convert()
+            self._in_dir = in_file
             self._in_file = out_file + '-tmp.oex'
-            f_oex = zipfile.ZipFile(self._in_file, "w", zipfile.ZIP_STORED)
-            base = os.path.join(in_file, "")
-            for top, _dirns, fnames in os.walk(in_file):
-                for fname in fnames:
-                    rfn = os.path.join(top, fname)
-                    afn = rfn.split(base)[1]
-                    f_oex.write(rfn, afn)
         else:
             self._in_file = in_file
+        # out_file could also be a file-like object, see convert_package()
+        if out_dir and not isinstance(out_file, basestring):
+            raise ValueError("An output directory needs a path")
         self._out_file = out_file
         self._key_file = key_file
         self._out_dir = out_dir
         self._oex = None
         self._nex = None
+        # the output when it has to be stored in the result cache from memory
+        self._nex_buffer = None
         self._zih_file = None
+        self._limits = dict(script_limits)
+        if limits:
+            self._limits.update(limits)
+        self._package_limits = package_limits
+        # the rules for library scripts copied as they are, vendor updates
+        # the defaults from vendor_libraries
+        self._vendor = dict(vendor_libraries)
+        if vendor:
+            self._vendor.update(vendor)
+        self._trim_shims = trim_shims
+        self._minify = minify
+        self._bundle_inline = bundle_inline
+        # zlib level for the output entries (0 stores them) and the number of
+        # threads compressing them, see NexWriter
+        self._compress_level = compress_level
+        self._jobs = jobs
+        self._reproducible = reproducible
+        # a ResultCache with earlier conversions, or None
+        self._result_cache = result_cache
+        # the jsbackend parsing the scripts
+        self._js = jsbackend.get_backend()
+        self._shims = set()
+        self._transforms = {}
+        # whether _memoized keeps the transforms of the current file, only
+        # done for files that may have a copy in the package
+        self._keep_transforms = True
+        # whether the memory meter may reset the peak of the process, see
+        # MemoryMeter
+        self._reset_peaks = reset_peaks
+        self._meter = MemoryMeter(reset_peaks)
         self.warnings = []
+        self.stats = self._new_stats()
+        # manifest.json of the converted package, as a dict
+        self.manifest = None
+
+    def _new_stats(self):
+        """ Returns empty conversion statistics """
+        # files: number of package members per class (see classify())
+        # minify: sizes of the scripts and shims before and after minifying
+        # reused: transforms skipped because a file had the same content as
+        # an earlier one (see _memoized())
+        # cached: the package was taken from the result cache
+        # memory: kB used per stage and per file, see MemoryMeter
+        # seconds: time taken by the stages, and by parsing, fixing and
+        # scanning scripts and by the rest of the work on HTML pages
+        # skipped: library scripts copied as they are, by file name, with
+        # the library (see vendor_library())
+        return {"files": {}, "parse_failures": 0,
+                "minify": {"before": 0, "after": 0}, "reused": 0,
+                "cached": False, "memory": {}, "seconds": {}, "skipped": {}}
+
+    def _memoized(self, key, transform, *args):
+        """ Returns transform(*args), computed only once per package for each
+        key. The key is the kind of transform and the content hash of the
+        file, so identical files (e.g. in locales/*/) share the result. Side
+        effects of the transform, like writing inline scripts or adding
+        permissions, are the same for the same input and are not repeated.
+        Results are only kept while _keep_transforms is set, so the output of
+        files without a copy is freed once it is written
+        """
+        if key in self._transforms:
+            self.stats["reused"] += 1
+            return self._transforms[key]
+        result = transform(*args)
+        if self._keep_transforms:
+            self._transforms[key] = result
+        return result
 
     def readoex(self):
         """
@@ -121,11 +350,15 @@ class Oex2Nex:
             print('Reading oex file.')
         try:
             oex = zipfile.ZipFile(self._in_file, "r")
-            if self._out_dir:
-                nex = zipfile.ZipFile(self._out_file + '.nex', "w",
-                                      zipfile.ZIP_DEFLATED)
+            if self._nex_buffer is not None:
+                nex = NexWriter(self._nex_buffer, self._compress_level,
+                                self._jobs, self._reproducible)
+            elif self._out_dir:
+                nex = NexWriter(self._out_file + '.nex', self._compress_level,
+                                self._jobs, self._reproducible)
             else:
-                nex = zipfile.ZipFile(self._out_file, "w", zipfile.ZIP_DEFLATED)
+                nex = NexWriter(self._out_file, self._compress_level,
+                                self._jobs, self._reproducible)
         except Exception as e:
             raise IOError("Unable to read/write the input files.\n"
                 "Error was: " + str(e))
@@ -134,6 +367,21 @@ class Oex2Nex:
         if debug:
             print(('Oex:', oex, ", Nex:", nex))
 
+    def _zip_directory(self):
+        """ Writes the files of the input directory to the package read by
+        readoex() """
+        f_oex = zipfile.ZipFile(self._in_file, "w", zipfile.ZIP_STORED)
+        base = os.path.join(self._in_dir, "")
+        for top, dirns, fnames in os.walk(self._in_dir):
+            # walk in a fixed order, so the package does not depend on
+            # the order of the directory entries
+            dirns.sort()
+            for fname in sorted(fnames):
+                rfn = os.path.join(top, fname)
+                afn = rfn.split(base)[1]
+                f_oex.write(rfn, afn)
+        f_oex.close()
+
     def _add_permission(self, *perms):
         """Adds a permission (or multiple) to the permission list."""
         for perm in perms:
@@ -143,43 +391,22 @@ class Oex2Nex:
                 permissions.extend(perm)
 
     def _get_permissions(self):
-        """ Serializes permissions list to be appended to manifest.json """
-        # "uniquify" permissions (as multiple perms may get in)
+        """ Returns the permissions list for manifest.json """
+        # "uniquify" permissions (as multiple perms may get in), sorted so
+        # the manifest does not depend on the set order
         def uniquify(lst):
             st = set(lst)
-            return list(st)
-        return ", ".join('"' + perm + '"' for perm in uniquify(permissions))
+            return sorted(st)
+        return uniquify(permissions)
 
     def _merge_features(self, featurenames):
         """
         Merge the permissions associated with the featurenames list into
         the permissions list
         """
-        feature_map = {
-            "opera:contextmenus":  "contextMenus",
-            "opera:share-cookies": "cookies"
-        }
         for feature in featurenames:
-            if feature in feature_map:
-                permissions.append(feature_map[feature])
-
-    def _normalize_version(self, version):
-        """Attemps to clean up existing config.xml @version values and
-        validate them against the CRX requirements (1-4 dot-separated integers
-        each between 0 and 65536). If that fails, returns '1.0.0.1'
-        """
-        # in case a stray None (or whatever) makes it in
-        version = str(version)
-        version = re.sub(r'[^\d\.]+', '.', version)
-        version = version.strip('.')
-        valid_version = re.match(r"^(([0-9]|[1-9][0-9]{1,3}|[1-5][0-9]{4}|"
-                                 "6[0-4][0-9]{3}|65[0-4][0-9]{2}|655[0-2]"
-                                 "[0-9]|6553[0-6])\.){0,3}([0-9]|[1-9][0-9]"
-                                 "{1,3}|[1-5][0-9]{4}|6[0-4][0-9]{3}|65[0-4]"
-                                 "[0-9]{2}|655[0-2][0-9]|6553[0-6])$", version)
-        if not valid_version:
-            version = "1.0.0.1"
-        return version
+            if feature in feature_permissions:
+                permissions.append(feature_permissions[feature])
 
     def _convert(self):
         """
@@ -191,175 +418,40 @@ class Oex2Nex:
         # parse config.xml to generate the suitable manifest entries
         oex = self._oex
         nex = self._nex
-        try:
-            # Also a quick sanity check for Opera extension format
-            configStr = unicoder(oex.read("config.xml"))
-        except KeyError as kex:
-            raise InvalidPackage("Is the input file a valid Opera extension? "
-                    "We did not find a config.xml inside.\nException was:"
-                    + str(kex))
-        except UnicodingError, e:
-            raise InvalidPackage("config.xml has an unknown encoding.")
-
-        if debug:
-            print(("Config.xml", configStr))
-        try:
-            # xml.etree requires UTF-8 input
-            root = etree.fromstring(configStr.encode('UTF-8'))
-        except ParseError, e:
-            raise InvalidPackage('Parsing config.xml failed '
-                    'with the following error: %s' % e.message)
-        #TODO: Handle localisation (xml:lang), defaultLocale, locales folder
-        # etc.
-
-        def _get_best_elem(_xmltree, tag):
-            """
-            Find and return default or English tag's content when config.xml
-            has same tag with different xml:lang
-            """
-
-            elems = root.findall("{http://www.w3.org/ns/widgets}" + tag)
-            rval = ""
-            # Use some 'en' value of the text content if the element is
-            # localised
-            for it in elems:
-                try:
-                    lang = it.attrib[
-                            '{http://www.w3.org/XML/1998/namespace}lang']
-                    if not rval or ((lang is not None) and ("en" in lang)):
-                        rval = it.text
-                except KeyError:
-                    if it is not None:
-                        rval = it.text
-                    break
-            if not rval:
-                rval = "No " + tag + " found in config.xml."
-            elif not isinstance(rval, unicode):
-                try:
-                    rval = unicoder(rval)
-                except UnicodingError:
-                    pass
-            else:
-                rval = rval.encode("utf-8")
-
-            return rval
-
-        name = _get_best_elem(root, "name")
-
-        if "version" in root.attrib:
-            version = self._normalize_version(root.attrib["version"])
-        else:
-            version = "1.0.0.1"
-
-        description = _get_best_elem(root, "description")
-        accesslist = root.findall("{http://www.w3.org/ns/widgets}access")
-        accessorigins = []
-        for acs in accesslist:
-            if "subdomains" in acs.attrib:
-                accessorigins.append([acs.attrib["origin"],
-                        acs.attrib["subdomains"]])
-            else:
-                accessorigins.append([acs.attrib["origin"], "false"])
-        if debug:
-            print(("Access origins:", accessorigins))
-
-        ### Handle feature elements
-
-        has_features = False
-        featurelist = root.findall("{http://www.w3.org/ns/widgets}feature")
-        featurenames = []
-        sd_url = ""
-        is_speeddial_extension = False
-
-        for feat in featurelist:
-
-            featurenames.append(feat.attrib["name"])
-
-            if feat.attrib["name"].lower() == "opera:speeddial":
-
-                param = feat.find("{http://www.w3.org/ns/widgets}param")
-
-                if param is not None and "value" in param.attrib:
-                    sd_url = param.attrib["value"]
-                    is_speeddial_extension = True
-
-                    if debug:
-                        print('Speeddial URL: ', sd_url)
-                else:
-                    self.warnings.append(
-                            "Invalid speed dial extension. "
-                            "feature element lacks param element or URL.")
-
-        if len(featurenames):
-            has_features = True
-
+        meter = self._meter
+        before = meter.sample()
+        config = parse_config(oex)
+        meter.add_stage("config", before)
+        self.warnings.extend(config["warnings"])
+        name = config["name"]
+        version = config["version"]
+        description = config["description"]
+        featurenames = config["features"]
+        has_features = bool(featurenames)
+        sd_url = config["speeddial"]
+        is_speeddial_extension = sd_url is not None
+        prefstore = config["preferences"]
+        indexfile = config["index"]
+        iconstore = config["icons"]
+        has_icons = bool(iconstore)
         if debug:
+            print(("Access origins:", config["access"]))
             print(("Feature names: ", featurenames))
-
-        # Store preference data and add them to the index doc using a script
-        prefstore = {}
-        prefnodes = root.findall("{http://www.w3.org/ns/widgets}preference")
-        for pref in prefnodes:
-            if "name" in pref.attrib:
-                prefstore[pref.attrib["name"]] = pref.attrib["value"]
-        if debug:
             print(("Preferences: ", prefstore))
-        indexfile = indexdoc
-        content = root.find("{http://www.w3.org/ns/widgets}content")
-        if content is not None:
-            if "src" in content.attrib:
-                indexfile = content.attrib["src"]
-        has_icons = False
-        icon_elms = root.findall("{http://www.w3.org/ns/widgets}icon")
-        iconlist = []
-        # If there's more than one icon, try to be smart about what to include
-        if len(icon_elms) > 1:
-            for icon in icon_elms:
-                w = icon.attrib.get("width")
-                src = icon.attrib.get("src")
-                if w in ["16", "48", "128"]:
-                    if src:
-                        has_icons = True
-                        iconlist.append((w, src))
-                elif re.search(r"16|48|128", src):
-                    m = re.search(r"16|48|128", src)
-                    w = m.group(0)
-                    if src:
-                        has_icons = True
-                        iconlist.append((w, src))
-                # else take one of whatever else is left
-                elif src:
-                    has_icons = True
-                    iconlist.append(("128", src))
-                    continue
-        # Otherwise just grab the only icon
-        elif len(icon_elms) == 1:
-            src = icon_elms[0].attrib.get("src")
-            if src:
-                has_icons = True
-                iconlist.append(("128", src))
-        iconstore = dict((size, name) for (size, name) in iconlist)
-        if debug:
             print("Icon files: ", iconstore)
         shim_wrap = self._shim_wrap
         # parsing includes and excludes from the included scripts
-        includes = []
-        excludes = []
         injscrlist = []
-        inj_scripts = ""
-        matches = ""
-        discards = ""
         has_popup = False
         has_option = False
         has_injscrs = False
         has_author = False
-        resources = ""
+        manifest = Manifest()
         zf_members = oex.namelist()
+        member_set = set(zf_members)
         # default_locale should be set in manifest.json *only* if there is a
         # corresponding _locales/foo folder in the input
-        default_locale = None
-        if "defaultlocale" in root.attrib:
-            default_locale = root.attrib["defaultlocale"]
+        default_locale = config["default_locale"]
         # not None or empty string
         if default_locale:
             if debug:
@@ -368,36 +460,57 @@ class Oex2Nex:
             # we should probably copy over the file from locales to _locales
             # and use the default_locale entry
             if ('_locales/' + default_locale + '/messages.json'
-                    not in zf_members):
+                    not in member_set):
                 if debug:
                     print('no _locales/' + default_locale +
                             '/messages.json in source zip file, '
                             'ignoring default locale')
                 default_locale = ''
-        author_elm = root.find("{http://www.w3.org/ns/widgets}author")
-        if author_elm is not None:
-            if author_elm.text:
-                author_name = author_elm.text
-                author_url = author_elm.attrib.get("href", "")
-                has_author = True
+        if config["author"] is not None:
+            has_author = True
+            author_name = config["author"]["name"]
+            author_url = config["author"]["url"]
         if has_author and debug:
             print("Author name: ", author_name)
             print("Author URL: ", author_url)
 
+        # members with the same CRC and size as another one, the only ones
+        # that can share transforms
+        sizes = {}
+        for info in oex.infolist():
+            sizes[(info.CRC, info.file_size)] = sizes.get(
+                    (info.CRC, info.file_size), 0) + 1
+        stage_before = meter.sample()
         for filename in zf_members:
             # dropping the _locales content if default_locale is not defined
             if not default_locale and filename.startswith("_locales/"):
                 continue
             if debug:
                 print("Handling file: %s" % filename)
-            if re.search(r"\.(x?html?|js|json)$", filename, flags=re.I):
+            before = meter.sample()
+            info = oex.getinfo(filename)
+            self._keep_transforms = sizes[(info.CRC, info.file_size)] > 1
+            file_data = oex.read(filename)
+            file_class = classify(filename, file_data)
+            self.stats["files"][file_class] = (
+                    self.stats["files"].get(file_class, 0) + 1)
+            # locale variants often have the very same content, it is only
+            # transformed once and the result reused for the other copies
+            digest = hashlib.sha1(file_data).hexdigest()
+            # known libraries are copied as they are
+            library = None
+            if file_class in (FILE_JS, FILE_USERSCRIPT):
+                library = vendor_library(filename, file_data, self._vendor,
+                                         digest)
+                if library is not None:
+                    self.stats["skipped"][filename] = library
+            if file_class in text_classes and library is None:
                 try:
-                    file_data = unicoder(oex.read(filename))
+                    file_data = self._memoized(("unicode", digest), unicoder,
+                                               file_data)
                 except UnicodingError:
                     raise InvalidPackage("The file %s has an unknown encoding."
                             % filename)
-            else:
-                file_data = oex.read(filename)
 
             self._zih_file = filename
             # for the background process file (most likely index.html)
@@ -411,51 +524,45 @@ class Oex2Nex:
                 # file and wrapped in an opera.isReady() function. Also this
                 # new file needs to be put in the indexdoc as a script and
                 # others removed
-                file_data = shim_wrap(file_data, "index", prefstore)
+                file_data = self._memoized(("index", digest), shim_wrap,
+                                           file_data, "index", prefstore)
             elif filename == popupdoc:
                 # same as with indexdoc
                 has_popup = True
-                file_data = shim_wrap(file_data, "popup")
+                file_data = self._memoized(("popup", digest), shim_wrap,
+                                           file_data, "popup")
             elif filename == optionsdoc:
                 has_option = True
-                file_data = shim_wrap(file_data, "option")
-            elif filename.find("includes/") == 0 and filename.endswith(".js"):
+                file_data = self._memoized(("option", digest), shim_wrap,
+                                           file_data, "option")
+            elif file_class == FILE_USERSCRIPT:
                 has_injscrs = True
                 f_includes = []
                 f_excludes = []
-                # add individual file names to the content_scripts value
-                inj_scripts += ('"' + filename + '",')
                 if debug:
                     print(('Included script:', filename))
-                pos = file_data.find("==/UserScript==")
-                if pos != -1:
-                    ijsProlog = file_data[:pos]
-                    if debug:
-                        print(("user script prolog: ", ijsProlog))
-                    lines = ijsProlog.split("\n")
-                    for line in lines:
-                        ipos = line.find("@include ")
-                        if ipos != -1:
-                            includes.append((line[ipos + 9:]).strip())
-                            f_includes.append((line[ipos + 9:]).strip())
-                        epos = line.find("@exclude ")
-                        if epos != -1:
-                            excludes.append((line[epos + 9:]).strip())
-                            f_excludes.append((line[epos + 9:]).strip())
+                metadata = parse_metadata(file_data)
+                if metadata is not None:
+                    f_includes = [g for g in metadata["include"] if g]
+                    f_excludes = [g for g in metadata["exclude"] if g]
                     if debug:
-                        print(("Includes: ", includes,
-                               " Excludes: ", excludes))
+                        print(("Includes: ", f_includes,
+                               " Excludes: ", f_excludes))
                 if not len(f_includes):
                     # uses glob pattern not match pattern (<all_urls>)
                     f_includes = ["*"]
                 injscrlist.append({"file": filename, "includes": f_includes,
                         "excludes": f_excludes})
-                is_json = False
-                (file_data, is_json) = self._update_scopes(file_data)
-                if not is_json:
-                    file_data = ("opera.isReady(function(){\n"
-                            + file_data + "\n});\n")
-            elif filename.endswith(".js"):
+                if library is None:
+                    (file_data, is_json) = self._memoized(
+                            ("scopes", file_class, digest),
+                            self._update_scopes, file_data, file_class)
+                    if not is_json:
+                        file_data = ("opera.isReady(function(){\n"
+                                + file_data + "\n});\n")
+            elif library is None and (file_class == FILE_JS
+                    or (file_class == FILE_JSON
+                        and re.search(r"\.js$", filename, flags=re.I))):
                 # do we actually *need* to make sure it's a Unicode string and
                 # not a set of UTF-bytes at this point? AFAIK we don't - as
                 # long as we're only appending ASCII characters, Python doesn't
@@ -468,18 +575,21 @@ class Oex2Nex:
                 # Important: ONLY ASCII in these strings, please..
                 # If script parsing failed, leave it alone
                 is_json = False
-                (file_data, is_json) = self._update_scopes(file_data)
+                (file_data, is_json) = self._memoized(
+                        ("scopes", file_class, digest),
+                        self._update_scopes, file_data, file_class)
                 if not is_json:
                     file_data = ("opera.isReady(function(){\n"
                             + file_data + "\n});\n")
-            elif re.search(r'\.x?html?$', filename, flags=re.I):
+            elif file_class == FILE_HTML:
                 if debug:
                     print("Adding shim for any page to file %s." % filename)
-                file_data = shim_wrap(file_data, "")
+                file_data = self._memoized(("page", digest), shim_wrap,
+                                           file_data, "")
 
             # Web accessible resources list
             if filename not in ["config.xml", indexdoc, popupdoc, optionsdoc]:
-                resources += ('"' + filename + '",')
+                manifest.add_resource(filename)
 
             if (filename != "config.xml"):
                 # Copy files from locales/en/ to root of the .nex package
@@ -489,7 +599,7 @@ class Oex2Nex:
                     noloc_filename = re.sub(r'^locales/en[a-zA-Z-]{0,2}/', '',
                             filename, count=1)
                     if (noloc_filename != filename
-                            and not (noloc_filename in zf_members)):
+                            and not (noloc_filename in member_set)):
                         do_copy = True
 
                 if noloc_filename and do_copy:
@@ -497,114 +607,76 @@ class Oex2Nex:
                         print("Copying a localised file : "
                               "%s to the root of package as : %s" % (
                                     filename, noloc_filename))
-                try:
-                    nex.writestr(filename, file_data)
-                    if noloc_filename and do_copy:
-                        nex.writestr(noloc_filename, file_data)
-                except UnicodeEncodeError:
-                    nex.writestr(filename, file_data.encode("utf-8"))
-                    if noloc_filename and do_copy:
-                        nex.writestr(noloc_filename, file_data.encode("utf-8"))
+                if isinstance(file_data, unicode):
+                    file_data = file_data.encode("utf-8")
+                nex.writestr(filename, file_data)
+                if noloc_filename and do_copy:
+                    nex.writestr(noloc_filename, file_data)
+            file_data = None
+            meter.add_file(filename, before)
+        meter.add_stage("files", stage_before)
+        self._transforms = {}
 
         if has_injscrs:
             if debug:
                 print('Has injected scripts')
             # add injected script shim if we have any includes or excludes
-            try:
-                nex.getinfo(oex_injscr_shim)
-            except KeyError:
-                injfh = open(os.path.join(shim_fs_path, oex_injscr_shim), 'r')
-                if injfh:
-                    inj_data = injfh.read()
-                    nex.writestr(oex_injscr_shim, inj_data)
-                    injfh.close()
-                else:
-                    self.warnings.append("Could not open " + oex_injscr_shim)
-
-            inj_scripts = '"' + oex_injscr_shim + '", ' + inj_scripts
+            self._shims.add(oex_injscr_shim)
 
-            for s in includes:
-                # double-quoted string
-                matches = matches + '"' + s + '",'
-            for s in excludes:
-                # double-quoted string
-                discards = discards + '"' + s + '",'
-
-            inj_scripts = inj_scripts[:-1]
-            matches = matches[:-1]
-            discards = discards[:-1]
-            if debug:
-                print(("Injected scripts:" + inj_scripts))
-            if not matches:
-                # match any page
-                matches = '"<all_urls>"'
-
-        jenc = json.JSONEncoder(ensure_ascii=False)
-        description = jenc.encode(description).decode('utf-8')
-        name = jenc.encode(name).decode('utf-8')
-        icon_files = jenc.encode(iconstore)
-
-        manifest = '{\n"name": ' + name
+        manifest["name"] = name
         if has_author:
-            manifest += ',\n"developer": {"name" : "' + author_name + '", '
-            manifest += '"url" : "' + author_url + '"}'
-        manifest += ',\n"description" : ' + description
-        manifest += ',\n"manifest_version" : 2,\n"version" : "' + version
-        manifest += '",\n"background" : {"page" : "' + indexfile + '"}'
+            manifest["developer"] = {"name": author_name, "url": author_url}
+        manifest["description"] = description
+        manifest["version"] = version
+        manifest["background"] = {"page": indexfile}
         if has_icons:
-            manifest += ',\n"icons" : ' + icon_files
+            manifest["icons"] = iconstore
         # An extension cannot have both speeddial and browser_action
         if not is_speeddial_extension:
-            if has_popup:
+            if has_popup or has_button:
                 # Let the APIs do their job  #"default_popup" : "popup.html"}'
-                manifest += ',\n"browser_action" : {}'
-            if has_button and not has_popup:
-                manifest += ',\n"browser_action" : {}'
+                manifest["browser_action"] = {}
         if has_option:
-            manifest += ',\n"options_page" : "options.html"'
+            manifest["options_page"] = "options.html"
         # default_locale should be set in manifest.json *only* if there is a
         # corresponding _locales/foo folder in the input
         if default_locale:
-            manifest += ',\n"default_locale" : "' + default_locale + '"'
+            manifest["default_locale"] = default_locale
         if has_injscrs:
-            # create separate entries for all injected scripts
-            content_scripts = ""
-            for cs in injscrlist:
-                content_scripts += ('\n{"js": ["' + oex_injscr_shim + '", '
-                        + jenc.encode(cs["file"])
-                        + '], "matches": ["<all_urls>"], "include_globs": '
-                        + jenc.encode(cs["includes"])
-                        + ', "exclude_globs": '
-                        + jenc.encode(cs["excludes"])
-                        + ', "run_at": "document_start", "all_frames" : true},'
-                )
-            content_scripts = content_scripts[:-1]
-            manifest += ',\n"content_scripts": [' + content_scripts + ']'
-
-        # add web_accessible_resources
-        # all files except the following: manifest.json, indexdoc, popupdoc,
-        # optionsdoc, anything else?
-        if resources:
-            resources = resources[:-1]
+            # one entry per run of scripts with the same globs, so the shim
+            # is only evaluated once for them
+            for cs in group_content_scripts(injscrlist):
+                (cs_matches, cs_globs) = content_script_matches(cs["includes"])
+                manifest.add_content_script([oex_injscr_shim] + cs["files"],
+                        cs_matches, cs_globs, cs["excludes"])
             if debug:
-                print(("Loadable resources:", resources))
-            manifest += ',\n"web_accessible_resources" : [' + resources + ']'
+                print(("Injected scripts:", manifest.content_scripts))
+
+        # web_accessible_resources are all files except the following:
+        # manifest.json, indexdoc, popupdoc, optionsdoc, anything else?
+        if debug and manifest.resources:
+            print(("Loadable resources:", manifest.resources))
 
         # if we have features, merge those into the permissions list
         if has_features:
             self._merge_features(featurenames)
 
-        manifest += ',\n"permissions" : [' + self._get_permissions() + ']'
+        manifest["permissions"] = self._get_permissions()
         if is_speeddial_extension:
-            manifest += ',\n"speeddial" : {"url": "' + sd_url + '"}'
-        manifest += ',\n"content_security_policy": '
-        manifest += '"script-src \'self\' \'unsafe-eval\';'
-        manifest += ' object-src \'unsafe-eval\';"'
-        manifest += '\n}\n'
+            manifest["speeddial"] = {"url": sd_url}
+        manifest["content_security_policy"] = ("script-src 'self' "
+                "'unsafe-eval'; object-src 'unsafe-eval';")
 
         if debug:
             print(("Manifest: ", manifest))
-        nex.writestr("manifest.json", manifest.encode('utf-8'))
+        self.manifest = manifest.to_dict()
+        nex.writestr("manifest.json", manifest.to_json().encode('utf-8'))
+        has_browser_action = not is_speeddial_extension and (has_popup
+                                                             or has_button)
+        before = meter.sample()
+        self._write_shims(shims.modules_for_manifest(permissions,
+                has_browser_action, is_speeddial_extension))
+        meter.add_stage("shims", before)
         if debug:
             print("Adding resource_loader files")
         nex.writestr(oex_resource_loader + ".html", """<!DOCTYPE html>
@@ -628,37 +700,69 @@ class Oex2Nex:
  if(h !== "") { document.body.style.minHeight = h.replace(/\D/g,'') + "px"; }
 """)
 
-    def _update_scopes(self, scriptdata):
+    def _update_scopes(self, scriptdata, file_class=None):
         """ Attempt to parse the script text and do some variable scoping fixes
-        so that the scripts used in the oex work with the shim """
+        so that the scripts used in the oex work with the shim. Scripts over
+        one of the resource limits only get the token level fixes. Data
+        classified as FILE_JSON is only checked with the JSON parser and left
+        as it is. """
+        if file_class is None and looks_like_json(scriptdata):
+            file_class = FILE_JSON
+        if file_class == FILE_JSON:
+            try:
+                json.loads(scriptdata)
+                return (scriptdata, True)
+            except ValueError:
+                # Not JSON after all, e.g. [a, b].forEach(...)
+                pass
+        try:
+            return self._update_scopes_ast(scriptdata)
+        except ScriptLimitExceeded as e:
+            self.warnings.append("Script exceeds the %s limit of %s. Only "
+                    "top level declarations were fixed, this script might "
+                    "need manual fixing and permissions might be missing."
+                    "\nFile: %s\n" % (e.limit, e.maximum, self._zih_file))
+            return (export_globals(scriptdata), False)
+
+    def _update_scopes_ast(self, scriptdata):
+        """ Does the work for _update_scopes with the full JS parser. Raises
+        ScriptLimitExceeded when the script goes over a resource limit """
+        limits = self._limits
+        if limits.get("size") and len(scriptdata) > limits["size"]:
+            raise ScriptLimitExceeded("size", limits["size"])
+        with _Deadline(limits.get("parse_time")) as deadline:
+            result = self._fix_script(scriptdata, deadline)
+            deadline.check()
+        return result
+
+    def _fix_script(self, scriptdata, deadline):
+        """ Parses the script, applies the ASTWalker fixes and looks for
+        permissions. Returns a tuple of the fixed script and is_json """
         is_json = False
+        meter = self._meter
+        start = time.time()
         try:
-            jstree = JSParser().parse(scriptdata)
+            jstree = self._js.parse(scriptdata)
         except SyntaxError:
-            try:
-                jstree = JSParser().parse(str(scriptdata, 'UTF-8'))
-            except Exception:
-                try:
-                    # Attempt to load as JSON
-                    json.loads(scriptdata)
-                    is_json = True
-                    return (scriptdata, is_json)
-                except:
-                    self.warnings.append("Script parsing failed. "
-                            "This script might need manual fixing."
-                            "\nFile: %s\n" % self._zih_file)
-                    return (scriptdata, is_json)
-
-        walker = ASTWalker(debug)
-        aliases = {
-            "window": ["window"],
-            "opera": ["opera", "window.opera"],
-            "widget": ["widget", "window.widget"],
-            "extension": ["opera.extension"],
-            "preferences": ["widget.preferences", "window.widget.preferences"],
-        }
-        scriptdata = jstree.to_ecma()
-        for rval in walker._get_replacements(jstree, aliases):
+            self.stats["parse_failures"] += 1
+            self.warnings.append("Script parsing failed. "
+                    "This script might need manual fixing."
+                    "\nFile: %s\n" % self._zih_file)
+            return (scriptdata, is_json)
+        finally:
+            meter.add_time("parse", start)
+
+        start = time.time()
+        walker = ASTWalker(debug, self._minify, self._js)
+        max_nodes = self._limits.get("nodes")
+        if max_nodes and walker.count_nodes(jstree, max_nodes) > max_nodes:
+            raise ScriptLimitExceeded("nodes", max_nodes)
+        source = scriptdata
+        scriptdata = walker.to_ecma(jstree)
+        fixed = _ScriptText(scriptdata)
+        for rval in walker._get_replacements(jstree,
+                AliasTable(backend=self._js)):
+            deadline.check()
             # if debug: print(('walker ret:', rval))
             if (isinstance(rval, list) and rval != []
                     and isinstance(rval[0], dict)):
@@ -670,38 +774,73 @@ class Oex2Nex:
             try:
                 for key in rdict:
                     if 'text' in rdict[key] and 'textnew' in rdict[key]:
-						# NOTE: replaces throughout the script text; so be
-						# specific in what we feed this
-                        scriptdata = scriptdata.replace(rdict[key]['text'],
+                        # NOTE: replaces the first match after the last
+                        # replacement; so be specific in what we feed this
+                        fixed.replace(rdict[key]['text'],
                                 rdict[key]['textnew'])
             except Exception as e:
                 warning = "Exception while fixing script: %s %s %s" % (
-                        e, key, scriptdata)
+                        e, key, fixed.text())
                 self.warnings.append(warning)
-
-        # defining this in here so we can share the jstree and walker instances
-        def find_permissions(tree):
-            """Looks for possible permissions to be added to manifest.json"""
-            # XXX The tree param is unused. For future extension? -hanst
-            self._add_permission(walker.find_apicall(jstree, 'create',
-                                                             'getAll',
-                                                             'getFocused',
-                                                             'getSelected',
-                                                             'getFocused'))
-            self._add_permission(walker.find_apicall(jstree, 'add', 'remove'))
-
-        find_permissions(jstree)
+        scriptdata = fixed.text()
+        meter.add_time("fix", start)
+
+        start = time.time()
+        # look for possible permissions to be added to manifest.json
+        self._add_permission(walker.find_apicall(jstree, 'create', 'getAll',
+                                                 'getFocused', 'getSelected'))
+        self._add_permission(walker.find_apicall(jstree, 'add', 'remove'))
         if walker.find_button(jstree):
             global has_button
             has_button = True
+        # the tree is often many times the size of the script, free it before
+        # the caller goes on with the text
+        jstree = walker = rval = rdict = fixed = None
+        meter.add_time("scan", start)
+        if self._minify:
+            self._count_minified(source, scriptdata)
         return (scriptdata, is_json)
 
     def convert(self):
         """ Public method which does the real work """
 
         self.warnings = []
+        self.stats = self._new_stats()
+        self.manifest = None
+        self._shims = set()
+        self._transforms = {}
+        self._meter = MemoryMeter(self._reset_peaks)
+        # permissions and has_button are module level, start afresh so a
+        # process can convert more than one package
+        global has_button
+        permissions[:] = default_permissions
+        has_button = False
+        # invalid packages are turned down before any output is written, a
+        # directory before it is zipped
+        if self._in_dir is not None:
+            check_package(self._in_dir, self._package_limits)
+            self._zip_directory()
+        else:
+            check_package(self._in_file, self._package_limits)
+        cache_key = None
+        self._nex_buffer = None
+        if (self._result_cache is not None
+                and isinstance(self._in_file, basestring)):
+            cache_key = self._result_cache.key(self._in_file,
+                                               self._cache_options())
+            if self._restore_cached(cache_key):
+                if self._key_file:
+                    self.signnex()
+                return
+            if not isinstance(self._out_file, basestring):
+                # the package is written to the stream and stored from
+                # a buffer, the stream may not be readable
+                self._nex_buffer = BytesIO()
+        before = self._meter.sample()
         self.readoex()
+        self._meter.add_stage("read", before)
         self._convert()
+        before = self._meter.sample()
         # extract file to the specified directory
         if self._out_dir:
             if debug:
@@ -720,10 +859,69 @@ class Oex2Nex:
         # the full data!
         self._oex.close()
         self._nex.close()
-
+        self._meter.add_stage("write", before)
+        self.stats["memory"] = self._meter.report()
+        self.stats["seconds"] = self._meter.seconds
+
+        if cache_key is not None:
+            nex_file = self._nex_file()
+            if self._nex_buffer is not None:
+                nex_file = self._nex_buffer
+                self._out_file.write(nex_file.getvalue())
+                nex_file.seek(0)
+            self._result_cache.put(cache_key, nex_file,
+                    {"warnings": self.warnings, "stats": self.stats,
+                     "manifest": self.manifest})
         if self._key_file:
             self.signnex()
 
+    def _nex_file(self):
+        """ Returns the path of the .nex package written """
+        if self._out_dir:
+            return self._out_file + '.nex'
+        return self._out_file
+
+    def _cache_options(self):
+        """ Returns the options that change the output, for the result cache
+        key """
+        return {"limits": self._limits, "trim_shims": self._trim_shims,
+                "minify": self._minify, "bundle_inline": self._bundle_inline,
+                "compress_level": self._compress_level,
+                "reproducible": self._reproducible,
+                "vendor": self._vendor}
+
+    def _restore_cached(self, key):
+        """ Writes the cached result for key as the output and takes its
+        warnings and stats. Returns False if there is no cached result """
+        cached = self._result_cache.get(key)
+        if cached is None:
+            return False
+        (nex_path, meta) = cached
+        try:
+            if not isinstance(self._out_file, basestring):
+                # read in full first, a failure leaves the stream untouched
+                fh = open(nex_path, "rb")
+                try:
+                    nexdata = fh.read()
+                finally:
+                    fh.close()
+                self._out_file.write(nexdata)
+            else:
+                shutil.copyfile(nex_path, self._nex_file())
+            if self._out_dir:
+                nex = zipfile.ZipFile(self._nex_file(), "r")
+                nex.extractall(self._out_file)
+                nex.close()
+        except (IOError, OSError, zipfile.BadZipfile) as e:
+            if debug:
+                print(("Could not use the cached result:", e))
+            return False
+        self.warnings = meta["warnings"]
+        self.stats = meta["stats"]
+        self.manifest = meta["manifest"]
+        self.stats["cached"] = True
+        return True
+
     def _shim_wrap(self, html, file_type=u"index", prefs=None):
         """
         Applies certain corrections to the HTML source passed to this method.
@@ -736,12 +934,15 @@ class Oex2Nex:
         serializer = html5lib.serializer.HTMLSerializer(
                 omit_optional_tags=False, quote_attr_values=True,
                 strip_whitespace=True, use_trailing_solidus=True)
+        # the time taken by the page, without the scripts fixed in it
+        meter = self._meter
+        start = time.time()
+        scripts = sum(meter.seconds.get(stage, 0)
+                      for stage in ("parse", "fix", "scan"))
         doc = htmlparser.parse(html)
-        inlinescrdata = u""
         nex = self._nex
         # FIXME: use the correct base for the @src (mostly this is the root
         # [''])
-        # Remove scripts only if we are merging all of them
 
         def add_dom_prefs(doc, prefs):
             """ Add an external script with the data taken from preference
@@ -749,21 +950,31 @@ class Oex2Nex:
             script src"""
             if isinstance(prefs, dict):
                 pref_str = ""
-                jenc = json.JSONEncoder(ensure_ascii=False)
-                for key in prefs:
-                    cur_pref_val = jenc.encode(prefs[key]).decode('utf-8')
-                    cur_pref = jenc.encode(key).decode('utf-8')
-                    pref_str += ('widget.preferences.setItem(' + cur_pref + ', '
-                            + cur_pref_val + ');\n')
+                if prefs:
+                    # All defaults go to the shim in one go; setItems saves
+                    # them with a single message to the other extension
+                    # pages instead of one per preference. Shims without
+                    # setItems get them one by one.
+                    jenc = json.JSONEncoder(ensure_ascii=False,
+                                            sort_keys=True)
+                    defaults = jenc.encode(prefs)
+                    if not isinstance(defaults, unicode):
+                        defaults = defaults.decode('utf-8')
+                    pref_str = ('(function(prefs, defaults) {\n'
+                            'if (prefs.getItem('
+                            '"_OPERA_INTERNAL_defaultPrefsSet")) {\n'
+                            'return;\n}\n'
+                            'defaults["_OPERA_INTERNAL_defaultPrefsSet"] = '
+                            'true;\n'
+                            'if (prefs.setItems) {\n'
+                            'prefs.setItems(defaults);\n'
+                            '} else {\n'
+                            'for (var key in defaults) {\n'
+                            'prefs.setItem(key, defaults[key]);\n}\n}\n'
+                            '})(widget.preferences, %s);\n') % defaults
                 if debug:
                     print("Preferences stringified: " + pref_str)
                 if pref_str:
-
-                    pref_str = ('if (!widget.preferences.getItem('
-                             '"_OPERA_INTERNAL_defaultPrefsSet"))'
-                             '{\n%s}\nwidget.preferences.setItem('
-                             '"_OPERA_INTERNAL_defaultPrefsSet", true);\n') % (
-                            pref_str)
                     p_scr = doc.createElementNS(u"http://www.w3.org/1999/xhtml", u"script")
                     p_scr_src = u"exported_prefs.js"
                     p_scr.setAttributeNS(u"http://www.w3.org/1999/xhtml", u"src", p_scr_src)
@@ -779,8 +990,76 @@ class Oex2Nex:
 
             return (doc, None, None)
 
-        # move inline scripts into a new external script
-        script_count = 0
+        def write_script(src, script_data):
+            try:
+                nex.writestr(src, script_data)
+            except UnicodeEncodeError:
+                # oops non-ASCII bytes found. *Presumably* we have
+                # Unicode already at this point so we can just
+                # encode it as UTF-8..
+                # If we at this point somehow end up with data
+                # that's already UTF-8 encoded, we'll be in
+                # trouble.. will that throw or just create mojibake
+                # in the resulting extension, I wonder?
+                nex.writestr(src, script_data.encode('utf-8'))
+
+        def replace_script(script, src):
+            """ Turns the script element into one loading src. Done in
+            place, replaceChild() looks the element up among all its
+            siblings """
+            for name in script.attributes.keys():
+                script.removeAttribute(name)
+            while script.firstChild is not None:
+                script.removeChild(script.firstChild)
+            script.setAttributeNS(u"http://www.w3.org/1999/xhtml", u"src", src)
+
+        def remove_scripts(scripts):
+            """ Removes the script elements, in one pass over the children
+            of each parent. removeChild() looks every one of them up among
+            its siblings """
+            removed = set(id(script) for script in scripts)
+            parents = dict((id(script.parentNode), script.parentNode)
+                           for script in scripts)
+            for parent in parents.values():
+                kept = [child for child in parent.childNodes
+                        if id(child) not in removed]
+                parent.childNodes[:] = kept
+                for (index, child) in enumerate(kept):
+                    child.previousSibling = kept[index - 1] if index else None
+                    child.nextSibling = (kept[index + 1]
+                                         if index + 1 < len(kept) else None)
+            for script in scripts:
+                script.parentNode = None
+                script.previousSibling = script.nextSibling = None
+
+        def bundle(run):
+            """ Returns the inline scripts of run fixed in one parse, each
+            in its own function and try block inside one isReady callback,
+            or None if one of them does not parse """
+            if [data for data in run if inline_boundary.strip(";") in data]:
+                return None
+            failures = self.stats["parse_failures"]
+            warnings = len(self.warnings)
+            (bundled, is_json) = self._update_scopes(
+                    (u"\n;\n" + inline_boundary + u"\n").join(run), FILE_JS)
+            fragments = bundled.split(inline_boundary)
+            if self.stats["parse_failures"] != failures \
+                    or len(fragments) != len(run):
+                # keep them in separate files so the others still run, the
+                # broken one gets its warning there
+                del self.warnings[warnings:]
+                self.stats["parse_failures"] = failures
+                return None
+            # an error in one script does not stop the ones after it, it is
+            # still reported
+            return u"opera.isReady(function(){\n" + u"".join(
+                    u"try {\n(function(){\n" + fragment.strip()
+                    + u"\n})();\n} catch (e) {\n"
+                    u"setTimeout(function () { throw e; }, 0);\n}\n"
+                    for fragment in fragments) + u"});\n"
+
+        # the inline scripts in runs with no external script between them
+        runs = [[]]
         for script in doc.getElementsByTagName(u"script"):
             script_name = script.getAttribute(u"src")
             if not script_name:
@@ -790,42 +1069,52 @@ class Oex2Nex:
                         script_data += cnode.nodeValue
                     script_data = script_data.strip()
                     if script_data:
-                        is_json = False
-                        (script_data, is_json) = self._update_scopes(
-                                script_data)
-                        if not is_json:
-                            script_data = u"opera.isReady(function(){\n" \
-                                    + script_data + "\n});\n"
-                        script_count += 1
-                        print doc
-                        iscr = doc.createElementNS(u"http://www.w3.org/1999/xhtml", u"script")
-                        iscr_src = u"inline_script_" + file_type + "_" \
-                                + str(script_count) + ".js"
-                        iscr.setAttributeNS(u"http://www.w3.org/1999/xhtml", u"src", iscr_src)
-                        script.parentNode.replaceChild(iscr, script)
-                        try:
-                            nex.writestr(iscr_src, script_data)
-                        except UnicodeEncodeError:
-                            # oops non-ASCII bytes found. *Presumably* we have
-                            # Unicode already at this point so we can just
-                            # encode it as UTF-8..
-                            # If we at this point somehow end up with data
-                            # that's already UTF-8 encoded, we'll be in
-                            # trouble.. will that throw or just create mojibake
-                            # in the resulting extension, I wonder?
-                            nex.writestr(iscr_src, script_data.encode('utf-8'))
+                        runs[-1].append((script, script_data))
+            elif runs[-1]:
+                runs.append([])
+
+        inline_scripts = []
+        bundles = 0
+        for run in runs:
+            bundled = None
+            if self._bundle_inline and len(run) > 1:
+                bundled = bundle([script_data
+                                  for (_s, script_data) in run])
+            if bundled is None:
+                inline_scripts.extend(run)
+                continue
+            # The run goes to one file in the place of its last script, so
+            # it still runs between the external scripts around it
+            bundles += 1
+            inline_src = u"allinlines_" + file_type \
+                    + (u"_%d" % bundles if bundles > 1 else u"") + ".js"
+            remove_scripts([script for (script, _script_data) in run[:-1]])
+            replace_script(run[-1][0], inline_src)
+            write_script(inline_src, bundled)
+
+        # move inline scripts into a new external script
+        script_count = 0
+        for script, script_data in inline_scripts:
+            is_json = False
+            (script_data, is_json) = self._update_scopes(script_data)
+            if not is_json:
+                script_data = u"opera.isReady(function(){\n" \
+                        + script_data + "\n});\n"
+            script_count += 1
+            iscr_src = u"inline_script_" + file_type + "_" \
+                    + str(script_count) + ".js"
+            replace_script(script, iscr_src)
+            write_script(iscr_src, script_data)
 
         shim = doc.createElementNS(u"http://www.w3.org/1999/xhtml", u"script")
         if file_type == "index":
             shim.setAttributeNS(u"http://www.w3.org/1999/xhtml", u"src", oex_bg_shim)
-            bgdata = self._get_shim_data(oex_bg_shim)
-            if oex_bg_shim not in nex.namelist():
-                nex.writestr(oex_bg_shim, bgdata)
+            self._shims.add(oex_bg_shim)
             if prefs:
                 (doc, pref_sdata, pref_src) = add_dom_prefs(doc, prefs)
                 pref_sdata = u"opera.isReady(function(){\n" \
                         + pref_sdata + "\n});\n"
-                nex.writestr(pref_src, pref_sdata)
+                nex.writestr(pref_src, pref_sdata.encode('utf-8'))
         # add the 'anypage.shim' to all content we receive here:
         else:
             #NOT : file_type == "popup" or file_type == "option":
@@ -833,92 +1122,76 @@ class Oex2Nex:
             # the package (Localisation ~!~!~!~)
 
             shim.setAttributeNS(u"http://www.w3.org/1999/xhtml", u"src", oex_anypage_shim)
-            ppdata = self._get_shim_data(oex_anypage_shim)
-            # add popup shim only if it hasn't been added already
-            if oex_anypage_shim not in nex.namelist():
-                nex.writestr(oex_anypage_shim, ppdata)
+            # the shims are written once the manifest is known
+            self._shims.add(oex_anypage_shim)
 
         tx2 = doc.createTextNode(u" ")
         shim.appendChild(tx2)
 
-        if inlinescrdata:
-            inscr = doc.createElement(u"script", u"http://www.w3.org/1999/xhtml")
-            inscr.setAttributeNS(u"http://www.w3.org/1999/xhtml", u"src", u"allinlines_" + file_type + ".js")
-            ti = doc.createTextNode(u" ")
-            inscr.appendChild(ti)
-
         # add scripts as necessary
         head = doc.getElementsByTagName(u"head")
         if head is not None and head != []:
             head = head[0]
             head.insertBefore(shim, head.firstChild)
-            if inlinescrdata:
-                head.appendChild(inscr)
         else:
             doc.documentElement.insertBefore(shim,
                     doc.documentElement.firstChild)
-            if inlinescrdata:
-                doc.documentElement.appendChild(inscr)
-        # scripts are read and written here only if they are merged
-        # if not, they are varscopefixed and added in the routine where other
-        # files are added.
-        return serializer.render(domwalker(doc))
+        html = serializer.render(domwalker(doc))
+        scripts = sum(meter.seconds.get(stage, 0)
+                      for stage in ("parse", "fix", "scan")) - scripts
+        meter.add_time("html", start + scripts)
+        # minidom nodes point to their parents and siblings, a document that
+        # is not unlinked stays until the cycle collector finds it
+        doc.unlink()
+        return html
 
     def signnex(self):
         """ Sign the nex file using the provided private key"""
         out_file = self._out_file
         if self._out_dir:
             out_file += ".nex"
-        key_file = self._key_file
-        signednex = crxheader
-        publen = 0
-        siglen = 0
         try:
-            import subprocess
-            import shlex
-            import struct
-            password = ""
             print('Signing NEX package:\nProvide password to load private key:')
             password = sys.stdin.readline()
-            if password[-1] == "\n":
+            if password[-1:] == "\n":
                 password = password[:-1]
-            args = shlex.split('openssl pkey -outform DER -pubout '
-                    '-out pubkey.der -in "' + key_file + '" -passin "pass:'
-                    + password + '"')
-            if debug:
-                print(args)
-            subprocess.call(args)
-            args = shlex.split('openssl dgst -sha1 -binary -sign "' + key_file
-                    + '" -passin "pass:' + password + '" -out "' + out_file
-                    + '.sig" "' + out_file + '"')
-            if debug:
-                print(args)
-            subprocess.call(args)
-            try:
-                pfh = open("pubkey.der", 'rb')
-                sfh = open(out_file + '.sig', 'rb')
-                ofh = open(out_file, 'rb')
-            except Exception as e:
-                print(('Failed to open required files to create signature.', e))
-
-            if sfh and pfh and ofh:
-                pubdata = pfh.read()
-                sigdata = sfh.read()
-                nexdata = ofh.read()
-                ofh.close()
-                ofh = open(out_file + '.signed.nex', 'wb')
-                publen = struct.pack("<L", len(pubdata))
-                siglen = struct.pack("<L", len(sigdata))
-                signednex += (publen + siglen + pubdata + sigdata + nexdata)
-                ofh.write(signednex)
-                sfh.close()
-                pfh.close()
-                ofh.close()
-                os.unlink("pubkey.der")
-                os.unlink(out_file + '.sig')
+            ofh = open(out_file, 'rb')
+            nexdata = ofh.read()
+            ofh.close()
+            signednex = sign_nex(nexdata, self._key_file, password)
+            ofh = open(out_file + '.signed.nex', 'wb')
+            ofh.write(signednex)
+            ofh.close()
         except Exception as e:
             print(("Signing of " + out_file + " failed, ", e))
 
+    def _write_shims(self, modules):
+        """ Writes the shims used by the pages of the extension, unless the
+        package already has them. When trimming, only the optional shim
+        modules listed in modules are kept """
+        for shim in sorted(self._shims):
+            if shim in self._nex.namelist():
+                continue
+            data = self._get_shim_data(shim)
+            if self._trim_shims:
+                data = shims.trim(data, os.path.basename(shim), modules)
+                if debug:
+                    print("Shim %s trimmed to modules: %s" % (shim,
+                            ", ".join(sorted(modules))))
+            if self._minify:
+                minified = shims.minify(data, cache_dir, self._js)
+                if minified is None:
+                    self.warnings.append("Could not minify " + shim)
+                else:
+                    self._count_minified(data, minified)
+                    data = minified
+            self._nex.writestr(shim, data)
+
+    def _count_minified(self, before, after):
+        """ Adds the sizes of a minified script to the stats """
+        self.stats["minify"]["before"] += len(before)
+        self.stats["minify"]["after"] += len(after)
+
     def _get_shim_data(self, shim):
         """ Reads and returns data from the shim file in shim_fs_path"""
         data = None
@@ -933,65 +1206,487 @@ class Oex2Nex:
         return data
 
 
-def fetch_shims():
-    """ Download shim files from remote server """
-    import urllib2
-    attempts = 0
-    shims = iter((
-            "operaextensions_background.js",
-            "operaextensions_popup.js",
-            "operaextensions_injectedscript.js",
-    ))
-    shim_dir = os.path.join(shim_fs_path, shim_dirname)
-    shim = next(shims)
-    url = shim_fetch_from + shim
-    while attempts < 10:
-        attempts += 1
+def _openssl(args, data=None):
+    """ Runs openssl with args, data on its stdin. Returns its output """
+    proc = subprocess.Popen(["openssl"] + args, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (out, err) = proc.communicate(data)
+    if proc.returncode:
+        raise ValueError("openssl %s failed: %s" % (args[0], err.strip()))
+    return out
+
+
+def sign_nex(nexdata, key_file, password=""):
+    """
+    Returns the package nexdata signed with the private key in key_file
+    (PEM, encrypted with password). The data goes to openssl through pipes,
+    so nothing is written to disk. Raises ValueError if openssl fails.
+    """
+    passin = "pass:" + password
+    pubkey = _openssl(["pkey", "-outform", "DER", "-pubout",
+                       "-in", key_file, "-passin", passin])
+    signature = _openssl(["dgst", "-sha1", "-binary", "-sign", key_file,
+                          "-passin", passin], nexdata)
+    return (crxheader + struct.pack("<L", len(pubkey))
+            + struct.pack("<L", len(signature)) + pubkey + signature
+            + nexdata)
+
+
+def convert_package(oex, out=None, key_file=None, password="", **options):
+    """
+    Converts a package in memory. oex is the .oex file as bytes or a
+    file-like object to read it from. The .nex package is written to the
+    file-like object out, or returned if out is None; with key_file it is
+    signed (see sign_nex()). options are passed to Oex2Nex. Returns a dict
+    with the nex bytes (None when written to out), the manifest (as a
+    dict), the warnings and the stats of the conversion.
+    """
+    if isinstance(oex, str):
+        oex = BytesIO(oex)
+    elif not (hasattr(oex, "seek") and hasattr(oex, "tell")):
+        # zipfile needs to seek, e.g. in a request body
+        oex = BytesIO(oex.read())
+    # zipfile can not write to streams it can not seek and the signature
+    # covers the whole package, so those go through a buffer
+    direct = (out is not None and key_file is None
+              and hasattr(out, "seek") and hasattr(out, "tell"))
+    nex = out if direct else BytesIO()
+    convertor = Oex2Nex(oex, nex, **options)
+    convertor.convert()
+    result = {"nex": None, "manifest": convertor.manifest,
+              "warnings": convertor.warnings, "stats": convertor.stats}
+    if not direct:
+        nexdata = nex.getvalue()
+        if key_file is not None:
+            nexdata = sign_nex(nexdata, key_file, password)
+        if out is None:
+            result["nex"] = nexdata
+        else:
+            out.write(nexdata)
+    return result
+
+
+def fetch_shims(url=None, jobs=3):
+    """ Downloads the shim files that changed on the server from url
+    (shim_fetch_from by default) into the oex_shim directory, see
+    ShimSync """
+    sync = ShimSync(url or shim_fetch_from,
+                    os.path.join(shim_fs_path, shim_dirname),
+                    os.path.join(cache_dir, "shim-sync"), jobs=jobs)
+    try:
         try:
-            res = urllib2.urlopen(url)
-            if res.code == 200:
-                try:
-                    if not os.path.exists(shim_dir):
-                        os.mkdir(shim_dir)
-                    elif os.path.isdir(shim_dir):
-                        fh = open(os.path.join(shim_dir, shim), 'w')
-                        fh.write(res.read())
-                        fh.close()
-                except Exception as e:
-                    sys.exit("ERROR: Unable to fetch shim files from " + url +
-                            "\nException was :" + str(e))
-            else:
-                if debug:
-                    print(('Response:', res.code))
+            status = sync.run()
+        except ShimAuthRequired as e:
+            # ask once, the credentials are used for all the shims
+            print("Basic auth: Realm: %s" % e.realm)
+            print("Enter username:")
+            usr = sys.stdin.readline().strip("\n")
+            print("Enter password:")
+            pwd = sys.stdin.readline().strip("\n")
+            auth_handler = urllib2.HTTPBasicAuthHandler()
+            auth_handler.add_password(realm=e.realm, uri=sync.url, user=usr,
+                                      passwd=pwd)
+            sync.opener = urllib2.build_opener(auth_handler)
+            status = sync.run()
+    except (ShimSyncError, IOError, OSError) as e:
+        sys.exit("ERROR: Unable to fetch shim files from %s\nException "
+                 "was: %s" % (sync.url, e))
+    for name in sorted(status):
+        print("%s: %s" % (name, status[name]))
+    return status
+
+
+# Classes of package members, see classify()
+FILE_HTML = "html"
+FILE_JS = "js"
+FILE_USERSCRIPT = "userscript"
+FILE_JSON = "json"
+FILE_BINARY = "binary"
+FILE_OTHER = "other"
+text_classes = (FILE_HTML, FILE_JS, FILE_USERSCRIPT, FILE_JSON)
+
+
+def looks_like_json(data):
+    """ Cheap check whether data could be a JSON object or array """
+    head = data[:64]
+    if isinstance(head, unicode):
+        head = head.lstrip(u"\ufeff")
+    elif head.startswith(codecs.BOM_UTF8):
+        head = head[3:]
+    return head.lstrip()[:1] in ("{", "[")
+
+
+def classify(filename, data):
+    """
+    Classifies a package member by its extension and the first bytes of its
+    content, so every file gets routed to exactly one kind of parser. Returns
+    one of FILE_HTML, FILE_JS, FILE_USERSCRIPT, FILE_JSON, FILE_BINARY or
+    FILE_OTHER.
+    """
+    if re.search(r"\.x?html?$", filename, flags=re.I):
+        return FILE_HTML
+    if "\0" in data[:1024]:
+        # e.g. images or the __MACOSX/._foo.js resource forks
+        return FILE_BINARY
+    if re.search(r"\.json$", filename, flags=re.I):
+        return FILE_JSON
+    if re.search(r"\.js$", filename, flags=re.I):
+        if filename.startswith("includes/"):
+            return FILE_USERSCRIPT
+        if looks_like_json(data):
+            return FILE_JSON
+        return FILE_JS
+    return FILE_OTHER
+
+
+# the comments a script starts with, where libraries have their banner
+_leading_comments = re.compile(r"(?:\xef\xbb\xbf)?\s*((?:/\*.*?\*/\s*"
+                               r"|//[^\n]*\n\s*)+)", re.S)
+
+
+def vendor_library(filename, data, rules=None, digest=None):
+    """
+    Returns the name of the library (or the glob) if the script filename
+    with the content data (bytes) matches one of the rules (see
+    vendor_libraries), None otherwise. digest is the SHA-1 of data if it is
+    known already.
+    """
+    if rules is None:
+        rules = vendor_libraries
+    for glob in rules.get("globs", ()):
+        if fnmatch.fnmatchcase(filename, glob):
+            return glob
+    hashes = rules.get("hashes")
+    if hashes:
+        name = hashes.get(digest or hashlib.sha1(data).hexdigest())
+        if name:
+            return name
+    banners = rules.get("banners")
+    if banners:
+        comments = _leading_comments.match(data[:4096])
+        if comments:
+            for (name, banner) in banners:
+                # at the start of a comment line, a script merely mentioning
+                # the library does not match
+                if re.search(r"(?m)^[\s/*!-]*" + banner, comments.group(1)):
+                    return name
+    return None
+
+
+def read_library_hashes(path):
+    """ Reads the file path with the SHA-1 sums of library scripts in the
+    format of sha1sum output. Returns a dict of the sums to the file names,
+    for the hashes of vendor_library() """
+    hashes = {}
+    fh = open(path)
+    try:
+        for line in fh:
+            fields = line.strip().split(None, 1)
+            if len(fields) == 2 and re.match(r"[0-9a-fA-F]{40}$", fields[0]):
+                name = os.path.basename(fields[1].lstrip("*"))
+                hashes[fields[0].lower()] = name
+    finally:
+        fh.close()
+    return hashes
+
+
+# the library releases copied as they are by default
+vendor_libraries["hashes"].update(read_library_hashes(
+        os.path.join(shim_fs_path, "known_libraries.sha1")))
+
+
+def group_content_scripts(injscrlist):
+    """
+    Groups the injected scripts in injscrlist that follow each other and
+    have the same include and exclude globs. Returns a list of {"files":
+    [...], "includes": [...], "excludes": [...]} dicts. Scripts are only
+    merged with their neighbours, so they are still injected in the order
+    of injscrlist, like in Opera: a script may use the globals of the ones
+    before it.
+    """
+    groups = []
+    last_key = None
+    for cs in injscrlist:
+        key = (tuple(cs["includes"]), tuple(cs["excludes"]))
+        if key != last_key:
+            groups.append({"files": [], "includes": cs["includes"],
+                           "excludes": cs["excludes"]})
+            last_key = key
+        groups[-1]["files"].append(cs["file"])
+    return groups
+
+
+def normalize_version(version):
+    """Attemps to clean up existing config.xml @version values and
+    validate them against the CRX requirements (1-4 dot-separated integers
+    each between 0 and 65536). If that fails, returns '1.0.0.1'
+    """
+    # in case a stray None (or whatever) makes it in
+    version = str(version)
+    version = re.sub(r'[^\d\.]+', '.', version)
+    version = version.strip('.')
+    valid_version = re.match(r"^(([0-9]|[1-9][0-9]{1,3}|[1-5][0-9]{4}|"
+                             "6[0-4][0-9]{3}|65[0-4][0-9]{2}|655[0-2]"
+                             "[0-9]|6553[0-6])\.){0,3}([0-9]|[1-9][0-9]"
+                             "{1,3}|[1-5][0-9]{4}|6[0-4][0-9]{3}|65[0-4]"
+                             "[0-9]{2}|655[0-2][0-9]|6553[0-6])$", version)
+    if not valid_version:
+        version = "1.0.0.1"
+    return version
+
+
+def parse_config(oex):
+    """
+    Reads and parses the config.xml of the package oex (a ZipFile). Returns a
+    dict with the name, description, normalized version, features (names),
+    speeddial (the URL, or None), access (a list of [origin, subdomains]),
+    preferences (by name), index (the content src), icons (src by size),
+    default_locale and author ({"name", "url"} or None) of the extension, and
+    a list of warnings about the config. Raises InvalidPackage if there is
+    no usable config.xml.
+    """
+    try:
+        # Also a quick sanity check for Opera extension format
+        configStr = unicoder(oex.read("config.xml"))
+    except KeyError as kex:
+        raise InvalidPackage("Is the input file a valid Opera extension? "
+                "We did not find a config.xml inside.\nException was:"
+                + str(kex))
+    except UnicodingError, e:
+        raise InvalidPackage("config.xml has an unknown encoding.")
+
+    if debug:
+        print(("Config.xml", configStr))
+    try:
+        # xml.etree requires UTF-8 input
+        root = etree.fromstring(configStr.encode('UTF-8'))
+    except ParseError, e:
+        raise InvalidPackage('Parsing config.xml failed '
+                'with the following error: %s' % e.message)
+    #TODO: Handle localisation (xml:lang), defaultLocale, locales folder
+    # etc.
+    ns = "{http://www.w3.org/ns/widgets}"
+    config = {"warnings": []}
+
+    def _get_best_elem(_xmltree, tag):
+        """
+        Find and return default or English tag's content when config.xml
+        has same tag with different xml:lang
+        """
+
+        elems = root.findall(ns + tag)
+        rval = ""
+        # Use some 'en' value of the text content if the element is
+        # localised
+        for it in elems:
             try:
-                shim = next(shims)
-            except StopIteration:
+                lang = it.attrib[
+                        '{http://www.w3.org/XML/1998/namespace}lang']
+                if not rval or ((lang is not None) and ("en" in lang)):
+                    rval = it.text
+            except KeyError:
+                if it is not None:
+                    rval = it.text
                 break
-            url = shim_fetch_from + shim
-        except urllib2.HTTPError as ex:
-            if ex.code == 401:
+        if not rval:
+            rval = "No " + tag + " found in config.xml."
+        elif not isinstance(rval, unicode):
+            try:
+                rval = unicoder(rval)
+            except UnicodingError:
+                pass
+        else:
+            rval = rval.encode("utf-8")
+
+        return rval
+
+    config["name"] = _get_best_elem(root, "name")
+    if "version" in root.attrib:
+        config["version"] = normalize_version(root.attrib["version"])
+    else:
+        config["version"] = "1.0.0.1"
+    config["description"] = _get_best_elem(root, "description")
+
+    accessorigins = []
+    for acs in root.findall(ns + "access"):
+        if "subdomains" in acs.attrib:
+            accessorigins.append([acs.attrib["origin"],
+                    acs.attrib["subdomains"]])
+        else:
+            accessorigins.append([acs.attrib["origin"], "false"])
+    config["access"] = accessorigins
+
+    ### Handle feature elements
+    featurenames = []
+    sd_url = None
+    for feat in root.findall(ns + "feature"):
+        featurenames.append(feat.attrib["name"])
+        if feat.attrib["name"].lower() == "opera:speeddial":
+            param = feat.find(ns + "param")
+            if param is not None and "value" in param.attrib:
+                sd_url = param.attrib["value"]
                 if debug:
-                    print(('HTTP Authentication required:', ex.code, ex.msg,
-                            ex.hdrs))
-                auth_type = ex.hdrs["WWW-Authenticate"].split()[0]
-                realm = ex.hdrs["WWW-Authenticate"].split('=')[1]
-                realm = realm.strip('"')
-                if auth_type == "Basic":
-                    auth_handler = urllib2.HTTPBasicAuthHandler()
-                    print("Basic auth: Realm: ", realm)
-                    print("Enter username:")
-                    usr = sys.stdin.readline()
-                    usr = usr.strip("\n")
-                    print("Enter password:")
-                    pwd = sys.stdin.readline()
-                    pwd = pwd.strip("\n")
-                    auth_handler.add_password(realm=realm, uri=shim_fetch_from,
-                            user=usr, passwd=pwd)
-                    opener = urllib2.build_opener(auth_handler)
-                    urllib2.install_opener(opener)
-                    continue
+                    print('Speeddial URL: ', sd_url)
             else:
-                print(('Threw :', ex, ' when fetching ', url))
+                config["warnings"].append(
+                        "Invalid speed dial extension. "
+                        "feature element lacks param element or URL.")
+    config["features"] = featurenames
+    config["speeddial"] = sd_url
+
+    # Store preference data and add them to the index doc using a script
+    prefstore = {}
+    for pref in root.findall(ns + "preference"):
+        if "name" in pref.attrib:
+            prefstore[pref.attrib["name"]] = pref.attrib["value"]
+    config["preferences"] = prefstore
+
+    config["index"] = indexdoc
+    content = root.find(ns + "content")
+    if content is not None:
+        if "src" in content.attrib:
+            config["index"] = content.attrib["src"]
+
+    icon_elms = root.findall(ns + "icon")
+    iconlist = []
+    # If there's more than one icon, try to be smart about what to include
+    if len(icon_elms) > 1:
+        for icon in icon_elms:
+            w = icon.attrib.get("width")
+            src = icon.attrib.get("src")
+            if w in ["16", "48", "128"]:
+                if src:
+                    iconlist.append((w, src))
+            elif re.search(r"16|48|128", src):
+                m = re.search(r"16|48|128", src)
+                w = m.group(0)
+                if src:
+                    iconlist.append((w, src))
+            # else take one of whatever else is left
+            elif src:
+                iconlist.append(("128", src))
+                continue
+    # Otherwise just grab the only icon
+    elif len(icon_elms) == 1:
+        src = icon_elms[0].attrib.get("src")
+        if src:
+            iconlist.append(("128", src))
+    config["icons"] = dict((size, name) for (size, name) in iconlist)
+
+    # only used if there is a matching _locales/ folder, see _convert
+    config["default_locale"] = root.attrib.get("defaultlocale")
+    config["author"] = None
+    author_elm = root.find(ns + "author")
+    if author_elm is not None and author_elm.text:
+        config["author"] = {"name": author_elm.text,
+                            "url": author_elm.attrib.get("href", "")}
+    return config
+
+
+class _PackageDirectory(object):
+    """ The namelist(), read() and file sizes of the files of an extracted
+    package, like a ZipFile """
+    def __init__(self, path):
+        self._path = path
+        self.sizes = {}
+        for top, dirns, fnames in os.walk(path):
+            for fname in fnames:
+                full = os.path.join(top, fname)
+                name = os.path.relpath(full, path).replace(os.sep, "/")
+                self.sizes[name] = os.path.getsize(full)
+
+    def namelist(self):
+        return sorted(self.sizes)
+
+    def read(self, name):
+        if name not in self.sizes:
+            raise KeyError("There is no item named %r in the directory"
+                           % name)
+        fh = open(os.path.join(self._path, *name.split("/")), "rb")
+        try:
+            return fh.read()
+        finally:
+            fh.close()
+
+    def close(self):
+        pass
+
+
+def check_package(package, limits=None, full=False):
+    """
+    Quick checks that package (the path of an .oex or of a directory with
+    its files, or a file-like object) can be converted, done before any
+    output is written: a zip file without encrypted or unsafely named
+    members and only stored or deflated ones, within the package_limits
+    (updated with limits), with a config.xml that parses and the content
+    src in it. Only the directory of the zip and config.xml are read. With
+    full the CRCs of all members and the encoding of the text files are
+    checked as well, which reads the whole package. Returns the config (see
+    parse_config()), raises InvalidPackage with the reason.
+    """
+    max_size = dict(package_limits, **(limits or {}))
+    if isinstance(package, basestring) and os.path.isdir(package):
+        oex = _PackageDirectory(package)
+        sizes = oex.sizes.items()
+    else:
+        try:
+            oex = zipfile.ZipFile(package, "r")
+        except (zipfile.BadZipfile, zipfile.LargeZipFile, IOError) as e:
+            raise InvalidPackage("Not a zip file: %s" % e)
+        sizes = [(info.filename, info.file_size) for info in oex.infolist()]
+    try:
+        if isinstance(oex, zipfile.ZipFile):
+            for info in oex.infolist():
+                name = info.filename
+                if info.flag_bits & 0x1:
+                    raise InvalidPackage("%s is encrypted" % name)
+                if info.compress_type not in (zipfile.ZIP_STORED,
+                                              zipfile.ZIP_DEFLATED):
+                    raise InvalidPackage("%s uses an unsupported compression "
+                                         "method" % name)
+                if (name.startswith("/") or "\\" in name
+                        or ".." in name.split("/")):
+                    raise InvalidPackage("%s is outside the package" % name)
+        if max_size.get("entries") and len(sizes) > max_size["entries"]:
+            raise InvalidPackage("The package has %d files, more than the "
+                                 "limit of %d" % (len(sizes),
+                                                  max_size["entries"]))
+        total = sum(size for (_name, size) in sizes)
+        if max_size.get("size") and total > max_size["size"]:
+            raise InvalidPackage("The package has %d bytes, more than the "
+                                 "limit of %d" % (total, max_size["size"]))
+        config = parse_config(oex)
+        members = set(name for (name, _size) in sizes)
+        if config["index"] not in members:
+            raise InvalidPackage("The start file %s given in config.xml is "
+                                 "not in the package" % config["index"])
+        if full:
+            _check_contents(oex, config)
+    finally:
+        oex.close()
+    return config
+
+
+def _check_contents(oex, config):
+    """ The full part of check_package(): CRCs and text encodings """
+    try:
+        if isinstance(oex, zipfile.ZipFile):
+            bad = oex.testzip()
+            if bad is not None:
+                raise InvalidPackage("%s is corrupt" % bad)
+        for filename in oex.namelist():
+            # _convert drops these then
+            if (not config["default_locale"]
+                    and filename.startswith("_locales/")):
+                continue
+            data = oex.read(filename)
+            if classify(filename, data) in text_classes:
+                unicoder(data)
+    except (zipfile.BadZipfile, zlib.error, IOError) as e:
+        raise InvalidPackage("The package is corrupt: %s" % e)
+    except UnicodingError:
+        raise InvalidPackage("The file %s has an unknown encoding."
+                             % filename)
 
 
 class UnicodingError(Exception):
@@ -1051,23 +1746,132 @@ def main(args=None):
     argparser.add_argument('-d', '--debug', default=False, action='store_true',
             help="Debug mode; quite verbose")
     argparser.add_argument('-f', '--fetch', default=False, action='store_true',
-            help="Fetch the latest oex_shim scripts and put them in oex_shim "
-                "directory.")
+            help="Fetch the oex_shim scripts that changed on the server and "
+                "put them in oex_shim directory.")
+    argparser.add_argument('--shim-url', default=shim_fetch_from,
+            metavar='URL',
+            help="Where -f fetches the shims from (default: %(default)s)")
+    argparser.add_argument('-t', '--trim-shims', default=False,
+            action='store_true',
+            help="Only include the parts of the background shim used by the "
+                "extension (tabs, toolbar, menu, speeddial, URL filter)")
+    argparser.add_argument('-m', '--minify', default=False,
+            action='store_true',
+            help="Minify the converted scripts and the shims")
+    argparser.add_argument('-b', '--bundle-inline', default=False,
+            action='store_true',
+            help="Put the inline scripts of a page that follow each other, "
+                "with no external script between them, in one external "
+                "script instead of one per inline script")
+    argparser.add_argument('-j', '--jobs', type=int, default=None,
+            metavar='N',
+            help="Number of threads compressing the output package "
+                "(default: number of CPUs)")
+    argparser.add_argument('--compress-level', type=int, default=6,
+            choices=range(10), metavar='LEVEL',
+            help="Compression level of the output package, from 0 (store "
+                "only) to 9. Images and other compressed media are always "
+                "stored")
+    argparser.add_argument('-r', '--reproducible', default=False,
+            action='store_true',
+            help="Write the same package bytes for the same input: sorted "
+                "entries with a fixed timestamp (SOURCE_DATE_EPOCH or "
+                "1980-01-01)")
+    argparser.add_argument('-c', '--cache', default=False,
+            action='store_true',
+            help="Reuse the result of an earlier conversion of the same "
+                "package with the same options, and store the result")
+    argparser.add_argument('--cache-max-size', type=int, default=512,
+            metavar='MB',
+            help="Size the result cache is kept under (0 for no limit)")
+    argparser.add_argument('--cache-max-age', type=int, default=30,
+            metavar='DAYS',
+            help="Results not used for this long are dropped from the cache "
+                "(0 for no limit)")
+    argparser.add_argument('--max-script-size', type=int,
+            default=script_limits["size"], metavar='CHARS',
+            help="Scripts larger than this only get fast top level fixes "
+                "(0 for no limit)")
+    argparser.add_argument('--max-parse-time', type=float,
+            default=script_limits["parse_time"], metavar='SECONDS',
+            help="Time allowed to parse and fix a single script before "
+                "falling back to fast top level fixes (0 for no limit)")
+    argparser.add_argument('--max-ast-nodes', type=int,
+            default=script_limits["nodes"], metavar='NODES',
+            help="Scripts with more AST nodes than this only get fast top "
+                "level fixes (0 for no limit)")
+    argparser.add_argument('--max-package-size', type=int,
+            default=package_limits["size"] // (1024 * 1024), metavar='MB',
+            help="Packages whose files are larger than this uncompressed "
+                "are rejected (0 for no limit)")
+    argparser.add_argument('--max-entries', type=int,
+            default=package_limits["entries"], metavar='N',
+            help="Packages with more files than this are rejected (0 for no "
+                "limit)")
+    argparser.add_argument('--pass-through', action='append', default=[],
+            metavar='GLOB',
+            help="Copy the scripts matching GLOB (a path in the package, "
+                "e.g. 'lib/*.js') as they are, without scope fixes. Can be "
+                "given more than once")
+    argparser.add_argument('--known-libraries', metavar='FILE',
+            help="Also copy the scripts with the SHA-1 sums listed in FILE "
+                "(sha1sum output) as they are")
+    argparser.add_argument('--fix-libraries', default=False,
+            action='store_true',
+            help="Fix the library releases in known_libraries.sha1 like "
+                "any other script")
+    argparser.add_argument('--trust-banners', default=False,
+            action='store_true',
+            help="Also copy the scripts starting with the license banner "
+                "of a library (jQuery, Prototype, MooTools, ...) as they "
+                "are. Library code bundled with other code is then not "
+                "fixed either")
 
     args = argparser.parse_args()
     global debug
     if args.debug:
         debug = True
     if args.fetch:
-        fetch_shims()
+        fetch_shims(args.shim_url)
     try:
-        convertor = Oex2Nex(args.in_file, args.out_file, args.key, args.outdir)
+        limits = {"size": args.max_script_size,
+                  "parse_time": args.max_parse_time,
+                  "nodes": args.max_ast_nodes}
+        vendor = {"globs": args.pass_through, "hashes": {}}
+        if not args.fix_libraries:
+            vendor["hashes"].update(vendor_libraries["hashes"])
+        if args.known_libraries:
+            vendor["hashes"].update(read_library_hashes(args.known_libraries))
+        if args.trust_banners:
+            vendor["banners"] = library_banners
+        result_cache = None
+        if args.cache:
+            result_cache = ResultCache(os.path.join(cache_dir, "results"),
+                                       args.cache_max_size * 1024 * 1024,
+                                       args.cache_max_age * 24 * 3600)
+        convertor = Oex2Nex(args.in_file, args.out_file, args.key, args.outdir,
+                            limits, args.trim_shims, args.minify,
+                            args.bundle_inline, args.compress_level,
+                            args.jobs, args.reproducible, result_cache,
+                            {"size": args.max_package_size * 1024 * 1024,
+                             "entries": args.max_entries}, vendor,
+                            reset_peaks=True)
         convertor.convert()
     except (ValueError, InvalidPackage, IOError, UnicodingError)  as e:
         sys.exit("ERROR: %s" % e.message)
 
     if convertor.warnings:
         print "\n".join(["Warning: " + w for w in convertor.warnings])
+    if args.minify:
+        print("Minified scripts and shims from %(before)d to %(after)d "
+              "characters" % convertor.stats["minify"])
+    if result_cache is not None:
+        stats = result_cache.stats()
+        stats["result"] = "hit" if convertor.stats["cached"] else "miss"
+        stats["hit_rate"] *= 100
+        print("Result cache %(result)s: %(hits)d hits, %(misses)d misses "
+              "(%(hit_rate).0f%%), %(entries)d entries in %(size)d bytes"
+              % stats)
 
 if __name__ == "__main__":
     main()
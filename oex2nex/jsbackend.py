@@ -0,0 +1,69 @@
+#!python
+"""
+The JavaScript parser. The converter, ASTWalker and AliasTable only use the
+parser through the backend returned by get_backend(), which parses, walks,
+serializes and minifies trees and provides the node types (backend.ast).
+"""
+
+_instance = None
+
+
+def get_backend():
+    """ Returns the shared SlimitBackend. Raises ImportError if slimit is not
+    installed """
+    global _instance
+    if _instance is None:
+        _instance = SlimitBackend()
+    return _instance
+
+
+class SlimitBackend(object):
+    """ The slimit parser """
+    def __init__(self):
+        from slimit.parser import Parser
+        from slimit import ast
+        from slimit.visitors.minvisitor import ECMAMinifier
+        self.ast = ast
+        self._parser = Parser
+        self._minifier = ECMAMinifier
+
+    def parse(self, source):
+        """ Returns the Program node of source, raises SyntaxError if it does
+        not parse """
+        # a parser keeps lexer state, a new one for every script
+        parser = self._parser()
+        try:
+            return parser.parse(source)
+        finally:
+            # the yacc and lex objects are in reference cycles with the
+            # Parser and the Lexer, and keep the last symbol stack (the
+            # whole tree) and the source. Unless the cycles are broken they
+            # stay until the cycle collector runs.
+            parser.lexer.lexer = None
+            parser.parser = None
+
+    def to_ecma(self, node):
+        """ Returns the source text of node """
+        return node.to_ecma()
+
+    def minify(self, node):
+        """ Returns the minified source text of node """
+        return self._minifier().visit(node)
+
+    def children(self, node):
+        """ Returns the child nodes of node, without the empty ones """
+        return [child for child in node.children() if child is not None]
+
+    def walk(self, node):
+        """ Yields all nodes below node, parents before their children """
+        stack = list(reversed(self.children(node)))
+        while stack:
+            current = stack.pop()
+            yield current
+            if isinstance(current, self.ast.Node):
+                stack.extend(reversed(self.children(current)))
+
+    def arguments(self, call):
+        """ Returns the argument nodes of a FunctionCall """
+        return list(call.args)
+
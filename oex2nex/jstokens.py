@@ -0,0 +1,139 @@
+#!python
+""" A cheap JavaScript tokenizer and the token level scope fixes used when a
+script is too big or too slow to go through slimit"""
+
+import re
+
+_token_re = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<name>[A-Za-z_$\\][\w$\\]*)
+  | (?P<num>\.?\d[\w.]*)
+  | (?P<str>"(?:[^"\\\n]|\\.|\\\n)*"?|'(?:[^'\\\n]|\\.|\\\n)*'?)
+  | (?P<punct>>>>=?|===|!==|<<=|>>=|>>>|[<>=!+\-*&|^%/]=|&&|\|\||\+\+|--|<<|>>
+              |[{}()\[\];,<>+\-*%&|^!~?:=./])
+  | (?P<other>.)
+""", re.X | re.S | re.U)
+
+_regex_re = re.compile(r"/(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[\w$]*",
+                       re.U)
+
+# After these a '/' starts a regular expression literal, not a division
+_regex_prefix_names = frozenset(("return", "typeof", "instanceof", "in", "of",
+                                 "new", "delete", "void", "throw", "case",
+                                 "do", "else"))
+
+
+def tokenize(script):
+    """
+    Yields (kind, value, start, end, newline_before) for the significant
+    tokens in script. Whitespace and comments are skipped, but are reported
+    through newline_before when they contain a line break.
+    """
+    pos = 0
+    length = len(script)
+    prev = None
+    newline = False
+    while pos < length:
+        if script[pos] == "/" and _slash_starts_regex(prev):
+            m = _regex_re.match(script, pos)
+            if m:
+                yield ("regex", m.group(), pos, m.end(), newline)
+                prev = ("regex", m.group())
+                newline = False
+                pos = m.end()
+                continue
+        m = _token_re.match(script, pos)
+        kind = m.lastgroup
+        if kind in ("space", "comment"):
+            if "\n" in m.group():
+                newline = True
+        else:
+            yield (kind, m.group(), pos, m.end(), newline)
+            prev = (kind, m.group())
+            newline = False
+        pos = m.end()
+
+
+def _slash_starts_regex(prev):
+    if prev is None:
+        return True
+    kind, value = prev
+    if kind == "punct":
+        return value not in (")", "]", "}")
+    if kind == "name":
+        return value in _regex_prefix_names
+    return False
+
+
+def _ends_expression(token):
+    kind, value = token
+    return kind != "punct" or value in (")", "]", "}")
+
+
+def export_globals(script):
+    """
+    Token level version of the top level fixes done by
+    ASTWalker._get_replacements:
+    var foo = 1, bar; -> var foo = window["foo"] = 1, bar = window["bar"];
+    function baz() {} -> function baz() {}
+                         var baz = window["baz"] = baz;
+    Only declarations at the top level of the script are touched.
+    """
+    inserts = []
+    depth = 0
+    prev = None
+    # var statement state: None, "name" (expecting a name) or "decl"
+    in_var = None
+    # None, "" right after the function keyword, or the declared name
+    func_name = None
+    for kind, value, start, end, newline in tokenize(script):
+        if (depth == 0 and in_var == "decl" and newline
+                and _ends_expression(prev) and kind in ("name", "num", "str")):
+            # automatic semicolon insertion ended the var statement
+            in_var = None
+        at_statement_start = (prev is None or prev[1] in (";", "}")
+                              or (newline and _ends_expression(prev)))
+        prev = (kind, value)
+        if func_name == "":
+            if kind == "name":
+                func_name = value
+                continue
+            # an anonymous function expression
+            func_name = None
+        if kind == "punct" and value in ("{", "(", "["):
+            depth += 1
+        elif kind == "punct" and value in ("}", ")", "]"):
+            depth = max(depth - 1, 0)
+            if depth == 0 and value == "}" and func_name:
+                inserts.append((end, '\nvar %s = window["%s"] = %s;'
+                                % (func_name, func_name, func_name)))
+                func_name = None
+        elif depth != 0:
+            continue
+        elif in_var == "name":
+            if kind == "name":
+                inserts.append((end, ' = window["%s"]' % value))
+                in_var = "decl"
+            else:
+                in_var = None
+        elif in_var == "decl" and value == ",":
+            in_var = "name"
+        elif in_var and value == ";":
+            in_var = None
+        elif kind == "name" and at_statement_start and func_name is None:
+            if value == "var":
+                in_var = "name"
+            elif value == "function":
+                func_name = ""
+
+    if not inserts:
+        return script
+    chunks = []
+    last = 0
+    for pos, text in inserts:
+        chunks.append(script[last:pos])
+        chunks.append(text)
+        last = pos
+    chunks.append(script[last:])
+    return u"".join(chunks)
@@ -0,0 +1,183 @@
+#!python
+""" Builds known_libraries.sha1, the SHA-1 sums of the library releases the
+converter copies as they are by default, from the upstream release files of
+the libraries Opera extensions bundled """
+
+import os
+import re
+import sys
+import socket
+import hashlib
+import urllib2
+from multiprocessing.pool import ThreadPool
+from shims import _write_atomic
+
+table_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "known_libraries.sha1")
+
+table_header = """\
+# SHA-1 sums of library releases, in sha1sum format, the scripts the
+# converter copies as they are by default (see vendor_library() in
+# convertor.py). Every entry follows the line with the URL of the upstream
+# release file it was taken from. Rebuilt with librarytable.py; more sums
+# can be given with --known-libraries, e.g. from sha1sum lib/*.js. Only
+# whole files match, a library bundled with other code is fixed like any
+# other script.
+"""
+
+_jquery = ("1.3", "1.3.1", "1.3.2", "1.4", "1.4.1", "1.4.2", "1.4.3", "1.4.4",
+           "1.5", "1.5.1", "1.5.2", "1.6", "1.6.1", "1.6.2", "1.6.3", "1.6.4",
+           "1.7", "1.7.1", "1.7.2", "1.8.0", "1.8.1", "1.8.2", "1.8.3",
+           "1.9.0", "1.9.1", "1.10.0", "1.10.1", "1.10.2")
+_jquery_ui = ["1.8"] + ["1.8.%d" % n for n in range(1, 25)]
+_prototype = ("1.6.0.2", "1.6.0.3", "1.6.1.0", "1.7.0.0", "1.7.1.0",
+              "1.7.2.0")
+_scriptaculous = ("1.8.1", "1.8.2", "1.8.3", "1.9.0")
+_scriptaculous_files = ("scriptaculous", "builder", "effects", "dragdrop",
+                        "controls", "slider", "sound")
+_mootools = ("1.2.1", "1.2.2", "1.2.3", "1.2.4", "1.2.5", "1.3.0", "1.3.1",
+             "1.3.2", "1.4.0", "1.4.1", "1.4.2", "1.4.3", "1.4.4", "1.4.5")
+_underscore = ("1.1.7", "1.2.0", "1.2.1", "1.2.2", "1.2.3", "1.2.4", "1.3.0",
+               "1.3.1", "1.3.2", "1.3.3", "1.4.0", "1.4.1", "1.4.2", "1.4.3",
+               "1.4.4", "1.5.0", "1.5.1", "1.5.2")
+_backbone = ("0.5.3", "0.9.0", "0.9.1", "0.9.2", "0.9.9", "0.9.10", "1.0.0",
+             "1.1.0")
+_json2 = ("20110223", "20121008", "20130526")
+
+
+def _releases():
+    """ Returns the (name, url) of every release file in the table """
+    releases = []
+    for v in _jquery:
+        for ext in (".js", ".min.js"):
+            releases.append(("jquery-%s%s" % (v, ext),
+                             "https://code.jquery.com/jquery-%s%s" % (v, ext)))
+    for v in _jquery_ui:
+        for ext in (".js", ".min.js"):
+            releases.append(("jquery-ui-%s%s" % (v, ext),
+                             "https://code.jquery.com/ui/%s/jquery-ui%s"
+                             % (v, ext)))
+    for v in _prototype:
+        releases.append(("prototype-%s.js" % v,
+                         "https://ajax.googleapis.com/ajax/libs/prototype/"
+                         "%s/prototype.js" % v))
+    for v in _scriptaculous:
+        for name in _scriptaculous_files:
+            releases.append(("scriptaculous-%s-%s.js" % (v, name),
+                             "https://ajax.googleapis.com/ajax/libs/"
+                             "scriptaculous/%s/%s.js" % (v, name)))
+    for v in _mootools:
+        for name in ("mootools", "mootools-yui-compressed"):
+            releases.append(("%s-%s.js" % (name, v),
+                             "https://ajax.googleapis.com/ajax/libs/mootools/"
+                             "%s/%s.js" % (v, name)))
+    for v in _underscore:
+        for name in ("underscore", "underscore-min"):
+            releases.append(("%s-%s.js" % (name, v),
+                             "https://raw.githubusercontent.com/jashkenas/"
+                             "underscore/%s/%s.js" % (v, name)))
+    for v in _backbone:
+        for name in ("backbone", "backbone-min"):
+            releases.append(("%s-%s.js" % (name, v),
+                             "https://raw.githubusercontent.com/jashkenas/"
+                             "backbone/%s/%s.js" % (v, name)))
+    for v in _json2:
+        releases.append(("json2-%s.js" % v,
+                         "https://cdnjs.cloudflare.com/ajax/libs/json2/%s/"
+                         "json2.js" % v))
+    return releases
+
+# the (name, url) of the upstream release files
+library_releases = _releases()
+
+
+def read_table(path):
+    """ Returns the entries of the table at path as a dict of the source URL
+    to (sha1, name), empty if there is no table """
+    entries = {}
+    try:
+        fh = open(path)
+    except IOError:
+        return entries
+    url = None
+    for line in fh:
+        line = line.strip()
+        if line.startswith("# http"):
+            url = line[2:]
+        elif url and re.match(r"[0-9a-f]{40}  \S", line):
+            (digest, name) = line.split("  ", 1)
+            entries[url] = (digest, name)
+            url = None
+    fh.close()
+    return entries
+
+
+def _fetch(url, opener, timeout):
+    """ Returns the SHA-1 of the file at url, or the error as a string """
+    try:
+        response = opener.open(url, timeout=timeout)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+    except (urllib2.URLError, socket.error, IOError) as e:
+        return (None, str(e))
+    if not data.strip() or data.lstrip()[:1] == "<":
+        # e.g. an error page served with 200
+        return (None, "not a script")
+    return (hashlib.sha1(data).hexdigest(), None)
+
+
+def build_table(path=table_path, releases=None, jobs=8, timeout=30,
+                opener=None):
+    """
+    Fetches the release files, (name, url) pairs, library_releases by
+    default, on jobs threads and writes their sums to the table at path.
+    A file that could not be fetched keeps its entry from the table there
+    was, if any. Returns a dict of the errors by URL.
+    """
+    if releases is None:
+        releases = library_releases
+    opener = opener or urllib2.build_opener()
+    known = read_table(path)
+    pool = ThreadPool(max(1, jobs))
+    try:
+        results = pool.map(lambda release: _fetch(release[1], opener,
+                                                  timeout), releases)
+    finally:
+        pool.close()
+        pool.join()
+    lines = [table_header]
+    errors = {}
+    for ((name, url), (digest, error)) in zip(releases, results):
+        if digest is None:
+            errors[url] = error
+            if url not in known:
+                continue
+            (digest, name) = known[url]
+        lines.append("# %s\n%s  %s\n" % (url, digest, name))
+    _write_atomic(path, "".join(lines), True)
+    return errors
+
+
+def main(args=None):
+    import argparse
+    argparser = argparse.ArgumentParser(description="Rebuild the table of "
+            "library releases the converter copies as they are")
+    argparser.add_argument('table', nargs='?', default=table_path,
+            help="Table file (default: known_libraries.sha1 next to the "
+                "converter)")
+    argparser.add_argument('-j', '--jobs', type=int, default=8, metavar='N',
+            help="Number of downloads at the same time (default: 8)")
+    args = argparser.parse_args(args)
+
+    errors = build_table(args.table, jobs=args.jobs)
+    for url in sorted(errors):
+        print("Could not fetch %s: %s" % (url, errors[url]))
+    print("%d of %d release files fetched" % (
+            len(library_releases) - len(errors), len(library_releases)))
+    if errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
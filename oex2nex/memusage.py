@@ -0,0 +1,172 @@
+#!python
+""" Memory and time accounting for the conversion stages and the files of a
+package.
+Python 2 has no tracemalloc, so the meter samples the resident set size of
+the process (/proc/self/statm) and its high-water mark. By default that only
+shows the growth over the earlier peak of the process. A meter that may
+reset the mark at every sample (/proc/self/clear_refs, Linux only) sees the
+peak within each stage and file; that changes the mark for the whole
+process, so only processes doing nothing but conversions, like the command
+line tools and batch workers, ask for it. Sizes are in kilobytes, None where
+the platform does not provide them. """
+
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    # no getrusage on this platform, peaks are not measured
+    resource = None
+
+
+def current_rss():
+    """ Returns the resident set size of the process in kB, or None """
+    try:
+        fh = open("/proc/self/statm")
+        try:
+            pages = int(fh.read().split()[1])
+        finally:
+            fh.close()
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return pages * (os.sysconf("SC_PAGE_SIZE") // 1024)
+
+
+def peak_rss():
+    """ Returns the highest resident set size the process had so far (or
+    since reset_peak()) in kB, or None """
+    try:
+        fh = open("/proc/self/status")
+        try:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+        finally:
+            fh.close()
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes there, kB everywhere else
+        peak //= 1024
+    return peak
+
+
+def reset_peak():
+    """ Sets the high-water mark of peak_rss() to the current resident set
+    size. Returns False where that is not possible """
+    try:
+        fh = open("/proc/self/clear_refs", "w")
+        try:
+            fh.write("5")
+        finally:
+            fh.close()
+    except (IOError, OSError):
+        return False
+    return True
+
+
+class _Sample(object):
+    """ A measurement: the time and resident set size at its start and the
+    highest size seen since then """
+    def __init__(self, rss, process_peak):
+        self.time = time.time()
+        self.rss = rss
+        self.peak = rss
+        # the high-water mark of the process at the start, for platforms
+        # where it can not be reset
+        self.process_peak = process_peak
+
+    def growth(self):
+        """ Returns how far the peak went over the start, or None """
+        if self.rss is None or self.peak is None:
+            return None
+        return self.peak - self.rss
+
+
+class MemoryMeter(object):
+    """
+    Records the memory used by the stages of a conversion and by the
+    handling of each file. A stage records how far the resident set went
+    over its size at the start of the stage ("peak") and how much of that
+    it still held at the end ("rss", negative when it released more than
+    it allocated). Files only record the former and only if it is not zero.
+    Stages and files overlap, the high-water mark goes into every open
+    measurement before it is reset. With reset_peaks unset the mark of the
+    process is left alone and the peaks are the growth over it. The time
+    taken by the stages and by parts of the work done across files (see
+    add_time()) is kept in seconds.
+    """
+    def __init__(self, reset_peaks=False):
+        self.stages = {}
+        self.files = {}
+        self.seconds = {}
+        self._open = []
+        self._resets = reset_peaks
+        self._start = self.sample()
+
+    def _update(self):
+        """ Takes the high-water mark into the open measurements and resets
+        it. Returns the current resident set size and the mark """
+        peak = peak_rss()
+        rss = current_rss()
+        if peak is not None:
+            for sample in self._open:
+                if self._resets:
+                    sample.peak = max(sample.peak, peak)
+                else:
+                    # only the growth over the earlier peak of the process
+                    sample.peak = max(sample.peak, sample.rss + peak
+                                      - sample.process_peak)
+        if self._resets:
+            self._resets = reset_peak()
+        return (rss, peak)
+
+    def sample(self):
+        """ Starts a measurement, returns it for add_stage() or add_file() """
+        (rss, peak) = self._update()
+        sample = _Sample(rss, peak)
+        if rss is not None:
+            self._open.append(sample)
+        return sample
+
+    def _finish(self, before):
+        """ Ends the measurement before, returns the resident set size """
+        rss = self._update()[0]
+        if before in self._open:
+            self._open.remove(before)
+        return rss
+
+    def add_stage(self, name, before):
+        """ Records the stage name, which started with the sample before """
+        rss = self._finish(before)
+        held = None
+        if rss is not None and before.rss is not None:
+            held = rss - before.rss
+        self.stages[name] = {"peak": before.growth(), "rss": held}
+        self.seconds[name] = time.time() - before.time
+
+    def add_time(self, name, start):
+        """ Adds the time since start (a time.time()) to the seconds of
+        name, without sampling the memory """
+        self.seconds[name] = self.seconds.get(name, 0) + time.time() - start
+
+    def add_file(self, name, before):
+        """ Records the handling of file name, which started with the sample
+        before """
+        self._finish(before)
+        peak = before.growth()
+        if peak:
+            self.files[name] = max(self.files.get(name, 0), peak)
+
+    def report(self):
+        """ Returns the measurements for the conversion stats: the highest
+        resident set size during the conversion, how far that went over the
+        size at the start, the stages and the files """
+        self._finish(self._start)
+        return {"peak": self._start.peak,
+                "peak_growth": self._start.growth(),
+                "stages": self.stages, "files": self.files}
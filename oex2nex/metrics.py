@@ -0,0 +1,260 @@
+#!python
+""" Throughput metrics of batch conversions: counters and histograms written
+as a Prometheus text format file (e.g. for the node_exporter textfile
+collector) and a JSON lines stream of package start and finish events """
+
+import os
+import re
+import json
+import time
+import tempfile
+
+# upper bounds of the histogram buckets, in seconds
+default_buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+                   300)
+
+# the kinds of conversion warnings, by the start of their text
+warning_types = (
+    ("parse_failure", "Script parsing failed"),
+    ("script_limit", "Script exceeds the"),
+    ("fix_error", "Exception while fixing script"),
+    ("minify", "Could not minify"),
+    ("speeddial", "Invalid speed dial"),
+)
+
+
+def warning_type(warning):
+    """ Returns the kind of a conversion warning, "other" for unknown
+    ones """
+    for (kind, start) in warning_types:
+        if warning.startswith(start):
+            return kind
+    return "other"
+
+
+def package_metrics(convertor, in_file, out_file):
+    """ Returns the metrics of a conversion by the Oex2Nex convertor for the
+    journal record of the package: sizes, stage times, parse failures,
+    warnings by kind and cache use """
+    stats = convertor.stats
+    warnings = {}
+    for warning in convertor.warnings:
+        kind = warning_type(warning)
+        warnings[kind] = warnings.get(kind, 0) + 1
+    return {"bytes_in": _size(in_file), "bytes_out": _size(out_file),
+            "stages": dict(stats.get("seconds", {})),
+            "parse_failures": stats.get("parse_failures", 0),
+            "warnings": warnings, "cached": stats.get("cached", False),
+            "reused": stats.get("reused", 0),
+            "skipped": len(stats.get("skipped", ()))}
+
+
+def _size(path):
+    """ The size of a file, or of the files in a directory """
+    if not isinstance(path, basestring):
+        return 0
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(top, fname))
+                   for (top, _dirns, fnames) in os.walk(path)
+                   for fname in fnames)
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class Histogram(object):
+    """ A Prometheus histogram: cumulative bucket counts, sum and count """
+    def __init__(self, buckets=default_buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for (i, bound) in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, re.sub(r'(["\\\\])', r"\\\1",
+                                                       unicode(value)))
+                             for (name, value) in labels)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class BatchMetrics(object):
+    """
+    Collects the metrics of the packages converted by a BatchRunner, from
+    the journal records with package_metrics(). The Prometheus file
+    prom_file is rewritten at most every interval seconds while packages
+    finish and once at the end of a run, the events go to events_file as
+    they happen. Either file may be None.
+    """
+    # name: (type, help)
+    described = {
+        "oex2nex_packages_total": ("counter",
+                "Packages handled, by status"),
+        "oex2nex_packages_in_progress": ("gauge",
+                "Packages being converted"),
+        "oex2nex_packages_per_second": ("gauge",
+                "Packages handled per second since the start"),
+        "oex2nex_start_time_seconds": ("gauge",
+                "Start of the run, as a Unix time"),
+        "oex2nex_package_seconds": ("histogram",
+                "Time taken by a package"),
+        "oex2nex_stage_seconds": ("histogram",
+                "Time taken by a conversion stage of a package"),
+        "oex2nex_bytes_in_total": ("counter",
+                "Size of the converted packages"),
+        "oex2nex_bytes_out_total": ("counter",
+                "Size of the converted packages' output"),
+        "oex2nex_parse_failures_total": ("counter",
+                "Scripts that did not parse"),
+        "oex2nex_warnings_total": ("counter",
+                "Conversion warnings, by kind"),
+        "oex2nex_result_cache_total": ("counter",
+                "Conversions taken from the result cache (hit) or not "
+                "(miss)"),
+        "oex2nex_transforms_reused_total": ("counter",
+                "File transforms reused for copies of a file"),
+        "oex2nex_scripts_skipped_total": ("counter",
+                "Library scripts copied without fixes"),
+    }
+
+    def __init__(self, prom_file=None, events_file=None, interval=1,
+                 buckets=default_buckets):
+        self.prom_file = prom_file
+        self.interval = interval
+        self.buckets = buckets
+        self.start = time.time()
+        self._written = 0
+        self._events = open(events_file, "a") if events_file else None
+        # values by (name, labels)
+        self.values = {}
+        self.histograms = {}
+        self.running = set()
+        self._set("oex2nex_start_time_seconds", self.start)
+
+    def _add(self, name, value=1, labels=()):
+        self.values[(name, labels)] = self.values.get((name, labels),
+                                                      0) + value
+
+    def _set(self, name, value, labels=()):
+        self.values[(name, labels)] = value
+
+    def _observe(self, name, value, labels=()):
+        if (name, labels) not in self.histograms:
+            self.histograms[(name, labels)] = Histogram(self.buckets)
+        self.histograms[(name, labels)].observe(value)
+
+    def _event(self, event):
+        if self._events is not None:
+            self._events.write(json.dumps(event, sort_keys=True) + "\n")
+            self._events.flush()
+
+    def started(self, in_file):
+        """ Records the start of the conversion of in_file """
+        self.running.add(in_file)
+        self._event({"event": "start", "time": round(time.time(), 3),
+                     "file": in_file})
+
+    def finished(self, record):
+        """ Records the journal record of a package """
+        self.running.discard(record["file"])
+        self._add("oex2nex_packages_total", labels=(("status",
+                                                     record["status"]),))
+        if record.get("seconds") is not None:
+            self._observe("oex2nex_package_seconds", record["seconds"])
+        metrics = record.get("metrics")
+        if metrics:
+            self._add("oex2nex_bytes_in_total", metrics["bytes_in"])
+            self._add("oex2nex_bytes_out_total", metrics["bytes_out"])
+            self._add("oex2nex_parse_failures_total",
+                      metrics["parse_failures"])
+            for (stage, seconds) in metrics["stages"].items():
+                self._observe("oex2nex_stage_seconds", seconds,
+                              (("stage", stage),))
+            for (kind, count) in metrics["warnings"].items():
+                self._add("oex2nex_warnings_total", count,
+                          (("type", kind),))
+            self._add("oex2nex_result_cache_total", labels=(
+                    ("result", "hit" if metrics["cached"] else "miss"),))
+            self._add("oex2nex_transforms_reused_total", metrics["reused"])
+            self._add("oex2nex_scripts_skipped_total", metrics["skipped"])
+        event = {"event": "finish", "time": round(time.time(), 3)}
+        for key in ("file", "status", "seconds", "error", "metrics"):
+            event[key] = record.get(key)
+        self._event(event)
+        self.tick()
+
+    def tick(self):
+        """ Writes the Prometheus file if interval has passed since it was
+        written last """
+        if time.time() - self._written >= self.interval:
+            self.write()
+
+    def render(self):
+        """ Returns the metrics in the Prometheus text format """
+        now = time.time()
+        done = sum(value for ((name, _labels), value) in self.values.items()
+                   if name == "oex2nex_packages_total")
+        self._set("oex2nex_packages_in_progress", len(self.running))
+        self._set("oex2nex_packages_per_second",
+                  done / max(now - self.start, 1e-6))
+        lines = []
+        for name in sorted(self.described):
+            (kind, help_text) = self.described[name]
+            samples = []
+            for ((sample, labels), value) in sorted(self.values.items()):
+                if sample == name:
+                    samples.append("%s%s %s" % (name, _labels(labels),
+                                                _number(value)))
+            for ((sample, labels), hist) in sorted(self.histograms.items()):
+                if sample != name:
+                    continue
+                for (bound, count) in zip(hist.buckets, hist.counts):
+                    samples.append("%s_bucket%s %d" % (name, _labels(
+                            labels + (("le", _number(bound)),)), count))
+                samples.append("%s_bucket%s %d" % (name, _labels(
+                        labels + (("le", "+Inf"),)), hist.count))
+                samples.append("%s_sum%s %s" % (name, _labels(labels),
+                                                _number(hist.sum)))
+                samples.append("%s_count%s %d" % (name, _labels(labels),
+                                                  hist.count))
+            if samples:
+                lines.append("# HELP %s %s" % (name, help_text))
+                lines.append("# TYPE %s %s" % (name, kind))
+                lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """ Writes the Prometheus file, through a rename so a scraper never
+        reads half of it """
+        self._written = time.time()
+        if not self.prom_file:
+            return
+        text = self.render()
+        dirname = os.path.dirname(os.path.abspath(self.prom_file))
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".metrics-")
+        fh = os.fdopen(fd, "w")
+        try:
+            fh.write(text.encode("utf-8"))
+        finally:
+            fh.close()
+        os.rename(tmp, self.prom_file)
+
+    def close(self):
+        """ Writes the Prometheus file and closes the event stream """
+        self.write()
+        if self._events is not None:
+            self._events.close()
+            self._events = None
@@ -0,0 +1,95 @@
+#!python
+""" The manifest.json of a converted extension """
+
+import json
+from collections import OrderedDict
+
+# Order of the keys in the written manifest.json, keys not listed here follow
+# in alphabetical order
+manifest_keys = ("name", "developer", "description", "manifest_version",
+                 "version", "background", "icons", "browser_action",
+                 "options_page", "default_locale", "content_scripts",
+                 "web_accessible_resources", "permissions", "speeddial",
+                 "content_security_policy")
+
+
+def _text(value):
+    """
+    Returns value with all byte strings in it decoded from UTF-8 and dicts
+    turned into OrderedDicts. json.dumps can not mix non-ASCII byte strings
+    with unicode when ensure_ascii is off, so the manifest only holds
+    unicode.
+    """
+    if isinstance(value, str):
+        return value.decode("utf-8")
+    if isinstance(value, OrderedDict):
+        return OrderedDict((_text(k), _text(v)) for k, v in value.items())
+    if isinstance(value, dict):
+        # sorted, so the output does not depend on the hash order
+        return OrderedDict((_text(k), _text(v))
+                           for k, v in sorted(value.items()))
+    if isinstance(value, (list, tuple)):
+        return [_text(v) for v in value]
+    return value
+
+
+class Manifest(object):
+    """
+    The fields of manifest.json, collected while the package is converted and
+    serialized once by to_json(). Fields are set like dict items, resources
+    and content scripts are appended as they are found, so building the
+    manifest of a package with thousands of files stays linear.
+    """
+    def __init__(self):
+        self._fields = {"manifest_version": 2}
+        self.resources = []
+        self.content_scripts = []
+
+    def __setitem__(self, key, value):
+        self._fields[key] = _text(value)
+
+    def __getitem__(self, key):
+        return self.to_dict()[key]
+
+    def __contains__(self, key):
+        return key in self.to_dict()
+
+    def add_resource(self, path):
+        """ Adds path to the web_accessible_resources """
+        self.resources.append(_text(path))
+
+    def add_content_script(self, js, matches, include_globs=None,
+                           exclude_globs=None):
+        """ Adds a content_scripts entry run at document_start in all frames
+        """
+        self.content_scripts.append(OrderedDict((
+            ("js", _text(js)),
+            ("matches", _text(matches)),
+            ("include_globs", _text(include_globs or [])),
+            ("exclude_globs", _text(exclude_globs or [])),
+            ("run_at", u"document_start"),
+            ("all_frames", True),
+        )))
+
+    def to_dict(self):
+        """ Returns the manifest as an OrderedDict in manifest_keys order """
+        fields = dict(self._fields)
+        if self.content_scripts:
+            fields["content_scripts"] = self.content_scripts
+        if self.resources:
+            fields["web_accessible_resources"] = self.resources
+        data = OrderedDict()
+        for key in manifest_keys:
+            if key in fields:
+                data[key] = fields.pop(key)
+        for key in sorted(fields):
+            data[key] = fields[key]
+        return data
+
+    def to_json(self):
+        """ Returns the manifest.json text as unicode """
+        data = json.dumps(self.to_dict(), ensure_ascii=False, indent=2,
+                          separators=(",", ": ")) + "\n"
+        if isinstance(data, str):
+            data = data.decode("utf-8")
+        return data
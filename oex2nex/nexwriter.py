@@ -0,0 +1,233 @@
+#!python
+""" Writing of the .nex archive with the entries compressed in parallel """
+
+import os
+import time
+import zlib
+import struct
+import zipfile
+import multiprocessing
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+# Already compressed formats, deflating them only costs time
+stored_types = frozenset((".png", ".jpg", ".jpeg", ".gif", ".ico", ".webp",
+                          ".zip", ".gz", ".crx", ".nex", ".oex", ".woff",
+                          ".woff2", ".mp3", ".ogg", ".oga", ".mp4", ".webm",
+                          ".swf"))
+
+
+def fixed_date_time():
+    """ Returns the ZipInfo date_time used for reproducible output, taken
+    from SOURCE_DATE_EPOCH if it is set """
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch:
+        date_time = time.gmtime(int(epoch))[:6]
+        if date_time[0] >= 1980:
+            return date_time
+    # the earliest date a zip file can hold
+    return (1980, 1, 1, 0, 0, 0)
+
+
+def _compressible(data):
+    """ Whether deflating data is worth it, judged by a fast compression of
+    its start """
+    sample = data[:65536]
+    return len(zlib.compress(sample, 1)) < len(sample)
+
+
+def _compress(data, level):
+    """ Returns (crc, compress_type, compressed data) for an entry. Runs on
+    the worker threads, zlib releases the GIL while it works """
+    crc = zlib.crc32(data) & 0xffffffff
+    if level and _compressible(data):
+        co = zlib.compressobj(level, zlib.DEFLATED, -15)
+        compressed = co.compress(data) + co.flush()
+        if len(compressed) < len(data):
+            return (crc, zipfile.ZIP_DEFLATED, compressed)
+    return (crc, zipfile.ZIP_STORED, data)
+
+
+def _encoded_name(zinfo):
+    """ Returns the file name of zinfo as bytes and its flag bits, with the
+    UTF-8 flag for names that are not ASCII """
+    name = zinfo.filename
+    if isinstance(name, unicode):
+        try:
+            return (name.encode("ascii"), zinfo.flag_bits)
+        except UnicodeEncodeError:
+            return (name.encode("utf-8"), zinfo.flag_bits | 0x800)
+    return (name, zinfo.flag_bits)
+
+
+def _dos_date_time(date_time):
+    """ Returns the (date, time) of a ZipInfo date_time in MS-DOS format """
+    (year, month, day, hour, minute, second) = date_time
+    return ((year - 1980) << 9 | month << 5 | day,
+            hour << 11 | minute << 5 | second // 2)
+
+
+class NexWriter(object):
+    """
+    A write only zipfile.ZipFile replacement for the output package. Entries
+    given to writestr() are compressed on a pool of jobs threads while the
+    conversion goes on, and appended to the archive in the order they were
+    given, so the output is the same as with a single thread. jobs of 1
+    compresses them on the calling thread.
+
+    level is the zlib compression level, 0 stores all entries. Entries with
+    a stored_types extension, or that do not get smaller, are always stored.
+
+    With reproducible set all entries get the fixed_date_time() and are
+    written sorted by name when the writer is flushed, so the same entries
+    always give the same bytes.
+
+    The records are written here rather than by ZipFile.writestr(), which
+    always compresses at zlib's default level on the calling thread. The
+    archives are read back with zipfile. Archives that would need ZIP64
+    raise zipfile.LargeZipFile, package_limits keeps packages far below.
+    """
+    def __init__(self, file, level=6, jobs=None, reproducible=False):
+        if isinstance(file, basestring):
+            self._file = file
+            self._fp = open(file, "wb")
+        else:
+            self._file = None
+            self._fp = file
+        self._level = level
+        self._reproducible = reproducible
+        if reproducible:
+            self._date_time = fixed_date_time()
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+        self._pool = ThreadPool(jobs) if jobs > 1 else None
+        self._names = []
+        # entries waiting to be written: (ZipInfo, size, result)
+        self._pending = deque()
+        # entries written, for the central directory
+        self._written = []
+        self._closed = False
+
+    def writestr(self, name, data):
+        """ Queues data to be written as name """
+        self._write_ready()
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        if self._reproducible:
+            date_time = self._date_time
+        else:
+            date_time = time.localtime(time.time())[:6]
+        zinfo = zipfile.ZipInfo(filename=name, date_time=date_time)
+        zinfo.external_attr = 0o600 << 16
+        level = self._level
+        if os.path.splitext(name)[1].lower() in stored_types:
+            level = 0
+        self._names.append(zinfo.filename)
+        if self._pool is None:
+            self._pending.append((zinfo, len(data), _compress(data, level)))
+        else:
+            self._pending.append((zinfo, len(data),
+                    self._pool.apply_async(_compress, (data, level))))
+
+    def _write_ready(self, wait=False):
+        """ Writes the entries at the front of the queue that are done
+        compressing, or all of them if wait is set. Entries are only
+        written on flush() in reproducible mode """
+        if self._reproducible and not wait:
+            return
+        if self._reproducible:
+            # sorted is stable, duplicate names keep their order
+            self._pending = deque(sorted(self._pending,
+                                         key=lambda entry: entry[0].filename))
+        while self._pending:
+            zinfo, size, result = self._pending[0]
+            if not isinstance(result, tuple):
+                if not wait and not result.ready():
+                    return
+                # raises the error of a worker thread
+                result = result.get()
+            self._pending.popleft()
+            self._write_record(zinfo, size, result)
+
+    def _write_record(self, zinfo, size, result):
+        """ Appends the local header and data of an entry compressed by
+        _compress() """
+        zinfo.CRC, zinfo.compress_type, data = result
+        zinfo.file_size = size
+        zinfo.compress_size = len(data)
+        zinfo.header_offset = self._fp.tell()
+        if max(zinfo.file_size, zinfo.compress_size,
+               zinfo.header_offset) > zipfile.ZIP64_LIMIT:
+            raise zipfile.LargeZipFile("Filesize would require ZIP64 "
+                                       "extensions")
+        (name, flag_bits) = _encoded_name(zinfo)
+        (dosdate, dostime) = _dos_date_time(zinfo.date_time)
+        self._fp.write(struct.pack(zipfile.structFileHeader,
+                zipfile.stringFileHeader, zinfo.extract_version,
+                zinfo.reserved, flag_bits, zinfo.compress_type, dostime,
+                dosdate, zinfo.CRC, zinfo.compress_size, zinfo.file_size,
+                len(name), 0))
+        self._fp.write(name)
+        self._fp.write(data)
+        self._written.append(zinfo)
+
+    def _write_central_directory(self):
+        start = self._fp.tell()
+        for zinfo in self._written:
+            (name, flag_bits) = _encoded_name(zinfo)
+            (dosdate, dostime) = _dos_date_time(zinfo.date_time)
+            self._fp.write(struct.pack(zipfile.structCentralDir,
+                    zipfile.stringCentralDir, zinfo.create_version,
+                    zinfo.create_system, zinfo.extract_version,
+                    zinfo.reserved, flag_bits, zinfo.compress_type, dostime,
+                    dosdate, zinfo.CRC, zinfo.compress_size,
+                    zinfo.file_size, len(name), 0, 0, 0,
+                    zinfo.internal_attr, zinfo.external_attr,
+                    zinfo.header_offset))
+            self._fp.write(name)
+        end = self._fp.tell()
+        if len(self._written) > 0xffff or end > zipfile.ZIP64_LIMIT:
+            raise zipfile.LargeZipFile("Archive would require ZIP64 "
+                                       "extensions")
+        self._fp.write(struct.pack(zipfile.structEndArchive,
+                zipfile.stringEndArchive, 0, 0, len(self._written),
+                len(self._written), end - start, start, 0))
+
+    def flush(self):
+        """ Waits for and writes all queued entries """
+        self._write_ready(wait=True)
+        self._fp.flush()
+
+    def namelist(self):
+        """ Returns the names of the written and queued entries """
+        return list(self._names)
+
+    def extractall(self, path):
+        """ Finishes the archive and extracts it to the directory path """
+        self.close()
+        if self._file is None:
+            self._fp.seek(0)
+            nex = zipfile.ZipFile(self._fp)
+        else:
+            nex = zipfile.ZipFile(self._file)
+        try:
+            nex.extractall(path)
+        finally:
+            nex.close()
+
+    def close(self):
+        """ Writes the queued entries and the central directory """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush()
+            self._write_central_directory()
+            self._fp.flush()
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+            if self._file is not None:
+                self._fp.close()
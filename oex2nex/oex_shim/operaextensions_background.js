@@ -932,6 +932,48 @@ var OStorage = function () {
     }.bind(this)
   });
 
+  // Set many items at once (e.g. the default preferences from config.xml)
+  // with a single message to the connected ports
+  Object.defineProperty(OStorage.prototype, "setItems", {
+    value: function( items, proxiedChange ) {
+      var storageEvts = [];
+
+      for(var key in items) {
+        var oldVal = this._storage.getItem(key);
+
+        this._storage.setItem(key, items[key]);
+
+        if( !this[key] ) {
+          this.length++;
+        }
+        this[key] = items[key];
+
+        storageEvts.push(new OEvent('storage', {
+          "key": key,
+          "oldValue": oldVal,
+          "newValue": this._storage.getItem(key),
+          "url": chrome.extension.getURL(""),
+          "storageArea": this._storage
+        }));
+      }
+
+      if( !proxiedChange ) {
+        OEX.postMessage({
+          "action": "___O_widgetPreferences_setItems_RESPONSE",
+          "data": {
+            "items": items
+          }
+        });
+      }
+
+      // Create and fire 'storage' events on window object
+      for(var i = 0, l = storageEvts.length; i < l; i++) {
+        global.dispatchEvent( storageEvts[i] );
+      }
+
+    }.bind(this)
+  });
+
   Object.defineProperty(OStorage.prototype, "clear", {
     value: function( proxiedChange ) {
       this._storage.clear();
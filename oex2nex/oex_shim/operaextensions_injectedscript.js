@@ -670,6 +670,15 @@ var OWidgetObjProxy = function() {
 
         break;
 
+      // Update many storage items at once
+      case '___O_widgetPreferences_setItems_RESPONSE':
+
+        for(var key in msg.data.data.items) {
+          this._preferences.setItem( key, msg.data.data.items[key], true );
+        }
+
+        break;
+
       // Remove a storage item
       case '___O_widgetPreferences_removeItem_RESPONSE':
 
@@ -0,0 +1,190 @@
+#!python
+""" A store of converted packages, so an unchanged input is not converted
+again """
+
+import os
+import json
+import time
+import glob
+import shutil
+import hashlib
+import tempfile
+from shims import _write_atomic
+try:
+    import fcntl
+except ImportError:
+    # e.g. on Windows, concurrent processes may then lose counts
+    fcntl = None
+
+_code_digest = None
+
+
+def code_version():
+    """
+    Returns a hash of the converter code and the shims, so results of an
+    older converter or shim version are never reused.
+    """
+    global _code_digest
+    if _code_digest is None:
+        base = os.path.dirname(os.path.abspath(__file__))
+        paths = (glob.glob(os.path.join(base, "*.py"))
+                 + glob.glob(os.path.join(base, "oex_shim", "*")))
+        digest = hashlib.sha1()
+        for path in sorted(paths):
+            digest.update(os.path.relpath(path, base) + "\0")
+            _update_from_file(digest, path)
+        _code_digest = digest.hexdigest()
+    return _code_digest
+
+
+def _update_from_file(digest, path):
+    fh = open(path, "rb")
+    try:
+        for chunk in iter(lambda: fh.read(1 << 16), ""):
+            digest.update(chunk)
+    finally:
+        fh.close()
+
+
+class ResultCache(object):
+    """
+    Converted packages stored in directory by the hash of the input, the
+    converter and shim code and the conversion options. Entries not used for
+    max_age seconds are dropped, and the least recently used ones go when
+    the store gets over max_size bytes. Hits and misses are counted in
+    stats.json in the directory, under a lock as processes converting in
+    parallel share it.
+    """
+    def __init__(self, directory, max_size=512 * 1024 * 1024,
+                 max_age=30 * 24 * 3600):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def key(self, in_file, options):
+        """ Returns the key of the result of converting the package file
+        in_file with the given options (a dict that can be dumped as JSON) """
+        digest = hashlib.sha1(code_version())
+        digest.update(json.dumps(options, sort_keys=True))
+        _update_from_file(digest, in_file)
+        return digest.hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    def get(self, key):
+        """ Returns (nex_path, meta) for a stored result, meta being the dict
+        given to put(), or None if there is no such result """
+        nex_path = self._path(key, ".nex")
+        try:
+            fh = open(self._path(key, ".json"), "rb")
+            meta = json.load(fh)
+            fh.close()
+            # the time of use is what eviction goes by
+            os.utime(nex_path, None)
+        except (IOError, OSError, ValueError):
+            self._count("misses")
+            return None
+        self._count("hits")
+        return (nex_path, meta)
+
+    def put(self, key, nex_file, meta):
+        """ Stores a copy of the package nex_file (a path or a file-like
+        object to read it from) and meta (e.g. warnings) as the result for
+        key """
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            if isinstance(nex_file, basestring):
+                os.close(fd)
+                shutil.copyfile(nex_file, tmp)
+            else:
+                fh = os.fdopen(fd, "wb")
+                try:
+                    shutil.copyfileobj(nex_file, fh)
+                finally:
+                    fh.close()
+            os.rename(tmp, self._path(key, ".nex"))
+        except (IOError, OSError):
+            return
+        # written last, entries without it are not complete
+        _write_atomic(self._path(key, ".json"), json.dumps(meta))
+        self.evict()
+
+    def _entries(self):
+        """ Returns a list of (last use, size, key) of the stored results """
+        entries = []
+        for nex_path in glob.glob(os.path.join(self.directory, "*.nex")):
+            key = os.path.basename(nex_path)[:-4]
+            size = 0
+            try:
+                used = os.path.getmtime(nex_path)
+                for ext in (".nex", ".json"):
+                    if os.path.exists(self._path(key, ext)):
+                        size += os.path.getsize(self._path(key, ext))
+            except OSError:
+                continue
+            entries.append((used, size, key))
+        return entries
+
+    def _remove(self, key):
+        for ext in (".json", ".nex"):
+            try:
+                os.unlink(self._path(key, ext))
+            except OSError:
+                pass
+
+    def evict(self):
+        """ Drops the results not used for max_age seconds, then the least
+        recently used ones until the store fits in max_size bytes """
+        entries = sorted(self._entries())
+        now = time.time()
+        total = sum(size for (_used, size, _key) in entries)
+        for used, size, key in entries:
+            if ((self.max_age and now - used > self.max_age)
+                    or (self.max_size and total > self.max_size)):
+                self._remove(key)
+                total -= size
+
+    def _load_counts(self):
+        try:
+            fh = open(os.path.join(self.directory, "stats.json"), "rb")
+            counts = json.load(fh)
+            fh.close()
+        except (IOError, ValueError):
+            counts = {}
+        return {"hits": counts.get("hits", 0),
+                "misses": counts.get("misses", 0)}
+
+    def _count(self, event):
+        """ Adds one to the count of event in stats.json. The read and the
+        write are done holding a lock on stats.lock, so no count of another
+        process is lost in between """
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            lock = open(os.path.join(self.directory, "stats.lock"), "a")
+        except (IOError, OSError):
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            counts = self._load_counts()
+            counts[event] += 1
+            _write_atomic(os.path.join(self.directory, "stats.json"),
+                          json.dumps(counts))
+        finally:
+            # closing it releases the lock
+            lock.close()
+
+    def stats(self):
+        """ Returns the hit and miss counts, the hit rate and the number and
+        total size of the stored results """
+        counts = self._load_counts()
+        lookups = counts["hits"] + counts["misses"]
+        entries = self._entries()
+        counts["hit_rate"] = float(counts["hits"]) / lookups if lookups else 0.0
+        counts["entries"] = len(entries)
+        counts["size"] = sum(size for (_used, size, _key) in entries)
+        return counts
@@ -0,0 +1,170 @@
+#!python
+""" Helpers for the oex_shim scripts added to converted extensions """
+
+import os
+import re
+import hashlib
+import tempfile
+from jsbackend import get_backend
+
+# Optional modules of the shim builds in the order they appear in the file.
+# Each entry is the module name and a pattern matching its first line; a
+# module runs up to the start of the next one, the last one up to the end
+# pattern. Every module ends with the top level if(manifest ...) blocks that
+# install it, so only shims laid out like that can be listed here.
+shim_modules = {
+    "operaextensions_background.js": {
+        "modules": (
+            ("tabs", r"^var BrowserWindowManager = function"),
+            ("toolbar", r"^var ToolbarContext = function"),
+            ("menu", r"^var MenuEvent = function"),
+            ("speeddial", r"^var SpeeddialContext = function"),
+            ("urlfilter", r"^/\*\s*\n \* This file is part of the Adblock Plus"),
+        ),
+        "end": r"^if \(global\.opera\) \{",
+    },
+}
+
+_guard_start = re.compile(r"^if\s*\(")
+_guard_end = re.compile(r"^\}\s*$")
+
+
+def modules_for_manifest(permissions, browser_action=False, speeddial=False):
+    """
+    Returns the names of the shim modules an extension with the given
+    manifest permissions, browser_action and speeddial entries uses. These
+    are the same checks the shim itself does when it installs a module.
+    """
+    permissions = set(permissions)
+    used = set()
+    if "tabs" in permissions:
+        used.add("tabs")
+    if browser_action:
+        used.add("toolbar")
+    if "contextMenus" in permissions:
+        used.add("menu")
+    if speeddial:
+        used.add("speeddial")
+    if "webRequest" in permissions and "webRequestBlocking" in permissions:
+        used.add("urlfilter")
+    return used
+
+
+def _module_spans(data, layout):
+    """
+    Returns a list of (name, start, end) offsets of the modules in data or
+    None if the shim does not look the way layout describes it.
+    """
+    starts = []
+    for name, pattern in layout["modules"]:
+        m = re.search(pattern, data, flags=re.M)
+        if m is None:
+            return None
+        starts.append((name, m.start()))
+    m = re.search(layout["end"], data, flags=re.M)
+    if m is None:
+        return None
+    starts.append((None, m.start()))
+    spans = []
+    for (name, start), (_next, end) in zip(starts, starts[1:]):
+        if end <= start:
+            return None
+        spans.append((name, start, end))
+    return spans
+
+
+def _guards(module):
+    """
+    Returns the top level if blocks of a module. Their conditions are false
+    when the module is not used, but their else branches still need to run
+    (e.g. to flag the feature as loaded for opera.isReady).
+    """
+    kept = []
+    in_guard = False
+    for line in module.splitlines(True):
+        if not in_guard and _guard_start.match(line):
+            in_guard = True
+        if in_guard:
+            kept.append(line)
+            if _guard_end.match(line):
+                in_guard = False
+    return "".join(kept)
+
+
+def trim(data, shim_name, used):
+    """
+    Returns the shim data without the code of the optional modules that are
+    not in used. Shims without a known layout are returned unchanged.
+    """
+    layout = shim_modules.get(shim_name)
+    if layout is None:
+        return data
+    spans = _module_spans(data, layout)
+    if spans is None:
+        return data
+    chunks = []
+    last = 0
+    for name, start, end in spans:
+        if name in used:
+            continue
+        chunks.append(data[last:start])
+        chunks.append(_guards(data[start:end]))
+        last = end
+    chunks.append(data[last:])
+    return "".join(chunks)
+
+
+def minify(data, cache_dir=None):
+    """
+    Returns the shim data minified with slimit, or None if it does not
+    parse. Minified shims are cached in cache_dir by the hash of data, so
+    every shim version (and trimmed variant) is only minified once.
+    """
+    backend = get_backend()
+    cache_file = None
+    if cache_dir:
+        if isinstance(data, unicode):
+            digest = hashlib.sha1(data.encode("utf-8")).hexdigest()
+        else:
+            digest = hashlib.sha1(data).hexdigest()
+        cache_file = os.path.join(cache_dir, "shims", digest + ".min.js")
+        if os.path.isfile(cache_file):
+            fh = open(cache_file, "rb")
+            minified = fh.read()
+            fh.close()
+            return minified
+    try:
+        minified = backend.minify(backend.parse(data))
+    except SyntaxError:
+        return None
+    if cache_file:
+        _write_atomic(cache_file, minified)
+    return minified
+
+
+def _write_atomic(path, data, raise_errors=False):
+    """ Writes data to path through a temporary file in the same directory
+    and a rename, so readers never see a partially written file. Failures
+    are ignored, the caches are optional, unless raise_errors is set. No
+    temporary file is left either way """
+    if isinstance(data, unicode):
+        data = data.encode("utf-8")
+    tmp = None
+    try:
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+        fh = os.fdopen(fd, "wb")
+        try:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        finally:
+            fh.close()
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+        if raise_errors:
+            raise
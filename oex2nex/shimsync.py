@@ -0,0 +1,237 @@
+#!python
+"""
+Keeps the oex_shim scripts in sync with the shim build server. The shims are
+downloaded concurrently with conditional requests (ETag and
+If-Modified-Since), so unchanged shims are not transferred again. Every
+downloaded version is kept in a cache directory under its SHA-1, and the
+shim files are only replaced once all of them have been downloaded and
+checked, each through a rename so no reader ever sees a partial file.
+"""
+
+import os
+import json
+import time
+import socket
+import hashlib
+import threading
+import urllib2
+from Queue import Queue, Empty
+from shims import _write_atomic
+
+shim_files = (
+    "operaextensions_background.js",
+    "operaextensions_popup.js",
+    "operaextensions_injectedscript.js",
+)
+
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+RESTORED = "restored"
+
+
+class ShimSyncError(Exception):
+    """ Raised when a shim could not be fetched, errors has the reason by
+    shim file """
+    def __init__(self, errors):
+        Exception.__init__(self, "; ".join("%s: %s" % (name, errors[name])
+                                           for name in sorted(errors)))
+        self.errors = errors
+
+
+class ShimAuthRequired(ShimSyncError):
+    """ Raised when the server asks for credentials, realm is the one it
+    gave """
+    def __init__(self, errors, realm):
+        ShimSyncError.__init__(self, errors)
+        self.realm = realm
+
+
+def _sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _read(path):
+    try:
+        fh = open(path, "rb")
+    except IOError:
+        return None
+    try:
+        return fh.read()
+    finally:
+        fh.close()
+
+
+class ShimSync(object):
+    """
+    Syncs the shim files from url (ending with "/") into shim_dir. The
+    versions and the ETag and Last-Modified of the last download of every
+    shim are kept in cache_dir. jobs threads download, every shim gets
+    retries more tries with a growing delay after network and server
+    errors. opener is the urllib2 opener to use, e.g. with authentication.
+    """
+    def __init__(self, url, shim_dir, cache_dir, files=shim_files, jobs=3,
+                 timeout=30, retries=3, opener=None):
+        self.url = url
+        self.shim_dir = shim_dir
+        self.cache_dir = cache_dir
+        self.files = files
+        self.jobs = jobs
+        self.timeout = timeout
+        self.retries = retries
+        self.opener = opener or urllib2.build_opener()
+        self._state_file = os.path.join(cache_dir, "state.json")
+
+    def _version_path(self, digest):
+        return os.path.join(self.cache_dir, "versions", digest + ".js")
+
+    def _load_state(self):
+        data = _read(self._state_file)
+        if data:
+            try:
+                return json.loads(data)
+            except ValueError:
+                pass
+        return {}
+
+    def version(self, name):
+        """ Returns the SHA-1 of the last version of shim name fetched, or
+        None """
+        return self._load_state().get(name, {}).get("sha1")
+
+    def _request(self, name, known):
+        """ Returns the request for shim name, conditional if the version
+        known is still in the cache """
+        request = urllib2.Request(self.url + name)
+        if known and os.path.isfile(self._version_path(known["sha1"])):
+            if known.get("etag"):
+                request.add_header("If-None-Match", known["etag"])
+            if known.get("last_modified"):
+                request.add_header("If-Modified-Since", known["last_modified"])
+        return request
+
+    def _fetch(self, name, known):
+        """ Fetches shim name. Returns a dict with the data (None when it is
+        not modified), etag and last_modified. Raises ShimSyncError """
+        attempt = 0
+        while True:
+            try:
+                response = self.opener.open(self._request(name, known),
+                                            timeout=self.timeout)
+                try:
+                    data = response.read()
+                    headers = response.info()
+                finally:
+                    response.close()
+                length = headers.get("Content-Length")
+                if length is not None and length.isdigit() \
+                        and int(length) != len(data):
+                    raise IOError("got %d of %s bytes" % (len(data), length))
+                if not data.strip() or data.lstrip()[:1] == "<":
+                    # e.g. a login or error page served with 200
+                    raise ShimSyncError({name: "not a script"})
+                return {"data": data, "etag": headers.get("ETag"),
+                        "last_modified": headers.get("Last-Modified")}
+            except urllib2.HTTPError as e:
+                if e.code == 304 and known:
+                    return {"data": None, "etag": known.get("etag"),
+                            "last_modified": known.get("last_modified")}
+                if e.code == 401:
+                    challenge = e.hdrs.get("WWW-Authenticate", "")
+                    realm = challenge.partition("=")[2].strip('"')
+                    raise ShimAuthRequired({name: "authentication required"},
+                                           realm)
+                if e.code < 500 or attempt >= self.retries:
+                    raise ShimSyncError({name: "HTTP %d %s" % (e.code,
+                                                               e.msg)})
+            except (urllib2.URLError, socket.error, IOError) as e:
+                if attempt >= self.retries:
+                    raise ShimSyncError({name: str(e)})
+            attempt += 1
+            time.sleep(0.5 * attempt)
+
+    def _fetch_all(self, state):
+        """ Fetches all shims in jobs threads. Returns the results by shim
+        name, raises ShimSyncError with the reasons of all failures """
+        todo = Queue()
+        for name in self.files:
+            todo.put(name)
+        results = {}
+        errors = {}
+        auth = []
+
+        def work():
+            while True:
+                try:
+                    name = todo.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[name] = self._fetch(name, state.get(name, {}))
+                except ShimAuthRequired as e:
+                    errors.update(e.errors)
+                    auth.append(e.realm)
+                except ShimSyncError as e:
+                    errors.update(e.errors)
+
+        threads = [threading.Thread(target=work)
+                   for _i in range(max(1, min(self.jobs, len(self.files))))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if auth:
+            raise ShimAuthRequired(errors, auth[0])
+        if errors:
+            raise ShimSyncError(errors)
+        return results
+
+    def run(self):
+        """
+        Fetches the shims and swaps in the changed ones. Returns what
+        happened to each shim by name: UPDATED (a new version was
+        downloaded), UNCHANGED or RESTORED (not modified on the server, but
+        the local file differed and was replaced by the cached version).
+        Raises ShimSyncError, without changing any shim file, when a shim
+        could not be fetched.
+        """
+        state = self._load_state()
+        results = self._fetch_all(state)
+        installs = []
+        status = {}
+        for name in self.files:
+            result = results[name]
+            path = os.path.join(self.shim_dir, name)
+            data = None
+            if result["data"] is None:
+                digest = state[name]["sha1"]
+                data = _read(self._version_path(digest))
+                if data is None or _sha1(data) != digest:
+                    # the cached version is gone or damaged, not modified
+                    # on the server does not help then
+                    data = None
+                    result = self._fetch(name, {})
+                else:
+                    status[name] = UNCHANGED
+            if data is None:
+                data = result["data"]
+                digest = _sha1(data)
+                _write_atomic(self._version_path(digest), data, True)
+                status[name] = UPDATED
+            current = _read(path)
+            if current is None or _sha1(current) != digest:
+                installs.append((path, data))
+                if status[name] == UNCHANGED:
+                    status[name] = RESTORED
+            elif status[name] == UPDATED and name in state \
+                    and state[name]["sha1"] == digest:
+                # downloaded again, e.g. a server without ETags
+                status[name] = UNCHANGED
+            state[name] = {"sha1": digest, "etag": result["etag"],
+                           "last_modified": result["last_modified"],
+                           "fetched": time.time()}
+        # everything is downloaded and in the cache, only renames are left
+        for (path, data) in installs:
+            _write_atomic(path, data, True)
+        _write_atomic(self._state_file, json.dumps(state, indent=1,
+                                                   sort_keys=True), True)
+        return status
@@ -2,8 +2,11 @@
 
 import unittest
 
+from tests.aliases import TestAliasTable, TestPrefsReplacements
 from tests.api_finder import TestAPIFinder
 from tests.browser_action import TestBrowserAction
+from tests.classify import TestClassify, TestClassifyStats
+from tests.minify import TestMinifyScripts, TestMinifyShims
 from tests.norm_version import TestNormVersion
 from tests.nex import TestNEX
 from tests.manifest import (TestManifest,
@@ -15,6 +18,32 @@ from tests.manifest import (TestManifest,
                             TestManifestEmptyAndNonEmptyIconSrc,
                             TestManifestDeveloperAttr,
                             TestManifestEmptyDeveloperAttr)
+from tests.script_limits import TestExportGlobals, TestScriptLimits
+from tests.shim_trim import TestShimTrim, TestTrimmedConversion
+from tests.content_scripts import (TestGroupContentScripts,
+                                   TestContentScriptsManifest)
+from tests.userscript_meta import (TestParseMetadata, TestGlobToMatch,
+                                   TestContentScriptMatches)
+from tests.inline_bundle import (TestInlineBundle, TestInlineBundleFallback,
+                                 TestInlineBundleRuns)
+from tests.locales import TestLocaleTransforms
+from tests.manifest_model import TestManifestModel
+from tests.nex_writer import TestNexWriter
+from tests.reproducible import TestReproducible
+from tests.result_cache import TestResultCache, TestCachedConversion
+from tests.batch_runner import TestBatchRunner
+from tests.shared_queue import TestWorkQueue
+from tests.catalogue_index import TestCatalogue
+from tests.js_backends import TestJSBackends
+from tests.in_memory import TestInMemory
+from tests.memory_use import TestMemoryUse
+from tests.scaling import TestScaling, TestScriptText
+from tests.package_triage import TestTriage
+from tests.vendor_scripts import TestVendorScripts
+from tests.library_table import TestLibraryTable
+from tests.shim_fetch import TestShimSync
+from tests.batch_metrics import TestBatchMetrics
+from tests.preferences import TestDefaultPrefs
 from tests.permissions import (TestContextMenuPerms, TestCookiesPerms,
                                TestTabsPerms, TestWebRequestPerms)
 
@@ -23,8 +52,14 @@ def tests():
     loader = unittest.TestLoader()
     suite = unittest.TestSuite()
     loader.sortTestMethodsUsing = None
+    suite.addTests(loader.loadTestsFromTestCase(TestAliasTable))
+    suite.addTests(loader.loadTestsFromTestCase(TestPrefsReplacements))
     suite.addTests(loader.loadTestsFromTestCase(TestAPIFinder))
     suite.addTests(loader.loadTestsFromTestCase(TestBrowserAction))
+    suite.addTests(loader.loadTestsFromTestCase(TestClassify))
+    suite.addTests(loader.loadTestsFromTestCase(TestClassifyStats))
+    suite.addTests(loader.loadTestsFromTestCase(TestMinifyScripts))
+    suite.addTests(loader.loadTestsFromTestCase(TestMinifyShims))
     suite.addTests(loader.loadTestsFromTestCase(TestNormVersion))
     suite.addTests(loader.loadTestsFromTestCase(TestNEX))
     suite.addTests(loader.loadTestsFromTestCase(TestManifest))
@@ -36,10 +71,42 @@ def tests():
     suite.addTests(loader.loadTestsFromTestCase(TestManifestSpeedDialAttr))
     suite.addTests(loader.loadTestsFromTestCase(TestManifestDeveloperAttr))
     suite.addTests(loader.loadTestsFromTestCase(TestManifestEmptyDeveloperAttr))
+    suite.addTests(loader.loadTestsFromTestCase(TestDefaultPrefs))
+    suite.addTests(loader.loadTestsFromTestCase(TestGroupContentScripts))
+    suite.addTests(loader.loadTestsFromTestCase(TestContentScriptsManifest))
+    suite.addTests(loader.loadTestsFromTestCase(TestParseMetadata))
+    suite.addTests(loader.loadTestsFromTestCase(TestGlobToMatch))
+    suite.addTests(loader.loadTestsFromTestCase(TestContentScriptMatches))
+    suite.addTests(loader.loadTestsFromTestCase(TestInlineBundle))
+    suite.addTests(loader.loadTestsFromTestCase(TestInlineBundleFallback))
+    suite.addTests(loader.loadTestsFromTestCase(TestInlineBundleRuns))
+    suite.addTests(loader.loadTestsFromTestCase(TestLocaleTransforms))
+    suite.addTests(loader.loadTestsFromTestCase(TestManifestModel))
+    suite.addTests(loader.loadTestsFromTestCase(TestNexWriter))
+    suite.addTests(loader.loadTestsFromTestCase(TestReproducible))
+    suite.addTests(loader.loadTestsFromTestCase(TestResultCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestCachedConversion))
+    suite.addTests(loader.loadTestsFromTestCase(TestBatchRunner))
+    suite.addTests(loader.loadTestsFromTestCase(TestWorkQueue))
+    suite.addTests(loader.loadTestsFromTestCase(TestCatalogue))
+    suite.addTests(loader.loadTestsFromTestCase(TestJSBackends))
+    suite.addTests(loader.loadTestsFromTestCase(TestInMemory))
+    suite.addTests(loader.loadTestsFromTestCase(TestMemoryUse))
+    suite.addTests(loader.loadTestsFromTestCase(TestScaling))
+    suite.addTests(loader.loadTestsFromTestCase(TestScriptText))
+    suite.addTests(loader.loadTestsFromTestCase(TestTriage))
+    suite.addTests(loader.loadTestsFromTestCase(TestVendorScripts))
+    suite.addTests(loader.loadTestsFromTestCase(TestLibraryTable))
+    suite.addTests(loader.loadTestsFromTestCase(TestShimSync))
+    suite.addTests(loader.loadTestsFromTestCase(TestBatchMetrics))
     suite.addTests(loader.loadTestsFromTestCase(TestContextMenuPerms))
     suite.addTests(loader.loadTestsFromTestCase(TestCookiesPerms))
     suite.addTests(loader.loadTestsFromTestCase(TestTabsPerms))
     suite.addTests(loader.loadTestsFromTestCase(TestWebRequestPerms))
+    suite.addTests(loader.loadTestsFromTestCase(TestExportGlobals))
+    suite.addTests(loader.loadTestsFromTestCase(TestScriptLimits))
+    suite.addTests(loader.loadTestsFromTestCase(TestShimTrim))
+    suite.addTests(loader.loadTestsFromTestCase(TestTrimmedConversion))
     return suite
 
 if __name__ == '__main__':
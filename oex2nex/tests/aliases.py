@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import unittest
+from slimit.parser import Parser as JSParser
+from astwalker import *
+from aliastable import AliasTable
+
+
+class TestAliasTable(unittest.TestCase):
+    def setUp(self):
+        self.jstree = JSParser()
+
+    def expr(self, script):
+        return self.jstree.parse(script).children()[0].expr
+
+    def test_builtins(self):
+        aliases = AliasTable()
+        self.assertEqual(aliases.resolve(self.expr("window.opera;")), "opera")
+        self.assertEqual(aliases.resolve(self.expr("opera.extension;")),
+                         "extension")
+        self.assertEqual(aliases.resolve(
+            self.expr("window.widget.preferences;")), "preferences")
+        self.assertEqual(aliases.resolve(
+            self.expr('window["widget"]["preferences"];')), "preferences")
+        self.assertIsNone(aliases.resolve(self.expr("foo.preferences;")))
+
+    def test_chained_alias(self):
+        aliases = AliasTable()
+        aliases.define("w", aliases.resolve(self.expr("window;")))
+        aliases.define("wd", aliases.resolve(self.expr("w.widget;")))
+        self.assertEqual(aliases.resolve(self.expr("wd.preferences;")),
+                         "preferences")
+
+    def test_shadowing(self):
+        aliases = AliasTable()
+        aliases.define("prefs", "preferences")
+        inner = aliases.child()
+        inner.define("prefs")
+        self.assertIsNone(inner.lookup("prefs"))
+        self.assertEqual(inner.child().lookup("widget"), "widget")
+        self.assertEqual(aliases.lookup("prefs"), "preferences")
+
+
+class TestPrefsReplacements(unittest.TestCase):
+    def setUp(self):
+        self.walker = ASTWalker()
+        self.jstree = JSParser()
+
+    def replacements(self, script):
+        found = []
+        for rval in self.walker._get_replacements(self.jstree.parse(script)):
+            if "prefs" in rval[0]:
+                found.append(rval[0]["prefs"]["textnew"])
+        return found
+
+    def test_direct(self):
+        script = """
+        widget.preferences.token = event.data.token;
+        widget.preferences["foo"] = bar;
+        """
+        self.assertEqual(self.replacements(script), [
+            "widget.preferences.setItem('token', event.data.token)",
+            'widget.preferences.setItem("foo", bar)'])
+
+    def test_aliased(self):
+        script = """
+        var w = window, prefs = w.widget.preferences;
+        prefs.cat = meow;
+        prefs[key] = ceow;
+        """
+        self.assertEqual(self.replacements(script), [
+            "prefs.setItem('cat', meow)", "prefs.setItem(key, ceow)"])
+
+    def test_untouched(self):
+        script = """
+        document.getElementById(widget.preferences.type).checked = true;
+        document.getElementById("speed").value = widget.preferences.interval;
+        widget.preferences.count += 1;
+        """
+        self.assertEqual(self.replacements(script), [])
+
+    def test_shadowed_in_function(self):
+        script = """
+        var prefs = widget.preferences;
+        function save(prefs) {
+            prefs.cat = meow;
+        }
+        function load() {
+            prefs.dog = woof;
+        }
+        """
+        self.assertEqual(self.replacements(script),
+                         ["prefs.setItem('dog', woof)"])
+
+    def test_named_function_expression(self):
+        script = """
+        var prefs = widget.preferences;
+        var f = function prefs() {
+            prefs.cat = meow;
+        };
+        function load() {
+            prefs.dog = woof;
+        }
+        """
+        self.assertEqual(self.replacements(script),
+                         ["prefs.setItem('dog', woof)"])
@@ -170,3 +170,18 @@ class TestAPIFinder(unittest.TestCase):
         """
         self.assertEqual(self.walker.find_apicall(
             self.jstree.parse(script), 'getSelected'), 'tabs')
+
+    def test_api_calls(self):
+        script = """
+        var w = window, o = w.opera;
+        o.contexts.toolbar.addItem(button);
+        function save() {
+            w.widget.preferences.setItem("a", 1);
+        }
+        opera.extension.tabs.create({url: "http://example.com/"});
+        document.getElementById("x").addEventListener("click", save);
+        """
+        self.assertEqual(self.walker.api_calls(self.jstree.parse(script)),
+                         set(["opera.contexts.toolbar.addItem",
+                              "widget.preferences.setItem",
+                              "opera.extension.tabs.create"]))
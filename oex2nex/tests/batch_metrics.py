@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import shutil
+import json
+import re
+import os
+from batch import BatchRunner
+from metrics import BatchMetrics, warning_type
+
+# a sample line of the Prometheus text format
+SAMPLE = re.compile(r'^[a-z0-9_]+(\{[a-z]+="[^"]*"(,[a-z]+="[^"]*")*\})? '
+                    r'[-+.e0-9]+$')
+
+
+def parse(text):
+    """ Returns the samples of a Prometheus text file by name with labels,
+    checking every line """
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("# HELP ") or line.startswith("# TYPE "):
+            continue
+        assert SAMPLE.match(line), line
+        (name, value) = line.rsplit(" ", 1)
+        samples[name] = float(value)
+    return samples
+
+
+class TestBatchMetrics(unittest.TestCase):
+    good = ["tests/fixtures/permissions-tabs-001.oex",
+            "tests/fixtures/manifest-test.oex"]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.prom = os.path.join(self.tmp, "oex2nex.prom")
+        self.events = os.path.join(self.tmp, "events.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def read(self, path):
+        fh = open(path)
+        data = fh.read()
+        fh.close()
+        return data
+
+    def test_batch_run(self):
+        bad = os.path.join(self.tmp, "bad.oex")
+        open(bad, "w").write("not a zip file")
+        metrics = BatchMetrics(self.prom, self.events)
+        runner = BatchRunner(os.path.join(self.tmp, "out"), jobs=2,
+                             metrics=metrics)
+        runner.run(self.good + [bad])
+        metrics.close()
+        samples = parse(self.read(self.prom))
+        self.assertEqual(samples['oex2nex_packages_total{status="ok"}'], 2)
+        self.assertEqual(samples['oex2nex_packages_total{status="failed"}'],
+                         1)
+        self.assertEqual(samples["oex2nex_packages_in_progress"], 0)
+        self.assertTrue(samples["oex2nex_packages_per_second"] > 0)
+        self.assertEqual(samples["oex2nex_bytes_in_total"],
+                         sum(os.path.getsize(path) for path in self.good))
+        out_size = sum(os.path.getsize(runner.out_file(path))
+                       for path in self.good)
+        self.assertEqual(samples["oex2nex_bytes_out_total"], out_size)
+        self.assertEqual(samples["oex2nex_package_seconds_count"], 3)
+        for stage in ("read", "files", "write", "parse"):
+            self.assertEqual(samples['oex2nex_stage_seconds_count{stage="%s"}'
+                                     % stage], 2)
+        self.assertEqual(
+                samples['oex2nex_result_cache_total{result="miss"}'], 2)
+        events = [json.loads(line)
+                  for line in self.read(self.events).splitlines()]
+        self.assertEqual(sorted(e["event"] for e in events),
+                         ["finish"] * 3 + ["start"] * 3)
+        finished = dict((e["file"], e) for e in events
+                        if e["event"] == "finish")
+        self.assertEqual(finished[bad]["status"], "failed")
+        self.assertEqual(finished[bad]["metrics"], None)
+        self.assertTrue(finished[self.good[0]]["metrics"]["stages"]["write"]
+                        >= 0)
+
+    def test_histograms_and_warnings(self):
+        metrics = BatchMetrics(self.prom, buckets=(0.1, 1))
+        for (seconds, warnings) in ((0.05, {"parse_failure": 2}),
+                                    (0.5, {"parse_failure": 1,
+                                           "other": 1})):
+            metrics.finished({"file": "a.oex", "status": "ok",
+                              "seconds": seconds, "metrics": {
+                    "bytes_in": 10, "bytes_out": 20,
+                    "stages": {"parse": seconds}, "parse_failures": 1,
+                    "warnings": warnings, "cached": seconds > 0.1,
+                    "reused": 0, "skipped": 1}})
+        samples = parse(metrics.render())
+        self.assertEqual(samples['oex2nex_package_seconds_bucket{le="0.1"}'],
+                         1)
+        self.assertEqual(samples['oex2nex_package_seconds_bucket{le="1"}'], 2)
+        self.assertEqual(samples['oex2nex_package_seconds_bucket{le="+Inf"}'],
+                         2)
+        self.assertAlmostEqual(samples["oex2nex_package_seconds_sum"], 0.55)
+        self.assertEqual(samples['oex2nex_stage_seconds_bucket{stage="parse",'
+                                 'le="0.1"}'], 1)
+        self.assertEqual(
+                samples['oex2nex_warnings_total{type="parse_failure"}'], 3)
+        self.assertEqual(samples["oex2nex_parse_failures_total"], 2)
+        self.assertEqual(samples["oex2nex_scripts_skipped_total"], 2)
+        self.assertEqual(samples['oex2nex_result_cache_total{result="hit"}'],
+                         1)
+        # nothing half written is left around
+        self.assertEqual(os.listdir(self.tmp), ["oex2nex.prom"])
+
+    def test_warning_type(self):
+        self.assertEqual(warning_type("Script parsing failed. This script "
+                                      "might need manual fixing."),
+                         "parse_failure")
+        self.assertEqual(warning_type("Script exceeds the size limit of 5."),
+                         "script_limit")
+        self.assertEqual(warning_type("Something new"), "other")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import shutil
+import json
+import zipfile
+import os
+from batch import BatchRunner
+
+
+class TestBatchRunner(unittest.TestCase):
+    good = ["tests/fixtures/permissions-tabs-001.oex",
+            "tests/fixtures/manifest-test.oex"]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.bad = os.path.join(self.tmp, "bad.oex")
+        fh = open(self.bad, "w")
+        fh.write("not a zip file")
+        fh.close()
+        self.out_dir = os.path.join(self.tmp, "out")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def runner(self, **kwargs):
+        return BatchRunner(self.out_dir, jobs=2, **kwargs)
+
+    def journal(self):
+        fh = open(os.path.join(self.out_dir, "batch-journal.jsonl"))
+        records = [json.loads(line) for line in fh]
+        fh.close()
+        return records
+
+    def test_bad_package_isolated(self):
+        counts = self.runner(tasks_per_worker=1).run(self.good + [self.bad])
+        self.assertEqual(counts, {"ok": 2, "failed": 1})
+        statuses = dict((r["file"], r["status"]) for r in self.journal())
+        self.assertEqual(statuses[self.bad], "failed")
+        for in_file in self.good:
+            self.assertEqual(statuses[in_file], "ok")
+            self.assertTrue(os.path.isfile(self.runner().out_file(in_file)))
+
+    def test_same_names(self):
+        in_files = []
+        for dirname in ("a", "b"):
+            os.mkdir(os.path.join(self.tmp, dirname))
+            in_files.append(os.path.join(self.tmp, dirname, "ext.oex"))
+        shutil.copy(self.good[0], in_files[0])
+        shutil.copy(self.good[1], in_files[1])
+        counts = self.runner().run(in_files + self.good[:1])
+        self.assertEqual(counts, {"ok": 3})
+        outs = dict((r["file"], r["out"]) for r in self.journal())
+        self.assertEqual(len(set(outs.values())), 3)
+        # a unique name is kept as it is
+        self.assertEqual(os.path.basename(outs[self.good[0]]),
+                         "permissions-tabs-001.nex")
+        names = [zipfile.ZipFile(outs[in_file]).read("manifest.json")
+                 for in_file in in_files]
+        self.assertNotEqual(names[0], names[1])
+
+    def test_same_names_later_run(self):
+        in_files = []
+        for dirname in ("a", "b"):
+            os.mkdir(os.path.join(self.tmp, dirname))
+            in_files.append(os.path.join(self.tmp, dirname, "ext.oex"))
+        shutil.copy(self.good[0], in_files[0])
+        shutil.copy(self.good[1], in_files[1])
+        self.runner().run(in_files[:1])
+        first = self.journal()[0]["out"]
+        self.assertEqual(os.path.basename(first), "ext.nex")
+        # b/ext.oex does not overwrite ext.nex, a/ext.oex keeps it
+        self.assertEqual(self.runner().run(in_files), {"ok": 1})
+        outs = dict((r["file"], r["out"]) for r in self.journal())
+        self.assertEqual(outs[in_files[0]], first)
+        self.assertNotEqual(outs[in_files[1]], first)
+        self.assertEqual(self.runner().out_files(in_files[1:2],
+                                                 self.runner().load_journal()),
+                         {in_files[1]: outs[in_files[1]]})
+        self.assertIn("tc-BrowserTabManager-001",
+                      zipfile.ZipFile(first).read("manifest.json"))
+
+    def test_resume(self):
+        self.runner().run(self.good[:1] + [self.bad])
+        counts = self.runner().run(self.good + [self.bad])
+        # only the package not in the journal yet is converted
+        self.assertEqual(counts, {"ok": 1})
+        counts = self.runner().run(self.good + [self.bad], retry_failed=True)
+        self.assertEqual(counts, {"failed": 1})
+        self.assertEqual(len(self.journal()), 4)
+
+    def test_timeout(self):
+        counts = self.runner(timeout=0.01).run(self.good)
+        self.assertEqual(counts, {"timeout": 2})
+        counts = self.runner().run(self.good, retry_failed=True)
+        self.assertEqual(counts, {"ok": 2})
+
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "Linux only")
+    def test_memory_limit(self):
+        # a package with a 50MB script, well over what the workers get on
+        # top of the address space they start with
+        big = os.path.join(self.tmp, "big.oex")
+        oex = zipfile.ZipFile(big, "w", zipfile.ZIP_DEFLATED)
+        oex.writestr("config.xml", '<widget xmlns="http://www.w3.org/ns/'
+                     'widgets"><name>Big</name></widget>')
+        oex.writestr("index.html", '<script src="big.js"></script>')
+        oex.writestr("big.js", "var a = 1;\n" * (5 * 1024 * 1024))
+        oex.close()
+        fh = open("/proc/self/statm")
+        size = int(fh.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+        fh.close()
+        counts = self.runner(max_memory=size + 20 * 1024 * 1024).run(
+                [big] + self.good[:1])
+        self.assertEqual(counts, {"ok": 1, "failed": 1})
+        errors = dict((r["file"], r["error"]) for r in self.journal())
+        self.assertEqual(errors[big], "Out of memory")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import shutil
+import os
+from catalogue import Catalogue, find_packages
+
+
+class TestCatalogue(unittest.TestCase):
+    fixtures = "tests/fixtures"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.catalogue = Catalogue(os.path.join(self.tmp, "index.db"))
+
+    def tearDown(self):
+        self.catalogue.close()
+        shutil.rmtree(self.tmp)
+
+    def copy(self, fixture, name):
+        path = os.path.join(self.tmp, name)
+        shutil.copyfile(os.path.join(self.fixtures, fixture), path)
+        return path
+
+    def names(self, rows):
+        return [os.path.basename(path) for (path, _name) in rows]
+
+    def test_index_and_find(self):
+        packages = find_packages([self.fixtures])
+        self.assertTrue(packages)
+        counts = self.catalogue.index(packages)
+        self.assertEqual(counts, {"indexed": len(packages), "unchanged": 0,
+                                  "failed": 0})
+        self.assertEqual(self.names(self.catalogue.find(
+                features=["opera:share-cookies"])),
+                ["permissions-share-cookies-001.oex",
+                 "permissions-share-cookies-002.oex",
+                 "permissions-share-cookies-003.oex"])
+        self.assertEqual(self.names(self.catalogue.find(
+                apis=["opera.extension.tabs.create"],
+                features=["opera:share-cookies"],
+                permissions=["tabs"])),
+                ["permissions-share-cookies-001.oex",
+                 "permissions-share-cookies-002.oex",
+                 "permissions-share-cookies-003.oex"])
+        self.assertEqual(self.names(self.catalogue.find(
+                apis=["opera.contexts.toolbar.addItem"],
+                features=["opera:share-cookies"])), [])
+        self.assertEqual(self.catalogue.query(
+                "SELECT speeddial FROM packages WHERE path LIKE ?",
+                ("%speeddial-001.oex",)),
+                [(u"http://www.qwantz.com/index.php",)])
+        self.assertEqual(self.catalogue.query(
+                "SELECT p.name, value FROM preferences p, packages k "
+                "WHERE p.package = k.id AND k.path LIKE ? ORDER BY p.name",
+                ("%preferences-001.oex",)),
+                [(u"greeting", u"h\xe9j"), (u"interval", u"30"),
+                 (u"theme", u"dark")])
+
+    def test_incremental(self):
+        package = self.copy("permissions-tabs-001.oex", "a.oex")
+        self.assertEqual(self.catalogue.index([package])["indexed"], 1)
+        self.assertEqual(self.catalogue.index([package]),
+                         {"indexed": 0, "unchanged": 1, "failed": 0})
+        # new content at the same path replaces the old rows
+        self.copy("permissions-share-cookies-001.oex", "a.oex")
+        self.assertEqual(self.catalogue.index([package])["indexed"], 1)
+        self.assertEqual(self.catalogue.query(
+                "SELECT count(*), name FROM packages"),
+                [(1, u"tc-extensions-share-cookies-001")])
+        self.assertEqual(self.catalogue.query(
+                "SELECT name FROM features"), [(u"opera:share-cookies",)])
+        os.unlink(package)
+        self.assertEqual(self.catalogue.remove_missing(), 1)
+        self.assertEqual(self.catalogue.query(
+                "SELECT count(*) FROM features"), [(0,)])
+
+    def test_invalid_package(self):
+        bad = os.path.join(self.tmp, "bad.oex")
+        fh = open(bad, "w")
+        fh.write("not a zip file")
+        fh.close()
+        self.assertEqual(self.catalogue.index([bad])["failed"], 1)
+        (error,) = self.catalogue.query("SELECT error FROM packages")[0]
+        self.assertTrue(error.startswith("Not a zip file"))
+        self.assertEqual(self.catalogue.find(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
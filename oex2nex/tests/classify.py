@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import unittest
+import subprocess
+import os
+from convertor import *
+
+
+class TestClassify(unittest.TestCase):
+    def test_html(self):
+        self.assertEqual(classify("index.html", "<!DOCTYPE html>"), FILE_HTML)
+        self.assertEqual(classify("locales/de/popup.XHTML", ""), FILE_HTML)
+
+    def test_scripts(self):
+        self.assertEqual(classify("background.js", "var a = 1;"), FILE_JS)
+        self.assertEqual(classify("includes/inject.js", "// ==UserScript=="),
+                         FILE_USERSCRIPT)
+        self.assertEqual(classify("lib/data.js", codecs.BOM_UTF8 + ' {"a": 1}'),
+                         FILE_JSON)
+        self.assertEqual(classify("lib/list.js", "[1, 2].forEach(f);"),
+                         FILE_JSON)
+
+    def test_json(self):
+        self.assertEqual(classify("data/strings.json", "{}"), FILE_JSON)
+
+    def test_binary(self):
+        self.assertEqual(classify("__MACOSX/._background.js",
+                                  "\x00\x05\x16\x07\x00\x02\x00\x00"),
+                         FILE_BINARY)
+        self.assertEqual(classify("icon.png", "\x89PNG\r\n\x1a\n\x00\x00"),
+                         FILE_BINARY)
+
+    def test_other(self):
+        self.assertEqual(classify("style.css", "body { margin: 0 }"),
+                         FILE_OTHER)
+
+
+class TestClassifyStats(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        if not os.path.exists("tests/fixtures/converted"):
+            os.makedirs("tests/fixtures/converted")
+        cls.convertor = Oex2Nex("tests/fixtures/manifest-test.oex",
+                                "tests/fixtures/converted/classify-test.nex")
+        cls.convertor.convert()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Clean up"""
+        subprocess.call("rm -r tests/fixtures/converted/*", shell=True)
+
+    def test_file_counts(self):
+        self.assertEqual(self.convertor.stats["files"],
+                         {FILE_HTML: 2, FILE_BINARY: 2, FILE_OTHER: 2})
+
+    def test_no_parse_failures(self):
+        self.assertEqual(self.convertor.stats["parse_failures"], 0)
+        self.assertEqual(self.convertor.warnings, [])
+
+    def test_json_not_parsed_as_script(self):
+        (data, is_json) = self.convertor._update_scopes(u'{"a": [1, 2]}')
+        self.assertTrue(is_json)
+        self.assertEqual(self.convertor.stats["parse_failures"], 0)
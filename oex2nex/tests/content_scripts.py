@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import unittest
+import zipfile
+import subprocess
+import json
+import os
+from convertor import group_content_scripts, oex_injscr_shim
+
+
+class TestGroupContentScripts(unittest.TestCase):
+    def test_shared_globs(self):
+        injscrlist = [
+            {"file": "includes/a.js", "includes": ["*"], "excludes": []},
+            {"file": "includes/b.js", "includes": ["*"], "excludes": []},
+            {"file": "includes/c.js", "includes": ["http://a/*"],
+             "excludes": []},
+        ]
+        self.assertEqual(group_content_scripts(injscrlist), [
+            {"files": ["includes/a.js", "includes/b.js"], "includes": ["*"],
+             "excludes": []},
+            {"files": ["includes/c.js"], "includes": ["http://a/*"],
+             "excludes": []}])
+
+    def test_order_kept(self):
+        # c may use the globals of b, it must not move ahead of it
+        injscrlist = [
+            {"file": "includes/a.js", "includes": ["*"], "excludes": []},
+            {"file": "includes/b.js", "includes": ["http://a/*"],
+             "excludes": []},
+            {"file": "includes/c.js", "includes": ["*"], "excludes": []},
+        ]
+        groups = group_content_scripts(injscrlist)
+        self.assertEqual([g["files"] for g in groups],
+                         [["includes/a.js"], ["includes/b.js"],
+                          ["includes/c.js"]])
+
+    def test_excludes_differ(self):
+        injscrlist = [
+            {"file": "includes/a.js", "includes": ["*"], "excludes": []},
+            {"file": "includes/b.js", "includes": ["*"],
+             "excludes": ["http://a/*"]},
+        ]
+        self.assertEqual(len(group_content_scripts(injscrlist)), 2)
+
+
+class TestContentScriptsManifest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Convert the test"""
+        if not os.path.exists("tests/fixtures/converted"):
+            os.makedirs("tests/fixtures/converted")
+        subprocess.call("python convertor.py -x tests/fixtures/content-scripts-001.oex tests/fixtures/converted/test1", shell=True)
+        nex = zipfile.ZipFile("tests/fixtures/converted/test1.nex", "r")
+        cls.manifest = json.loads(nex.read("manifest.json"))
+
+    @classmethod
+    def tearDownClass(cls):
+        """Clean up"""
+        subprocess.call("rm -r tests/fixtures/converted/*", shell=True)
+
+    def test_injection_order(self):
+        # a and c share their globs, but b comes between them
+        content_scripts = self.manifest["content_scripts"]
+        self.assertEqual([cs["js"] for cs in content_scripts],
+                         [[oex_injscr_shim, "includes/a.js"],
+                          [oex_injscr_shim, "includes/b.js"],
+                          [oex_injscr_shim, "includes/c.js"]])
+        self.assertEqual(content_scripts[0]["exclude_globs"],
+                         ["http://example.com/private/*"])
+        self.assertEqual(content_scripts[2]["exclude_globs"],
+                         ["http://example.com/private/*"])
+        self.assertEqual(content_scripts[1]["matches"],
+                         ["http://example.org/*"])
+        self.assertEqual(content_scripts[1]["include_globs"], [])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import shutil
+import zipfile
+import struct
+import json
+import os
+import subprocess
+from io import BytesIO
+from convertor import Oex2Nex, InvalidPackage, convert_package
+
+
+class _Unseekable(object):
+    """ A stream without seek, like a socket or a request body """
+    def __init__(self, data=""):
+        self.data = data
+        self.written = []
+
+    def read(self, size=-1):
+        (data, self.data) = (self.data, "")
+        return data
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class TestInMemory(unittest.TestCase):
+    fixture = "tests/fixtures/permissions-tabs-001.oex"
+
+    def setUp(self):
+        fh = open(self.fixture, "rb")
+        self.oex = fh.read()
+        fh.close()
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def convert_in_tmp(self, *args, **kwargs):
+        """ Converts in an empty working directory, which has to stay
+        empty """
+        work = os.path.join(self.tmp, "work")
+        os.mkdir(work)
+        os.chdir(work)
+        try:
+            return convert_package(*args, **kwargs)
+        finally:
+            os.chdir(self.cwd)
+            self.assertEqual(os.listdir(work), [])
+            os.rmdir(work)
+
+    def test_bytes(self):
+        result = self.convert_in_tmp(self.oex, reproducible=True)
+        nex = zipfile.ZipFile(BytesIO(result["nex"]))
+        self.assertEqual(json.loads(nex.read("manifest.json")),
+                         result["manifest"])
+        self.assertIn("tabs", result["manifest"]["permissions"])
+        self.assertEqual(result["warnings"], [])
+        self.assertTrue(result["stats"]["files"])
+        # the same package as converting files
+        out_file = os.path.join(self.tmp, "out.nex")
+        Oex2Nex(self.fixture, out_file, reproducible=True).convert()
+        fh = open(out_file, "rb")
+        self.assertEqual(fh.read(), result["nex"])
+        fh.close()
+
+    def test_streams(self):
+        out = BytesIO()
+        result = self.convert_in_tmp(BytesIO(self.oex), out,
+                                     reproducible=True)
+        self.assertEqual(result["nex"], None)
+        unseekable = _Unseekable(self.oex)
+        self.convert_in_tmp(unseekable, unseekable, reproducible=True)
+        self.assertEqual("".join(unseekable.written), out.getvalue())
+
+    def test_invalid(self):
+        self.assertRaises(InvalidPackage, convert_package, "not a zip")
+        self.assertRaises(ValueError, Oex2Nex, BytesIO(self.oex), BytesIO(),
+                          out_dir=True)
+
+    def test_signed(self):
+        key_file = os.path.join(self.tmp, "key.pem")
+        null = open(os.devnull, "w")
+        status = subprocess.call(["openssl", "genpkey", "-algorithm", "RSA",
+                                  "-out", key_file], stdout=null, stderr=null)
+        null.close()
+        if status:
+            self.skipTest("openssl is not available")
+        unsigned = convert_package(self.oex, reproducible=True)["nex"]
+        signed = self.convert_in_tmp(self.oex, key_file=key_file,
+                                     reproducible=True)["nex"]
+        self.assertEqual(signed[:4], "Cr24")
+        (publen, siglen) = struct.unpack("<LL", signed[8:16])
+        self.assertEqual(signed[16 + publen + siglen:], unsigned)
+
+
+if __name__ == '__main__':
+    unittest.main()
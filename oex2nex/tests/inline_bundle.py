@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import unittest
+import zipfile
+import subprocess
+import os
+import re
+import StringIO
+from io import BytesIO
+from convertor import Oex2Nex
+from nexwriter import NexWriter
+
+
+class TestInlineBundle(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Convert the test"""
+        if not os.path.exists("tests/fixtures/converted"):
+            os.makedirs("tests/fixtures/converted")
+        subprocess.call("python convertor.py -x tests/fixtures/inline-scripts-001.oex tests/fixtures/converted/test1", shell=True)
+        subprocess.call("python convertor.py -x -b tests/fixtures/inline-scripts-001.oex tests/fixtures/converted/test2", shell=True)
+        cls.nex = zipfile.ZipFile("tests/fixtures/converted/test1.nex", "r")
+        cls.bundled = zipfile.ZipFile("tests/fixtures/converted/test2.nex", "r")
+
+    @classmethod
+    def tearDownClass(cls):
+        """Clean up"""
+        subprocess.call("rm -r tests/fixtures/converted/*", shell=True)
+
+    def test_unbundled(self):
+        names = self.nex.namelist()
+        for n in range(1, 4):
+            self.assertIn("inline_script_index_%d.js" % n, names)
+        self.assertNotIn("allinlines_index.js", names)
+
+    def test_one_file(self):
+        names = self.bundled.namelist()
+        self.assertIn("allinlines_index.js", names)
+        # the script before lib.js is not bundled with the ones after it
+        self.assertEqual([n for n in names if n.startswith("inline_script_")],
+                         ["inline_script_index_1.js"])
+        index = self.bundled.read("index.html")
+        self.assertEqual(index.count('src="allinlines_index.js"'), 1)
+        self.assertLess(index.index('src="inline_script_index_1.js"'),
+                        index.index('src="lib.js"'))
+        self.assertLess(index.index('src="lib.js"'),
+                        index.index('src="allinlines_index.js"'))
+
+    def test_one_wrapper(self):
+        script = self.bundled.read("allinlines_index.js")
+        self.assertEqual(script.count("opera.isReady("), 1)
+        self.assertNotIn("count = 0", script)
+        self.assertIn('var tick = window["tick"] = tick;', script)
+        self.assertLess(script.index("function tick"), script.index("tick();"))
+        # every script has its own scope and try block
+        self.assertEqual(script.count("try {\n(function(){"), 2)
+        self.assertEqual(script.count("try {"), 2)
+        self.assertNotIn("oex2nex:inline-script", script)
+
+
+class TestInlineBundleRuns(unittest.TestCase):
+    def wrap(self, html):
+        convertor = Oex2Nex("in.oex", "out.nex", bundle_inline=True)
+        out = BytesIO()
+        convertor._nex = NexWriter(out)
+        html = convertor._shim_wrap(html)
+        convertor._nex.close()
+        return (html, zipfile.ZipFile(out))
+
+    def test_order_kept(self):
+        (html, nex) = self.wrap(
+                "<html><head><script>var a = 1;</script>"
+                "<script>var b = 2;</script>"
+                "<script src='lib.js'></script>"
+                "<script>var c = lib(a);</script>"
+                "<script>var d = c + b;</script>"
+                "<script src='late.js'></script>"
+                "<script>var e = d;</script></head><body></body></html>")
+        self.assertEqual(sorted(nex.namelist()),
+                         ["allinlines_index.js", "allinlines_index_2.js",
+                          "inline_script_index_1.js"])
+        srcs = re.findall(r'src="([^"]*)"', html)
+        self.assertEqual(srcs[-5:], ["allinlines_index.js", "lib.js",
+                                     "allinlines_index_2.js", "late.js",
+                                     "inline_script_index_1.js"])
+        first = nex.read("allinlines_index.js")
+        self.assertIn('var a = window["a"] = 1;', first)
+        self.assertNotIn("var c", first)
+        second = nex.read("allinlines_index_2.js")
+        self.assertLess(second.index("var c"), second.index("var d"))
+
+    def test_fragments_isolated(self):
+        (html, nex) = self.wrap("<script>undefinedCall();</script>"
+                                "<script>var b = 2;</script>")
+        script = nex.read("allinlines_index.js")
+        self.assertEqual(script.count("} catch (e) {"), 2)
+        self.assertLess(script.index("undefinedCall();"),
+                        script.index("} catch (e) {"))
+        self.assertLess(script.index("} catch (e) {"), script.index("var b"))
+
+
+class TestInlineBundleFallback(unittest.TestCase):
+    def test_parse_failure(self):
+        html = ("<html><head><script>var a = 1;</script>"
+                "<script>var b = ;</script></head><body></body></html>")
+        convertor = Oex2Nex("in.oex", "out.nex", bundle_inline=True)
+        convertor._nex = zipfile.ZipFile(StringIO.StringIO(), "w")
+        html = convertor._shim_wrap(html)
+        self.assertEqual(sorted(convertor._nex.namelist()),
+                         ["inline_script_index_1.js",
+                          "inline_script_index_2.js"])
+        self.assertEqual(convertor.stats["parse_failures"], 1)
+        self.assertEqual(len(convertor.warnings), 1)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+import unittest
+from jsbackend import get_backend
+from slimit.visitors.nodevisitor import NodeVisitor
+
+
+class TestJSBackends(unittest.TestCase):
+    script = "var a = f(1, 2); function g(x) { return window.opera; }"
+
+    def test_shared(self):
+        self.assertIs(get_backend(), get_backend())
+
+    def test_slimit_walk(self):
+        js = get_backend()
+        tree = js.parse(self.script)
+        # the same nodes in the same order as slimit's own visitor
+        self.assertEqual(list(js.walk(tree)), list(NodeVisitor().visit(tree)))
+        calls = [node for node in js.walk(tree)
+                 if isinstance(node, js.ast.FunctionCall)]
+        self.assertEqual([js.to_ecma(arg) for arg in js.arguments(calls[0])],
+                         ["1", "2"])
+
+    def test_syntax_error(self):
+        self.assertRaises(SyntaxError, get_backend().parse, "var = ;")
+
+    def test_round_trip(self):
+        js = get_backend()
+        source = js.to_ecma(js.parse(self.script))
+        self.assertEqual(js.to_ecma(js.parse(source)), source)
+        minified = js.minify(js.parse(self.script))
+        self.assertTrue(len(minified) < len(source))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import hashlib
+import shutil
+import threading
+import os
+import BaseHTTPServer
+import SocketServer
+from librarytable import (build_table, read_table, library_releases,
+                          table_path)
+from convertor import read_library_hashes
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves server.files """
+
+    def do_GET(self):
+        data = self.server.files.get(self.path.lstrip("/"))
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestLibraryTable(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.table = os.path.join(self.tmp, "known_libraries.sha1")
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.files = {"jquery-1.7.2.js": "/*! jQuery v1.7.2 */\n",
+                             "json2.js": "var JSON;\n",
+                             "error.js": "<html>Not found</html>"}
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def url(self, name):
+        return "http://127.0.0.1:%d/%s" % (self.server.server_address[1],
+                                           name)
+
+    def test_build(self):
+        releases = [("jquery-1.7.2.js", self.url("jquery-1.7.2.js")),
+                    ("json2-20110223.js", self.url("json2.js")),
+                    ("gone.js", self.url("gone.js")),
+                    ("error.js", self.url("error.js"))]
+        errors = build_table(self.table, releases, jobs=2)
+        self.assertEqual(sorted(errors), [self.url("error.js"),
+                                          self.url("gone.js")])
+        digest = hashlib.sha1("var JSON;\n").hexdigest()
+        self.assertEqual(read_table(self.table)[self.url("json2.js")],
+                         (digest, "json2-20110223.js"))
+        hashes = read_library_hashes(self.table)
+        self.assertEqual(sorted(hashes.values()), ["jquery-1.7.2.js",
+                                                   "json2-20110223.js"])
+        # an entry that could not be fetched again is kept
+        del self.server.files["json2.js"]
+        errors = build_table(self.table, releases, jobs=2)
+        self.assertIn(self.url("json2.js"), errors)
+        self.assertEqual(read_library_hashes(self.table), hashes)
+
+    def test_shipped_sources(self):
+        urls = set(url for (_name, url) in library_releases)
+        entries = read_table(table_path)
+        self.assertTrue(entries)
+        for url in entries:
+            self.assertIn(url, urls)
+        # every entry in the file has its source
+        self.assertEqual(len(read_library_hashes(table_path)), len(entries))
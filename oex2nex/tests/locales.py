@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import unittest
+import subprocess
+import zipfile
+import os
+from convertor import Oex2Nex
+
+
+class TestLocaleTransforms(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        if not os.path.exists("tests/fixtures/converted"):
+            os.makedirs("tests/fixtures/converted")
+        cls.convertor = Oex2Nex("tests/fixtures/locales-001.oex",
+                                "tests/fixtures/converted/locales-test.nex")
+        cls.convertor.convert()
+        cls.nex = zipfile.ZipFile("tests/fixtures/converted/locales-test.nex")
+
+    @classmethod
+    def tearDownClass(cls):
+        """Clean up"""
+        subprocess.call("rm -r tests/fixtures/converted/*", shell=True)
+
+    def test_transformed_once(self):
+        # de and fr reuse the decoded text and the fixed html and script
+        # of en: 2 copies * 2 files * 2 transforms
+        self.assertEqual(self.convertor.stats["reused"], 8)
+
+    def test_all_copies_written(self):
+        names = self.nex.namelist()
+        self.assertEqual(len(names), len(set(names)))
+        script = self.nex.read("locales/en/help.js")
+        self.assertIn('var topics = window["topics"] = [];', script)
+        for name in ("locales/de/help.js", "locales/fr/help.js", "help.js"):
+            self.assertEqual(self.nex.read(name), script)
+        page = self.nex.read("locales/en/help.html")
+        self.assertIn("operaextensions_popup.js", page)
+        for name in ("locales/de/help.html", "locales/fr/help.html",
+                     "help.html"):
+            self.assertEqual(self.nex.read(name), page)
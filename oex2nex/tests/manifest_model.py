@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import json
+from nexmanifest import Manifest
+
+
+class TestManifestModel(unittest.TestCase):
+    def test_key_order(self):
+        manifest = Manifest()
+        manifest["permissions"] = ["tabs"]
+        manifest["version"] = "1.0"
+        manifest["name"] = "Test"
+        manifest["zoo"] = 1
+        manifest.add_resource("a.png")
+        self.assertEqual(manifest.to_dict().keys(), [
+            "name", "manifest_version", "version",
+            "web_accessible_resources", "permissions", "zoo"])
+
+    def test_non_ascii(self):
+        manifest = Manifest()
+        # config.xml values come both as UTF-8 bytes and as unicode
+        manifest["name"] = "Caf\xc3\xa9 \"quoted\""
+        manifest["developer"] = {"name": u"J\xf6rg", "url": "http://a/"}
+        manifest["description"] = u"日本"
+        text = manifest.to_json()
+        self.assertIsInstance(text, unicode)
+        self.assertIn(u"J\xf6rg", text)
+        data = json.loads(text)
+        self.assertEqual(data["name"], u"Caf\xe9 \"quoted\"")
+        self.assertEqual(data["developer"],
+                         {"name": u"J\xf6rg", "url": "http://a/"})
+        self.assertEqual(data["description"], u"日本")
+
+    def test_content_scripts(self):
+        manifest = Manifest()
+        manifest.add_content_script(["shim.js", "a.js"], ["<all_urls>"],
+                                    None, ["http://a/*"])
+        self.assertEqual(json.loads(manifest.to_json())["content_scripts"], [
+            {"js": ["shim.js", "a.js"], "matches": ["<all_urls>"],
+             "include_globs": [], "exclude_globs": ["http://a/*"],
+             "run_at": "document_start", "all_frames": True}])
+
+    def test_many_resources(self):
+        manifest = Manifest()
+        for n in xrange(50000):
+            manifest.add_resource("res/%d.png" % n)
+        resources = json.loads(manifest.to_json())["web_accessible_resources"]
+        self.assertEqual(len(resources), 50000)
+        self.assertEqual(resources[-1], "res/49999.png")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import shutil
+import zipfile
+import gc
+import hashlib
+import os
+import multiprocessing
+from xml.dom import minidom
+from convertor import Oex2Nex
+import memusage
+from memusage import MemoryMeter, current_rss
+from jsbackend import get_backend
+
+config = ('<?xml version="1.0"?><widget xmlns="http://www.w3.org/ns/widgets">'
+          '<name>Memory</name></widget>')
+
+
+def make_package(path, pages, lines, copies=0):
+    """ Writes an .oex with pages HTML pages and as many scripts, each of
+    about lines lines, and copies pages with the content of the first """
+    script = "".join("var v%d = opera.extension; function f%d(a) { "
+                     "return widget.preferences.p%d + a; }\n" % (i, i, i)
+                     for i in range(lines))
+    oex = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+    oex.writestr("config.xml", config)
+    oex.writestr("index.html", "<!DOCTYPE html><script>%s</script>" % script)
+    for n in range(pages):
+        oex.writestr("page%d.html" % n, "<!DOCTYPE html><script src="
+                     "'script%d.js'></script><div>%s</div>"
+                     % (n, "<p>page %d</p>" % n * lines * 4))
+        oex.writestr("script%d.js" % n, script.replace("f", "s%d_" % n))
+    for n in range(copies):
+        oex.writestr("copy%d.html" % n, oex.read("page0.html"))
+    oex.close()
+
+
+def _peak_growth(path, out, queue):
+    """ Converts path in a fresh process, puts the peak growth on queue """
+    convertor = Oex2Nex(path, out, reset_peaks=True)
+    convertor.convert()
+    queue.put(convertor.stats["memory"]["peak_growth"])
+
+
+class TestMemoryUse(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.oex = os.path.join(self.tmp, "memory.oex")
+        self.nex = os.path.join(self.tmp, "memory.nex")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_stats(self):
+        make_package(self.oex, 2, 50)
+        convertor = Oex2Nex(self.oex, self.nex)
+        convertor.convert()
+        memory = convertor.stats["memory"]
+        self.assertEqual(sorted(memory["stages"]),
+                         ["config", "files", "read", "shims", "write"])
+        if current_rss() is None:
+            self.skipTest("No resident set size on this platform")
+        self.assertTrue(memory["peak"] > 0)
+        for stage in memory["stages"].values():
+            self.assertTrue(0 <= stage["peak"] <= memory["peak_growth"])
+        for peak in memory["files"].values():
+            self.assertTrue(0 < peak <= memory["stages"]["files"]["peak"])
+
+    def test_meter_overlapping(self):
+        meter = MemoryMeter(reset_peaks=True)
+        if current_rss() is None:
+            self.skipTest("No resident set size on this platform")
+        stage = meter.sample()
+        before = meter.sample()
+        data = "x" * (32 * 1024 * 1024)
+        meter.add_file("big", before)
+        del data
+        meter.add_stage("files", stage)
+        self.assertTrue(meter.files["big"] >= 30 * 1024)
+        self.assertTrue(meter.stages["files"]["peak"] >= 30 * 1024)
+        self.assertTrue(meter.stages["files"]["rss"] < 30 * 1024)
+
+    def test_peak_left_alone(self):
+        resets = []
+        reset_peak = memusage.reset_peak
+        memusage.reset_peak = lambda: resets.append(1) or True
+        try:
+            make_package(self.oex, 1, 10)
+            convertor = Oex2Nex(self.oex, self.nex)
+            convertor.convert()
+            self.assertEqual(resets, [])
+            self.assertIn("rss", convertor.stats["memory"]["stages"]["files"])
+            Oex2Nex(self.oex, self.nex, reset_peaks=True).convert()
+            self.assertTrue(resets)
+        finally:
+            memusage.reset_peak = reset_peak
+
+    def test_trees_released(self):
+        make_package(self.oex, 3, 50)
+        convertor = Oex2Nex(self.oex, self.nex)
+        ast = get_backend().ast
+        gc.collect()
+        # the trees other tests keep alive, e.g. in their parsers
+        kept = set(id(o) for o in gc.get_objects()
+                   if isinstance(o, (ast.Node, minidom.Node)))
+        gc.disable()
+        try:
+            convertor.convert()
+            # nothing was collected, so these are only the objects that
+            # would wait for the cycle collector
+            trees = [o for o in gc.get_objects()
+                     if isinstance(o, ast.Node) and id(o) not in kept]
+            nodes = [o for o in gc.get_objects()
+                     if isinstance(o, minidom.Node) and id(o) not in kept]
+        finally:
+            gc.enable()
+        # the scripts have 250 statements, ply keeps the last slice it
+        # reduced and html5lib the elements left open, of 200 paragraphs
+        self.assertTrue(len(trees) < 20, len(trees))
+        self.assertTrue(len(nodes) < 50, len(nodes))
+
+    def test_transforms_of_copies(self):
+        make_package(self.oex, 3, 10, copies=2)
+        convertor = Oex2Nex(self.oex, self.nex)
+        kept = set()
+        memoized = convertor._memoized
+
+        def spy(key, transform, *args):
+            result = memoized(key, transform, *args)
+            kept.update(convertor._transforms)
+            return result
+        convertor._memoized = spy
+        convertor.convert()
+        # only the transforms of the first page are kept for its copies
+        page = zipfile.ZipFile(self.oex).read("page0.html")
+        self.assertEqual(set(key[-1] for key in kept),
+                         set([hashlib.sha1(page).hexdigest()]))
+        self.assertEqual(convertor.stats["reused"], 4)
+        self.assertEqual(convertor._transforms, {})
+
+    def test_peak_memory(self):
+        """ More pages do not add up: each tree and document is freed once
+        its file is written """
+        if current_rss() is None:
+            self.skipTest("No resident set size on this platform")
+        peaks = []
+        for pages in (4, 16):
+            make_package(self.oex, pages, 200)
+            queue = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=_peak_growth,
+                                             args=(self.oex, self.nex, queue))
+            worker.start()
+            peaks.append(queue.get(timeout=120))
+            worker.join()
+        self.assertTrue(peaks[1] < peaks[0] * 1.6,
+                        "peak grew from %d kB to %d kB" % tuple(peaks))
+
+
+if __name__ == '__main__':
+    unittest.main()
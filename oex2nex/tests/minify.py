@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import tempfile
+import shims
+from convertor import Oex2Nex
+
+
+class TestMinifyScripts(unittest.TestCase):
+    script = u"""
+    var prefs = widget.preferences;
+    function save(value) {
+        prefs.last = value;
+        return value;
+    }
+    """
+
+    def test_minified(self):
+        convertor = Oex2Nex("in.oex", "out.nex", minify=True)
+        (data, is_json) = convertor._update_scopes(self.script)
+        self.assertNotIn("\n  ", data)
+        self.assertIn('var prefs = window["prefs"]=widget.preferences;', data)
+        self.assertIn("prefs.setItem('last', value)", data)
+        self.assertIn('var save = window["save"] = save;', data)
+        stats = convertor.stats["minify"]
+        self.assertEqual(stats["before"], len(self.script))
+        self.assertEqual(stats["after"], len(data))
+
+    def test_not_minified(self):
+        convertor = Oex2Nex("in.oex", "out.nex")
+        (data, is_json) = convertor._update_scopes(self.script)
+        self.assertIn("prefs.setItem('last', value)", data)
+        self.assertEqual(convertor.stats["minify"]["after"], 0)
+
+
+class TestMinifyShims(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_cached(self):
+        fh = open("oex_shim/operaextensions_popup.js", "r")
+        shim = fh.read()
+        fh.close()
+        minified = shims.minify(shim, self.cache_dir)
+        self.assertTrue(len(minified) < len(shim))
+        cached = os.listdir(os.path.join(self.cache_dir, "shims"))
+        self.assertEqual(len(cached), 1)
+        self.assertEqual(shims.minify(shim, self.cache_dir), minified)
+
+    def test_syntax_error(self):
+        self.assertIsNone(shims.minify("var = ;", self.cache_dir))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import unittest
+import zipfile
+import StringIO
+import os
+import zlib
+import shutil
+import tempfile
+from nexwriter import NexWriter
+
+
+class TestNexWriter(unittest.TestCase):
+    entries = [("manifest.json", '{"name": "test"}\n' * 50),
+               ("icon.png", "\x89PNG\r\n\x1a\n" + "\x00" * 500),
+               ("random.bin", os.urandom(2000)),
+               (u"locales/de/\xfcber.js", u"var \xfc = 1;\n" * 100)]
+
+    def write(self, level=6, jobs=4):
+        out = StringIO.StringIO()
+        nex = NexWriter(out, level, jobs)
+        for name, data in self.entries:
+            nex.writestr(name, data)
+        nex.close()
+        return zipfile.ZipFile(StringIO.StringIO(out.getvalue()))
+
+    def test_order_and_content(self):
+        for jobs in (1, 4):
+            nex = self.write(jobs=jobs)
+            self.assertIsNone(nex.testzip())
+            self.assertEqual(nex.namelist(),
+                             [name for name, _data in self.entries])
+            for name, data in self.entries:
+                if isinstance(data, unicode):
+                    data = data.encode("utf-8")
+                self.assertEqual(nex.read(name), data)
+
+    def test_compress_types(self):
+        types = [i.compress_type for i in self.write().infolist()]
+        # media and incompressible data are stored
+        self.assertEqual(types, [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED,
+                                 zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+
+    def test_stored_level(self):
+        nex = self.write(level=0)
+        self.assertEqual(set(i.compress_type for i in nex.infolist()),
+                         set([zipfile.ZIP_STORED]))
+        self.assertIsNone(nex.testzip())
+
+    def test_write_error(self):
+        class Full(StringIO.StringIO):
+            def write(self, data):
+                raise IOError(28, "No space left on device")
+        nex = NexWriter(Full(), 6, 4)
+        nex.writestr("a.js", "var a;")
+        self.assertRaises(IOError, nex.flush)
+
+    def test_levels(self):
+        sizes = []
+        for level in (1, 9):
+            nex = self.write(level=level)
+            self.assertIsNone(nex.testzip())
+            sizes.append(nex.getinfo("manifest.json").compress_size)
+        self.assertEqual(sizes[0], len(zlib.compress(
+                self.entries[0][1], 1)) - 6)
+        self.assertEqual(sizes[1], len(zlib.compress(
+                self.entries[0][1], 9)) - 6)
+
+    def test_extractall(self):
+        out = StringIO.StringIO()
+        nex = NexWriter(out, 6, 4)
+        for name, data in self.entries[:3]:
+            nex.writestr(name, data)
+        tmp = tempfile.mkdtemp()
+        try:
+            nex.extractall(tmp)
+            nex.close()
+            self.assertEqual(sorted(os.listdir(tmp)),
+                             ["icon.png", "manifest.json", "random.bin"])
+        finally:
+            shutil.rmtree(tmp)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import shutil
+import zipfile
+import time
+import os
+from convertor import Oex2Nex, InvalidPackage, check_package
+from catalogue import find_packages
+from triage import triage
+
+CONFIG = ('<widget xmlns="http://www.w3.org/ns/widgets"><name>Triage</name>'
+          '<content src="%s"/></widget>')
+
+
+class TestTriage(unittest.TestCase):
+    fixtures = "tests/fixtures"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def package(self, name, files, method=zipfile.ZIP_DEFLATED):
+        path = os.path.join(self.tmp, name)
+        oex = zipfile.ZipFile(path, "w", method)
+        for (filename, data) in files:
+            oex.writestr(filename, data)
+        oex.close()
+        return path
+
+    def good(self, name="good.oex", method=zipfile.ZIP_DEFLATED):
+        return self.package(name, [("config.xml", CONFIG % "index.html"),
+                                   ("index.html", "<script>1</script>"),
+                                   ("app.js", "var a = 1;")], method)
+
+    def assertInvalid(self, package, reason, **kwargs):
+        with self.assertRaises(InvalidPackage) as raised:
+            check_package(package, **kwargs)
+        self.assertIn(reason, str(raised.exception))
+
+    def test_fixtures_pass(self):
+        for path in find_packages([self.fixtures]):
+            check_package(path, full=True)
+
+    def test_invalid(self):
+        self.assertEqual(check_package(self.good())["name"], u"Triage")
+        path = os.path.join(self.tmp, "text.oex")
+        open(path, "w").write("not a zip")
+        self.assertInvalid(path, "Not a zip file")
+        self.assertInvalid(self.package("noconfig.oex", [("a.js", "1")]),
+                           "did not find a config.xml")
+        self.assertInvalid(self.package("badconfig.oex",
+                [("config.xml", "<widget>")]), "Parsing config.xml failed")
+        self.assertInvalid(self.package("noindex.oex",
+                [("config.xml", CONFIG % "start.html")]),
+                "start.html given in config.xml is not in the package")
+        self.assertInvalid(self.package("unsafe.oex",
+                [("config.xml", CONFIG % "index.html"),
+                 ("index.html", ""), ("../evil.js", "")]),
+                "outside the package")
+        self.assertInvalid(self.good(), "more than the limit of 2",
+                           limits={"entries": 2})
+        self.assertInvalid(self.good(), "bytes, more than the limit",
+                           limits={"size": 100})
+        check_package(self.good(), limits={"size": None, "entries": 0})
+
+    def test_full(self):
+        # text in a legacy encoding is converted like UTF-8 text
+        check_package(self.package("encoding.oex",
+                [("config.xml", CONFIG % "index.html"),
+                 ("index.html", "caf\xe9"), ("app.js", "'\x80'")]),
+                full=True)
+        # a flipped byte in the stored data of a member
+        path = self.good("corrupt.oex", zipfile.ZIP_STORED)
+        data = bytearray(open(path, "rb").read())
+        offset = data.index("var a")
+        data[offset] ^= 0xff
+        open(path, "wb").write(data)
+        check_package(path)
+        self.assertInvalid(path, "corrupt", full=True)
+
+    def test_directory(self):
+        src = os.path.join(self.tmp, "src")
+        os.mkdir(src)
+        open(os.path.join(src, "config.xml"), "w").write(CONFIG % "main.html")
+        self.assertInvalid(src, "main.html given in config.xml")
+        out = os.path.join(self.tmp, "out.nex")
+        self.assertRaises(InvalidPackage, Oex2Nex(src, out).convert)
+        # nothing written, not even the zip of the directory
+        self.assertEqual(os.listdir(self.tmp), ["src"])
+        open(os.path.join(src, "main.html"), "w").write("<p>hi</p>")
+        Oex2Nex(src, out).convert()
+        self.assertTrue(zipfile.is_zipfile(out))
+
+    def test_no_output_for_invalid(self):
+        out = os.path.join(self.tmp, "out.nex")
+        open(out, "w").write("earlier result")
+        path = self.package("noindex.oex",
+                            [("config.xml", CONFIG % "start.html")])
+        self.assertRaises(InvalidPackage, Oex2Nex(path, out).convert)
+        self.assertEqual(open(out).read(), "earlier result")
+
+    def test_triage(self):
+        paths = [self.good("a.oex"), os.path.join(self.tmp, "missing.oex"),
+                 self.good("b.oex")]
+        for jobs in (1, 2):
+            records = list(triage(paths, jobs))
+            self.assertEqual([r["path"] for r in records], paths)
+            self.assertEqual([r["ok"] for r in records], [True, False, True])
+            self.assertIn("missing.oex", records[1]["error"])
+
+    def test_throughput(self):
+        # the quick checks only read the zip directory and config.xml, so a
+        # corpus can be sorted out at thousands of packages per second
+        path = self.good()
+        start = time.time()
+        for _i in range(200):
+            check_package(path)
+        self.assertLess(time.time() - start, 1)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+import unittest
+import zipfile
+import subprocess
+import json
+import os
+
+
+class TestDefaultPrefs(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Convert the test"""
+        if not os.path.exists("tests/fixtures/converted"):
+            os.makedirs("tests/fixtures/converted")
+        subprocess.call("python convertor.py -x tests/fixtures/preferences-001.oex tests/fixtures/converted/test1", shell=True)
+        nex = zipfile.ZipFile("tests/fixtures/converted/test1.nex", "r")
+        cls.prefs = nex.read("exported_prefs.js").decode("utf-8")
+
+    @classmethod
+    def tearDownClass(cls):
+        """Clean up"""
+        subprocess.call("rm -r tests/fixtures/converted/*", shell=True)
+
+    def test_single_payload(self):
+        """All defaults are set with one setItems call"""
+        self.assertEqual(self.prefs.count("prefs.setItems(defaults)"), 1)
+        start = self.prefs.index("})(widget.preferences, ") + 23
+        end = self.prefs.index(");", start)
+        defaults = json.loads(self.prefs[start:end])
+        self.assertEqual(defaults, {"interval": "30", "theme": "dark",
+                                    "greeting": u"h\xe9j"})
+
+    def test_set_once(self):
+        self.assertIn('if (prefs.getItem("_OPERA_INTERNAL_defaultPrefsSet"))',
+                      self.prefs)
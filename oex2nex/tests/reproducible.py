@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+import unittest
+import subprocess
+import hashlib
+import zipfile
+import time
+import os
+
+
+def sha1(path):
+    fh = open(path, "rb")
+    digest = hashlib.sha1(fh.read()).hexdigest()
+    fh.close()
+    return digest
+
+
+class TestReproducible(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Convert the tests twice"""
+        if not os.path.exists("tests/fixtures/converted"):
+            os.makedirs("tests/fixtures/converted")
+        for n in (1, 2):
+            subprocess.call("python convertor.py -r -j %d tests/fixtures/permissions-tabs-001.oex tests/fixtures/converted/tabs%d.nex" % (n * 2 - 1, n), shell=True)
+            subprocess.call("python convertor.py -r tests/fixtures/manifest-test-dir tests/fixtures/converted/dir%d.nex" % n, shell=True)
+            # a new second, so conversion time would show up
+            time.sleep(1)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Clean up"""
+        subprocess.call("rm -r tests/fixtures/converted/*", shell=True)
+
+    def test_same_hash(self):
+        self.assertEqual(sha1("tests/fixtures/converted/tabs1.nex"),
+                         sha1("tests/fixtures/converted/tabs2.nex"))
+
+    def test_same_hash_from_directory(self):
+        self.assertEqual(sha1("tests/fixtures/converted/dir1.nex"),
+                         sha1("tests/fixtures/converted/dir2.nex"))
+
+    def test_sorted_entries(self):
+        nex = zipfile.ZipFile("tests/fixtures/converted/tabs1.nex")
+        names = nex.namelist()
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(set(i.date_time for i in nex.infolist()),
+                         set([(1980, 1, 1, 0, 0, 0)]))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import unittest
+import subprocess
+import tempfile
+import shutil
+import time
+import zipfile
+import multiprocessing
+import os
+from io import BytesIO
+from convertor import Oex2Nex, InvalidPackage
+from resultcache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.nex = os.path.join(self.tmp, "in.nex")
+        fh = open(self.nex, "wb")
+        fh.write("x" * 1000)
+        fh.close()
+        self.cache = ResultCache(os.path.join(self.tmp, "results"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_key(self):
+        key = self.cache.key(self.nex, {"minify": False})
+        self.assertEqual(key, self.cache.key(self.nex, {"minify": False}))
+        self.assertNotEqual(key, self.cache.key(self.nex, {"minify": True}))
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", self.nex, {"warnings": ["w"]})
+        (path, meta) = self.cache.get("a")
+        self.assertEqual(open(path, "rb").read(), "x" * 1000)
+        self.assertEqual(meta, {"warnings": ["w"]})
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]),
+                         (1, 1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_evict_by_size(self):
+        now = time.time()
+        for age, key in ((30, "a"), (20, "b"), (10, "c")):
+            self.cache.put(key, self.nex, {})
+            os.utime(self.cache._path(key, ".nex"), (now - age, now - age))
+        # a is used again, so b is now the least recently used
+        self.cache.get("a")
+        self.cache.max_size = 2500
+        self.cache.evict()
+        self.assertEqual(self.cache.stats()["entries"], 2)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("c"))
+
+    def test_evict_by_age(self):
+        self.cache.put("a", self.nex, {})
+        self.cache.put("b", self.nex, {})
+        old = time.time() - self.cache.max_age - 10
+        os.utime(self.cache._path("a", ".nex"), (old, old))
+        self.cache.evict()
+        self.assertIsNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("b"))
+
+
+    def test_put_stream(self):
+        self.cache.put("a", BytesIO("y" * 10), {})
+        (path, _meta) = self.cache.get("a")
+        self.assertEqual(open(path, "rb").read(), "y" * 10)
+
+    def test_concurrent_counts(self):
+        workers = [multiprocessing.Process(target=_count_misses,
+                                           args=(self.cache.directory, 50))
+                   for _i in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.stats()["misses"], 200)
+
+    def test_stream_output(self):
+        package = "tests/fixtures/permissions-tabs-001.oex"
+        outputs = []
+        for _n in (1, 2):
+            out = BytesIO()
+            convertor = Oex2Nex(package, out, result_cache=self.cache)
+            convertor.convert()
+            outputs.append(out.getvalue())
+        self.assertTrue(convertor.stats["cached"])
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIsNone(zipfile.ZipFile(BytesIO(outputs[1])).testzip())
+
+    def test_limits_before_cache(self):
+        package = "tests/fixtures/permissions-tabs-001.oex"
+        Oex2Nex(package, BytesIO(), result_cache=self.cache).convert()
+        convertor = Oex2Nex(package, BytesIO(), result_cache=self.cache,
+                            package_limits={"entries": 1})
+        self.assertRaises(InvalidPackage, convertor.convert)
+
+
+def _count_misses(directory, times):
+    cache = ResultCache(directory)
+    for _i in range(times):
+        cache.get("missing")
+
+
+class TestCachedConversion(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        if not os.path.exists("tests/fixtures/converted"):
+            os.makedirs("tests/fixtures/converted")
+        cls.tmp = tempfile.mkdtemp()
+        cls.convertors = []
+        for n in (1, 2):
+            convertor = Oex2Nex("tests/fixtures/permissions-tabs-001.oex",
+                                "tests/fixtures/converted/cached%d" % n,
+                                out_dir=True,
+                                result_cache=ResultCache(cls.tmp))
+            convertor.convert()
+            cls.convertors.append(convertor)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Clean up"""
+        shutil.rmtree(cls.tmp)
+        subprocess.call("rm -r tests/fixtures/converted/*", shell=True)
+
+    def test_second_is_cached(self):
+        self.assertFalse(self.convertors[0].stats["cached"])
+        self.assertTrue(self.convertors[1].stats["cached"])
+        self.assertEqual(self.convertors[0].warnings,
+                         self.convertors[1].warnings)
+
+    def test_same_output(self):
+        for name in ("cached%d.nex", "cached%d/manifest.json"):
+            first = open("tests/fixtures/converted/" + name % 1, "rb").read()
+            second = open("tests/fixtures/converted/" + name % 2, "rb").read()
+            self.assertEqual(first, second)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import shutil
+import zipfile
+import time
+import os
+from convertor import Oex2Nex, _ScriptText
+
+# How much slower a conversion, or a stage of it, of FACTOR times the input
+# may be. Linear growth is FACTOR, quadratic FACTOR ** 2. Stages taking less
+# than MIN_SHARE of the time of the larger conversion are not checked.
+FACTOR = 8
+LIMIT = FACTOR * 2
+MIN_SHARE = 0.1
+
+config = ('<?xml version="1.0"?><widget xmlns="http://www.w3.org/ns/widgets">'
+          '<name>Scaling</name>%s</widget>')
+background = "<!DOCTYPE html><script src='background.js'></script>"
+
+
+def declarations(oex, n):
+    """ A background script with n top level declarations """
+    oex.writestr("config.xml", config % "")
+    oex.writestr("index.html", background)
+    oex.writestr("background.js", "".join(
+        "var v%d = opera.extension;\nfunction f%d() { return v%d; }\n"
+        % (i, i, i) for i in range(n)))
+
+
+def script_length(oex, n):
+    """ A background script of n lines in a single function, with
+    preference assignments and calls that look like API calls """
+    oex.writestr("config.xml", config % "")
+    oex.writestr("index.html", background)
+    oex.writestr("background.js", "(function () {\nvar tabs = "
+                 "opera.extension.tabs, prefs = widget.preferences;\n%s"
+                 "var done = true;\n})();\n"
+                 % "".join("var l%d = prefs.p%d + %d;\nprefs.q%d = l%d;\n"
+                           "tabs.create({url: l%d});\n"
+                           "document.body.classList.add(l%d);\n"
+                           % (i, i, i, i, i, i, i) for i in range(n)))
+
+
+def files(oex, n):
+    """ n pages, scripts, images and localised copies """
+    oex.writestr("config.xml", config % "")
+    oex.writestr("index.html", background)
+    oex.writestr("background.js", "var a = 1;")
+    for i in range(n):
+        oex.writestr("page%d.html" % i, "<!DOCTYPE html><script src="
+                     "'script%d.js'></script><p>%d</p>" % (i, i))
+        oex.writestr("script%d.js" % i, "var s%d = %d;" % (i, i))
+        oex.writestr("images/%d.png" % i, "\x89PNG" + "%d" % i * 10)
+        oex.writestr("locales/en/text%d.txt" % i, "text %d" % i)
+
+
+def inline_scripts(oex, n):
+    """ A background page with n inline scripts """
+    oex.writestr("config.xml", config % "")
+    # mostly data, which is not parsed, so the handling of the page counts
+    oex.writestr("index.html", "<!DOCTYPE html>" + "".join(
+        "<script>%s</script><p>%d</p>"
+        % ("var i%d = %d;" % (i, i) if i % 20 == 0 else "[%d]" % i, i)
+        for i in range(n)))
+
+
+def preferences(oex, n):
+    """ n preferences in config.xml """
+    oex.writestr("config.xml", config % "".join(
+        '<preference name="p%d" value="%d"/>' % (i, i) for i in range(n)))
+    oex.writestr("index.html", background)
+    oex.writestr("background.js", "var a = widget.preferences.p0;")
+
+
+class TestScaling(unittest.TestCase):
+    """
+    Converts synthetic packages of growing size and checks that the time
+    grows about linearly. A failure names the stage (see the seconds in the
+    conversion stats) that grew the most.
+    """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def convert(self, make, n, options):
+        """ Returns the seconds a package of size n takes and its stats """
+        path = os.path.join(self.tmp, "%s-%d.oex" % (make.__name__, n))
+        oex = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        make(oex, n)
+        oex.close()
+        convertor = Oex2Nex(path, path[:-4] + ".nex", **options)
+        start = time.time()
+        convertor.convert()
+        return (time.time() - start, convertor.stats)
+
+    def stages(self, stats):
+        """ Returns the seconds per stage, with the work on files other
+        than scripts and pages as a stage of its own """
+        seconds = dict(stats["seconds"])
+        rest = seconds.pop("files")
+        for stage in ("parse", "fix", "scan", "html"):
+            rest -= seconds.get(stage, 0)
+        seconds["other file handling"] = rest
+        return seconds
+
+    def growth(self, small, large):
+        """ Returns the stage that grew the most over the limit, or None """
+        (small_seconds, small_stats) = small
+        (large_seconds, large_stats) = large
+        before = self.stages(small_stats)
+        after = self.stages(large_stats)
+        over = [(after[s] - before.get(s, 0) * LIMIT, s) for s in after
+                if after[s] >= large_seconds * MIN_SHARE
+                and after[s] > before.get(s, 0) * LIMIT]
+        if over:
+            return max(over)[1]
+        if large_seconds > small_seconds * LIMIT:
+            # no single stage, the one with the most extra time
+            return max(after, key=lambda s: after[s]
+                       - before.get(s, 0) * FACTOR)
+        return None
+
+    def check(self, make, n, **options):
+        """ Fails if FACTOR times n takes more than LIMIT times as long,
+        in all or in one of the stages. Measured twice before failing, the
+        best times count """
+        small = self.convert(make, n, options)
+        large = self.convert(make, n * FACTOR, options)
+        if self.growth(small, large) is not None:
+            small = min(small, self.convert(make, n, options))
+            large = min(large, self.convert(make, n * FACTOR, options))
+        stage = self.growth(small, large)
+        if stage is not None:
+            before = self.stages(small[1]).get(stage, 0)
+            after = self.stages(large[1])[stage]
+            self.fail("%s: %d times the size took %.1f times as long "
+                      "(%.2fs, %.2fs), %s %.1f times (%.2fs, %.2fs)"
+                      % (" ".join(make.__doc__.split()), FACTOR, large[0] / small[0],
+                         small[0], large[0], stage,
+                         after / before if before else float("inf"),
+                         before, after))
+
+    def test_declarations(self):
+        self.check(declarations, 200)
+
+    def test_script_length(self):
+        self.check(script_length, 80)
+
+    def test_files(self):
+        self.check(files, 20)
+
+    def test_inline_scripts(self):
+        self.check(inline_scripts, 200)
+
+    def test_bundled_inline_scripts(self):
+        self.check(inline_scripts, 200, bundle_inline=True)
+
+    def test_preferences(self):
+        self.check(preferences, 200)
+
+
+class TestScriptText(unittest.TestCase):
+    def test_in_order(self):
+        text = _ScriptText(u"function f() { eval(a); }\neval(a);\n")
+        text.replace(u"function f() { eval(a); }",
+                     u"function f() { eval(a); }\nvar f = window.f = f;")
+        # inside the replacement, then the next one
+        text.replace(u"eval(a)", u"eval.call(window, a)")
+        text.replace(u"eval(a)", u"eval.call(window, a)")
+        self.assertEqual(text.text(), u"function f() { eval.call(window, a); }"
+                         u"\nvar f = window.f = f;\neval.call(window, a);\n")
+
+    def test_not_after_last(self):
+        text = _ScriptText(u"a = 1; b = 2; a = 1; c = 3;")
+        text.replace(u"c = 3", u"c = 4")
+        # not found after the last replacement, replaced everywhere
+        text.replace(u"a = 1", u"a = 0")
+        self.assertEqual(text.text(), u"a = 0; b = 2; a = 0; c = 4;")
+        text.replace(u"d", u"e")
+        self.assertEqual(text.text(), u"a = 0; b = 2; a = 0; c = 4;")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import unittest
+from convertor import Oex2Nex
+from jstokens import export_globals
+
+
+class TestExportGlobals(unittest.TestCase):
+    def test_vars(self):
+        script = u"var a = 1, b, c = {x: [1, 2]};"
+        self.assertEqual(export_globals(script),
+                         u'var a = window["a"] = 1, b = window["b"], '
+                         u'c = window["c"] = {x: [1, 2]};')
+
+    def test_function(self):
+        script = u"function foo(x) { function bar() {} return x / 2; }"
+        self.assertEqual(export_globals(script),
+                         script + u'\nvar foo = window["foo"] = foo;')
+
+    def test_asi(self):
+        script = u"var u = 3\nfoo(u)\n"
+        self.assertEqual(export_globals(script),
+                         u'var u = window["u"] = 3\nfoo(u)\n')
+
+    def test_nested_untouched(self):
+        script = (u"for (var i = 0; i < 3; i++) {}\n"
+                  u"if (x) { var y = 1; }\n"
+                  u"var f = function named() { var z; };\n"
+                  u"s = 'var q'; r = /var t/g; // var v\n")
+        self.assertEqual(export_globals(script), script.replace(
+            u"var f =", u'var f = window["f"] ='))
+
+
+class TestScriptLimits(unittest.TestCase):
+    script = u"var a = 1;\nfunction foo() { return a; }\n"
+
+    def convertor(self, limits):
+        return Oex2Nex("in.oex", "out.nex", limits=limits)
+
+    def test_within_limits(self):
+        convertor = self.convertor(None)
+        (data, is_json) = convertor._update_scopes(self.script)
+        self.assertFalse(is_json)
+        self.assertIn('window["a"]', data)
+        self.assertEqual(convertor.warnings, [])
+
+    def test_size_limit(self):
+        convertor = self.convertor({"size": 10})
+        (data, is_json) = convertor._update_scopes(self.script)
+        self.assertFalse(is_json)
+        self.assertIn('var a = window["a"] = 1', data)
+        self.assertIn('var foo = window["foo"] = foo;', data)
+        self.assertEqual(len(convertor.warnings), 1)
+        self.assertIn("size limit", convertor.warnings[0])
+
+    def test_node_limit(self):
+        convertor = self.convertor({"nodes": 5})
+        (data, is_json) = convertor._update_scopes(self.script)
+        self.assertIn('var a = window["a"] = 1', data)
+        self.assertIn("nodes limit", convertor.warnings[0])
+
+    def test_json_over_limit(self):
+        convertor = self.convertor({"size": 5})
+        (data, is_json) = convertor._update_scopes(u'{"a": [1, 2, 3]}')
+        self.assertTrue(is_json)
+        self.assertEqual(convertor.warnings, [])
+
+    def test_parse_time_limit(self):
+        convertor = self.convertor({"parse_time": 0.000001})
+        (data, is_json) = convertor._update_scopes(self.script * 50)
+        self.assertIn('var a = window["a"] = 1', data)
+        self.assertIn("parse_time limit", convertor.warnings[0])
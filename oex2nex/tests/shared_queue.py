@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import shutil
+import time
+import os
+import multiprocessing
+from batch import BatchRunner
+from workqueue import WorkQueue
+
+
+def _node(directory, lease_timeout):
+    """ A node of the queue, run in its own process like on another
+    machine """
+    queue = WorkQueue(directory, lease_timeout)
+    runner = BatchRunner(os.path.join(directory, "results"), jobs=1,
+                         options={"jobs": 1})
+    queue.work(runner, poll=0.1)
+
+
+class TestWorkQueue(unittest.TestCase):
+    packages = ["tests/fixtures/permissions-tabs-001.oex",
+                "tests/fixtures/permissions-tabs-002.oex",
+                "tests/fixtures/permissions-tabs-003.oex",
+                "tests/fixtures/manifest-test.oex",
+                "tests/fixtures/locales-001.oex"]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.bad = os.path.join(self.tmp, "bad.oex")
+        fh = open(self.bad, "w")
+        fh.write("not a zip file")
+        fh.close()
+        self.queue = WorkQueue(os.path.join(self.tmp, "queue"), 600)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def run_nodes(self, count, lease_timeout=600):
+        nodes = [multiprocessing.Process(target=_node,
+                 args=(self.queue.directory, lease_timeout))
+                 for _i in range(count)]
+        for node in nodes:
+            node.start()
+        for node in nodes:
+            node.join(120)
+            self.assertEqual(node.exitcode, 0)
+
+    def results(self):
+        return sorted(os.listdir(os.path.join(self.queue.directory,
+                                              "results")))
+
+    def test_nodes_share_jobs(self):
+        self.assertEqual(self.queue.add(self.packages + [self.bad]), 6)
+        # adding a package again does not make another job
+        self.assertEqual(self.queue.add(self.packages[:1]), 0)
+        self.run_nodes(3)
+        reports = self.queue.reports()
+        self.assertEqual(sorted(reports), self.queue.jobs())
+        self.assertEqual(self.queue.pending(), [])
+        self.assertEqual(self.queue.status(),
+                         {"jobs": 6, "leased": 0, "ok": 5, "failed": 1})
+        # every package converted exactly once, no temporary files left
+        self.assertEqual(self.results(), sorted(
+            "%s-%s.nex" % (os.path.splitext(os.path.basename(p))[0],
+                           self.queue.job_id(p))
+            for p in self.packages))
+        for report in reports.values():
+            if report["status"] == "ok":
+                self.assertTrue(os.path.isfile(report["out"]))
+        self.assertEqual(self.queue.retry_failed(), 1)
+        self.assertEqual(self.queue.pending(),
+                         [self.queue.job_id(self.bad)])
+
+    def test_same_names(self):
+        in_files = []
+        for (dirname, package) in zip(("a", "b"), self.packages[:2]):
+            os.mkdir(os.path.join(self.tmp, dirname))
+            in_files.append(os.path.join(self.tmp, dirname, "ext.oex"))
+            shutil.copy(package, in_files[-1])
+        self.assertEqual(self.queue.add(in_files), 2)
+        self.run_nodes(1)
+        reports = self.queue.reports()
+        self.assertEqual([report["status"] for report in reports.values()],
+                         ["ok", "ok"])
+        self.assertEqual(len(self.results()), 2)
+        for in_file in in_files:
+            report = reports[self.queue.job_id(in_file)]
+            self.assertEqual(report["file"], in_file)
+            self.assertEqual(os.path.basename(report["out"]), "ext-%s.nex"
+                             % self.queue.job_id(in_file))
+
+    def test_stale_lease_taken_over(self):
+        self.queue.add(self.packages[:2])
+        (stale, held) = [self.queue.job_id(p) for p in self.packages[:2]]
+        # a node that died an hour ago, and one that is still working
+        other = WorkQueue(self.queue.directory, 600)
+        other.owner = "elsewhere:1"
+        self.assertTrue(other.acquire(stale))
+        self.assertTrue(other.acquire(held))
+        self.assertFalse(self.queue.acquire(held))
+        lease = os.path.join(self.queue.directory, "leases", stale + ".lease")
+        past = time.time() - 3600
+        os.utime(lease, (past, past))
+        self.assertTrue(self.queue.acquire(stale))
+        self.assertTrue(self.queue.holds(stale))
+        self.assertFalse(other.holds(stale))
+        self.queue.release(stale)
+        # the node of the live lease finishes its job while the others wait
+        node = multiprocessing.Process(target=_node,
+                                       args=(self.queue.directory, 600))
+        node.start()
+        deadline = time.time() + 60
+        while not self.queue.reports() and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(sorted(self.queue.reports()), [stale])
+        self.assertTrue(node.is_alive())
+        other.finish(held, {"file": self.packages[1], "status": "failed",
+                            "out": os.path.join(self.tmp, "missing.nex"),
+                            "error": "Test", "warnings": [],
+                            "seconds": 0})
+        node.join(60)
+        self.assertEqual(node.exitcode, 0)
+        self.assertEqual(self.queue.status(),
+                         {"jobs": 2, "leased": 0, "ok": 1, "failed": 1})
+
+    def test_fresh_lease_kept(self):
+        self.queue.add(self.packages[:1])
+        job_id = self.queue.job_id(self.packages[0])
+        leases = os.path.join(self.queue.directory, "leases")
+        # this node saw an expired lease, but before its rename another
+        # node took it over and wrote a new one
+        other = WorkQueue(self.queue.directory, 600)
+        other.owner = "elsewhere:2"
+        self.assertTrue(other.acquire(job_id))
+        looks = []
+
+        def lease_expired(lease):
+            looks.append(lease)
+            return len(looks) == 1 or WorkQueue._lease_expired(self.queue,
+                                                               lease)
+        self.queue._lease_expired = lease_expired
+        self.assertFalse(self.queue.acquire(job_id))
+        self.assertEqual(len(looks), 2)
+        self.assertTrue(other.holds(job_id))
+        self.assertEqual(os.listdir(leases), [job_id + ".lease"])
+
+    def test_lost_lease_not_published(self):
+        self.queue.add(self.packages[:1])
+        job_id = self.queue.job_id(self.packages[0])
+        self.assertTrue(self.queue.acquire(job_id))
+        out = os.path.join(self.queue.directory, "results", ".tmp.nex")
+        open(out, "w").close()
+        # another node took the lease over in the meantime
+        os.unlink(os.path.join(self.queue.directory, "leases",
+                               job_id + ".lease"))
+        other = WorkQueue(self.queue.directory, 600)
+        other.owner = "elsewhere:1"
+        self.assertTrue(other.acquire(job_id))
+        record = self.queue.finish(job_id, {"file": self.packages[0],
+                                            "status": "ok", "out": out})
+        self.assertEqual(record, None)
+        self.assertEqual(self.queue.reports(), {})
+        self.assertEqual(self.results(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
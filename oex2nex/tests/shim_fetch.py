@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import hashlib
+import shutil
+import threading
+import time
+import os
+import BaseHTTPServer
+import SocketServer
+from shimsync import (ShimSync, ShimSyncError, ShimAuthRequired, UPDATED,
+                      UNCHANGED, RESTORED)
+
+FILES = ("a.js", "b.js", "c.js")
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves server.files with ETags and Last-Modified, failing the files
+    in server.fail with their status """
+
+    def do_GET(self):
+        server = self.server
+        name = self.path.lstrip("/")
+        with server.lock:
+            server.requests.append((name, self.headers.get("If-None-Match"),
+                                    self.headers.get("If-Modified-Since")))
+        time.sleep(server.delay)
+        if name in server.fail:
+            self.send_error(server.fail[name])
+            return
+        if name not in server.files:
+            self.send_error(404)
+            return
+        data = server.files[name]
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", "Mon, 17 Jun 2013 10:00:00 GMT")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestShimSync(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.shim_dir = os.path.join(self.tmp, "oex_shim")
+        self.cache_dir = os.path.join(self.tmp, "cache")
+        os.mkdir(self.shim_dir)
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.files = dict((name, "var %s = 1;\n" % name[0])
+                                 for name in FILES)
+        self.server.fail = {}
+        self.server.delay = 0
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def sync(self, **kwargs):
+        url = "http://127.0.0.1:%d/" % self.server.server_address[1]
+        return ShimSync(url, self.shim_dir, self.cache_dir, FILES,
+                        retries=0, **kwargs)
+
+    def shim(self, name):
+        fh = open(os.path.join(self.shim_dir, name), "rb")
+        data = fh.read()
+        fh.close()
+        return data
+
+    def test_fetch_and_not_modified(self):
+        sync = self.sync()
+        self.assertEqual(sync.run(), dict.fromkeys(FILES, UPDATED))
+        for name in FILES:
+            self.assertEqual(self.shim(name), self.server.files[name])
+            digest = hashlib.sha1(self.server.files[name]).hexdigest()
+            self.assertEqual(sync.version(name), digest)
+            self.assertTrue(os.path.isfile(os.path.join(
+                    self.cache_dir, "versions", digest + ".js")))
+        del self.server.requests[:]
+        mtime = os.path.getmtime(os.path.join(self.shim_dir, "a.js"))
+        self.assertEqual(sync.run(), dict.fromkeys(FILES, UNCHANGED))
+        # every request was conditional
+        for (_name, etag, modified) in self.server.requests:
+            self.assertTrue(etag)
+            self.assertEqual(modified, "Mon, 17 Jun 2013 10:00:00 GMT")
+        self.assertEqual(mtime, os.path.getmtime(
+                os.path.join(self.shim_dir, "a.js")))
+
+    def test_one_changed(self):
+        self.sync().run()
+        self.server.files["b.js"] = "var b = 2;\n"
+        self.assertEqual(self.sync().run(), {"a.js": UNCHANGED,
+                                             "b.js": UPDATED,
+                                             "c.js": UNCHANGED})
+        self.assertEqual(self.shim("b.js"), "var b = 2;\n")
+
+    def test_restored_from_cache(self):
+        self.sync().run()
+        fh = open(os.path.join(self.shim_dir, "c.js"), "w")
+        fh.write("var c = 'edited';")
+        fh.close()
+        self.assertEqual(self.sync().run()["c.js"], RESTORED)
+        self.assertEqual(self.shim("c.js"), self.server.files["c.js"])
+
+    def test_damaged_version(self):
+        sync = self.sync()
+        sync.run()
+        digest = sync.version("a.js")
+        fh = open(os.path.join(self.cache_dir, "versions", digest + ".js"),
+                  "w")
+        fh.write("var a = 'damaged';")
+        fh.close()
+        os.remove(os.path.join(self.cache_dir, "versions",
+                               sync.version("b.js") + ".js"))
+        os.remove(os.path.join(self.shim_dir, "a.js"))
+        os.remove(os.path.join(self.shim_dir, "b.js"))
+        del self.server.requests[:]
+        self.assertEqual(sync.run(), {"a.js": UPDATED, "b.js": UPDATED,
+                                      "c.js": UNCHANGED})
+        for name in ("a.js", "b.js"):
+            self.assertEqual(self.shim(name), self.server.files[name])
+        # a.js was fetched again without the conditions
+        self.assertIn(("a.js", None, None), self.server.requests)
+        fh = open(os.path.join(self.cache_dir, "versions", digest + ".js"))
+        self.assertEqual(fh.read(), self.server.files["a.js"])
+        fh.close()
+
+    def test_failure_changes_nothing(self):
+        self.sync().run()
+        self.server.files["a.js"] = "var a = 2;\n"
+        self.server.files["b.js"] = "var b = 2;\n"
+        self.server.fail["c.js"] = 500
+        with self.assertRaises(ShimSyncError) as raised:
+            self.sync().run()
+        self.assertEqual(list(raised.exception.errors), ["c.js"])
+        self.assertEqual(self.shim("a.js"), "var a = 1;\n")
+        self.assertEqual(self.shim("b.js"), "var b = 1;\n")
+        self.assertEqual(sorted(os.listdir(self.shim_dir)), list(FILES))
+        # an error page served as a shim is not taken either
+        del self.server.fail["c.js"]
+        self.server.files["c.js"] = "<html>Sign in</html>"
+        self.assertRaises(ShimSyncError, self.sync().run)
+        self.assertEqual(self.shim("a.js"), "var a = 1;\n")
+
+    def test_auth_required(self):
+        self.server.fail["a.js"] = 401
+        self.assertRaises(ShimAuthRequired, self.sync().run)
+        self.assertEqual(os.listdir(self.shim_dir), [])
+
+    def test_concurrent(self):
+        self.server.delay = 0.4
+        start = time.time()
+        self.sync(jobs=3).run()
+        self.assertLess(time.time() - start, 1.0)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import unittest
+import zipfile
+import subprocess
+import os
+import shims
+
+all_modules = set(["tabs", "toolbar", "menu", "speeddial", "urlfilter"])
+
+
+class TestShimTrim(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fh = open("oex_shim/operaextensions_background.js", "r")
+        cls.shim = fh.read()
+        fh.close()
+
+    def trim(self, modules):
+        return shims.trim(self.shim, "operaextensions_background.js",
+                          set(modules))
+
+    def test_all_modules(self):
+        self.assertEqual(self.trim(all_modules), self.shim)
+
+    def test_no_modules(self):
+        trimmed = self.trim([])
+        self.assertTrue(len(trimmed) < len(self.shim) / 4)
+        for cls in ("BrowserWindowManager", "ToolbarContext", "MenuContext",
+                    "SpeeddialContext", "UrlFilterManager"):
+            self.assertNotIn("var %s = function" % cls, trimmed)
+        # the else branches flagging unused features as loaded stay
+        self.assertIn("deferredComponentsLoadStatus['WINTABS_LOADED'] = true",
+                      trimmed)
+        self.assertIn("deferredComponentsLoadStatus['SPEEDDIAL_LOADED'] = true",
+                      trimmed)
+        self.assertIn("global.widget = global.widget || new OWidgetObj();",
+                      trimmed)
+        self.assertIn("if (global.opera) {", trimmed)
+
+    def test_some_modules(self):
+        trimmed = self.trim(["tabs", "menu"])
+        self.assertIn("var BrowserWindowManager = function", trimmed)
+        self.assertIn("var MenuContext = function", trimmed)
+        self.assertNotIn("var ToolbarContext = function", trimmed)
+        self.assertNotIn("var UrlFilterManager = function", trimmed)
+
+    def test_unknown_layout(self):
+        self.assertEqual(shims.trim("var a;", "operaextensions_background.js",
+                                    set()), "var a;")
+        self.assertEqual(shims.trim(self.shim, "operaextensions_popup.js",
+                                    set()), self.shim)
+
+    def test_modules_for_manifest(self):
+        self.assertEqual(shims.modules_for_manifest(
+            ["tabs", "webRequest", "webRequestBlocking"], True, False),
+            set(["tabs", "urlfilter", "toolbar"]))
+        self.assertEqual(shims.modules_for_manifest(["webRequest"]), set())
+
+
+class TestTrimmedConversion(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Convert the test"""
+        if not os.path.exists("tests/fixtures/converted"):
+            os.makedirs("tests/fixtures/converted")
+        subprocess.call("python convertor.py -x -t tests/fixtures/permissions-tabs-001.oex tests/fixtures/converted/test1", shell=True)
+        nex = zipfile.ZipFile("tests/fixtures/converted/test1.nex", "r")
+        cls.shim = nex.read("oex_shim/operaextensions_background.js")
+
+    @classmethod
+    def tearDownClass(cls):
+        """Clean up"""
+        subprocess.call("rm -r tests/fixtures/converted/*", shell=True)
+
+    def test_used_module_kept(self):
+        self.assertIn("var RootBrowserTabManager = function", self.shim)
+
+    def test_unused_module_dropped(self):
+        self.assertNotIn("var UrlFilterManager = function", self.shim)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import unittest
+from userscript import *
+
+
+class TestParseMetadata(unittest.TestCase):
+    def test_block(self):
+        script = (u"// ==UserScript==\n"
+                  u"// @name Foo\n"
+                  u"// @include http://example.com/*\n"
+                  u"//@include   https://example.com/*  \n"
+                  u"// @exclude http://example.com/private/*\n"
+                  u"// @noframes\n"
+                  u"// ==/UserScript==\n"
+                  u"// @include http://after.example.com/*\n")
+        metadata = parse_metadata(script)
+        self.assertEqual(metadata["include"], [u"http://example.com/*",
+                                               u"https://example.com/*"])
+        self.assertEqual(metadata["exclude"],
+                         [u"http://example.com/private/*"])
+        self.assertEqual(metadata["name"], [u"Foo"])
+        self.assertEqual(metadata["noframes"], [u""])
+
+    def test_no_start_line(self):
+        script = u"// @include http://example.com/*\n// ==/UserScript==\n"
+        self.assertEqual(parse_metadata(script)["include"],
+                         [u"http://example.com/*"])
+
+    def test_no_block(self):
+        self.assertIsNone(parse_metadata(u"// @include http://a/*\nvar a;"))
+
+
+class TestGlobToMatch(unittest.TestCase):
+    def test_exact(self):
+        self.assertEqual(glob_to_match("*"), ("<all_urls>", True))
+        self.assertEqual(glob_to_match("http://example.com/*"),
+                         ("http://example.com/*", True))
+        self.assertEqual(glob_to_match("https://example.com/a/*.html"),
+                         ("https://example.com/a/*.html", True))
+        self.assertEqual(glob_to_match("http://*/*"), ("http://*/*", True))
+        self.assertEqual(glob_to_match("file:///home/*"),
+                         ("file:///home/*", True))
+
+    def test_narrowed(self):
+        self.assertEqual(glob_to_match("*://example.com/*"),
+                         ("*://example.com/*", False))
+        self.assertEqual(glob_to_match("http://*.example.com/*"),
+                         ("http://*.example.com/*", False))
+        self.assertEqual(glob_to_match("http://example.com:8080/*"),
+                         ("http://example.com/*", False))
+        self.assertEqual(glob_to_match("http://example.com/search?q=*"),
+                         ("http://example.com/*", False))
+        self.assertEqual(glob_to_match("http://*/foo"),
+                         ("http://*/*", False))
+        self.assertEqual(glob_to_match("http://www.example.*/*"),
+                         ("http://*/*", False))
+
+    def test_not_covered(self):
+        self.assertIsNone(glob_to_match("*example.com*"))
+        self.assertIsNone(glob_to_match("http*://example.com/*"))
+        self.assertIsNone(glob_to_match("opera:*"))
+
+
+class TestContentScriptMatches(unittest.TestCase):
+    def test_exact(self):
+        self.assertEqual(content_script_matches(
+            ["http://example.com/*", "https://example.com/*"]),
+            (["http://example.com/*", "https://example.com/*"], []))
+        self.assertEqual(content_script_matches(["*"]), (["<all_urls>"], []))
+
+    def test_globs_kept(self):
+        includes = ["http://example.com/*", "http://*.example.org/*"]
+        self.assertEqual(content_script_matches(includes),
+                         (["http://example.com/*", "http://*.example.org/*"],
+                          includes))
+
+    def test_fallback(self):
+        includes = ["http://example.com/*", "*example.org*"]
+        self.assertEqual(content_script_matches(includes),
+                         (["<all_urls>"], includes))
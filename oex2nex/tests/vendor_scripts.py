@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import unittest
+import tempfile
+import hashlib
+import zipfile
+import os
+from io import BytesIO
+from convertor import (convert_package, vendor_library, read_library_hashes,
+                       vendor_libraries, library_banners)
+
+JQUERY = ("/*!\n * jQuery JavaScript Library v1.7.2\n * http://jquery.com/\n"
+          " * Copyright 2011, John Resig \xa9\n */\n"
+          "(function(window){ var jQuery = function(){};"
+          " window.jQuery = window.$ = jQuery; })(window);\n")
+PROTOTYPE = ("/*  Prototype JavaScript framework, version 1.7\n"
+             " *  (c) 2005-2010 Sam Stephenson\n */\n"
+             "var Prototype = {Version: '1.7'};\n")
+MINIFIED = ("/*! jQuery v1.8.3 jquery.com | jquery.org/license */\n"
+            "(function(e,t){var n=1})(window);")
+
+
+class TestVendorScripts(unittest.TestCase):
+
+    def package(self, files):
+        data = BytesIO()
+        oex = zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED)
+        oex.writestr("config.xml", '<widget xmlns="http://www.w3.org/ns/'
+                     'widgets"><name>Vendor</name></widget>')
+        oex.writestr("index.html", '<script src="lib/jquery.js"></script>'
+                     '<script src="app.js"></script>')
+        oex.writestr("app.js", "var count = 1;")
+        for (name, content) in files:
+            oex.writestr(name, content)
+        oex.close()
+        return data.getvalue()
+
+    def convert(self, oex, **options):
+        result = convert_package(oex, **options)
+        nex = zipfile.ZipFile(BytesIO(result["nex"]))
+        return (result, nex)
+
+    def test_banners(self):
+        rules = {"banners": library_banners}
+        self.assertEqual(vendor_library("a.js", JQUERY, rules), "jQuery")
+        self.assertEqual(vendor_library("a.js", MINIFIED, rules), "jQuery")
+        self.assertEqual(vendor_library("a.js", PROTOTYPE, rules), "Prototype")
+        self.assertEqual(vendor_library("a.js", "// jQuery UI 1.8.24\n"
+                                        "(function(){})();", rules),
+                         "jQuery UI")
+        # only the comments the script starts with count, and only at the
+        # start of a line
+        self.assertEqual(vendor_library("a.js", "// needs the jQuery 1.7 "
+                                        "plugin\nvar a = 1;", rules), None)
+        self.assertEqual(vendor_library("a.js", "var a = 1;\n" + JQUERY,
+                                        rules), None)
+        # not used unless asked for
+        self.assertEqual(vendor_library("a.js", JQUERY), None)
+
+    def test_known_releases(self):
+        hashes = vendor_libraries["hashes"]
+        self.assertEqual(hashes["71cce71820cc47b3bd1098618d248325fcf24ddb"],
+                         "jquery-1.6.4.min.js")
+        for (digest, name) in hashes.items():
+            self.assertEqual(len(digest), 40)
+            self.assertTrue(name.endswith(".js"))
+        self.assertEqual(vendor_library(
+                "lib/jq.js", "", digest="71cce71820cc47b3bd1098618d248325"
+                "fcf24ddb"), "jquery-1.6.4.min.js")
+
+    def test_globs_and_hashes(self):
+        rules = {"globs": ["lib/*.js"],
+                 "hashes": {hashlib.sha1("var a;").hexdigest(): "a.js"}}
+        self.assertEqual(vendor_library("lib/x.js", "var b;", rules),
+                         "lib/*.js")
+        self.assertEqual(vendor_library("app.js", "var a;", rules), "a.js")
+        self.assertEqual(vendor_library("app.js", "var b;", rules), None)
+        fd, path = tempfile.mkstemp()
+        os.write(fd, "%s  lib/a.js\n%s *b.js\nnot a sum\n" % (
+                hashlib.sha1("var a;").hexdigest(),
+                hashlib.sha1("var b;").hexdigest().upper()))
+        os.close(fd)
+        try:
+            hashes = read_library_hashes(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(sorted(hashes.values()), ["a.js", "b.js"])
+        self.assertEqual(hashes[hashlib.sha1("var b;").hexdigest()], "b.js")
+
+    def test_pass_through(self):
+        userscript = "// ==UserScript==\n// @include http://a.com/*\n" \
+                     "// ==/UserScript==\n" + PROTOTYPE
+        (result, nex) = self.convert(self.package(
+                [("lib/jquery.js", JQUERY),
+                 ("includes/proto.js", userscript)]),
+                vendor={"hashes": {hashlib.sha1(JQUERY).hexdigest():
+                                   "jquery-1.7.2.js"},
+                        "banners": library_banners})
+        self.assertEqual(result["stats"]["skipped"],
+                         {"lib/jquery.js": "jquery-1.7.2.js",
+                          "includes/proto.js": "Prototype"})
+        # copied byte for byte, even the latin-1 copyright sign
+        self.assertEqual(nex.read("lib/jquery.js"), JQUERY)
+        self.assertEqual(nex.read("includes/proto.js"), userscript)
+        self.assertTrue(nex.read("app.js").startswith("opera.isReady("))
+        # the userscript still gets injected
+        self.assertEqual(result["manifest"]["content_scripts"][0]["js"][-1],
+                         "includes/proto.js")
+
+    def test_bundle_fixed(self):
+        # a library banner in front of application code
+        bundle = JQUERY + "var app = jQuery;\n"
+        (result, nex) = self.convert(self.package([("lib/jquery.js",
+                                                    bundle)]))
+        self.assertEqual(result["stats"]["skipped"], {})
+        script = nex.read("lib/jquery.js")
+        self.assertTrue(script.startswith("opera.isReady("))
+        self.assertIn('var app = window["app"] = jQuery;', script)
+        # a plugin naming the library it needs
+        plugin = "/*! jQuery 1.7 plugin: tooltips */\nvar tips = 1;\n"
+        (result, nex) = self.convert(self.package([("lib/jquery.js",
+                                                    plugin)]))
+        self.assertEqual(result["stats"]["skipped"], {})
+
+    def test_fix_libraries(self):
+        oex = self.package([("lib/jquery.js", JQUERY)])
+        known = {hashlib.sha1(JQUERY).hexdigest(): "jquery-1.7.2.js"}
+        (result, nex) = self.convert(oex, vendor={"hashes": known})
+        self.assertEqual(result["stats"]["skipped"],
+                         {"lib/jquery.js": "jquery-1.7.2.js"})
+        (result, nex) = self.convert(oex, vendor={"hashes": {}})
+        self.assertEqual(result["stats"]["skipped"], {})
+        self.assertTrue(nex.read("lib/jquery.js").startswith("opera.isReady("))
+        (result, nex) = self.convert(oex, vendor={"globs": ["app.js"]})
+        self.assertEqual(result["stats"]["skipped"], {"app.js": "app.js"})
+        self.assertEqual(nex.read("app.js"), "var count = 1;")
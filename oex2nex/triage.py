@@ -0,0 +1,94 @@
+#!python
+""" Checks many packages with check_package() without converting them, so
+the invalid ones can be sorted out of a corpus before a batch run """
+
+import os
+import sys
+import json
+import functools
+import multiprocessing
+from convertor import check_package, package_limits, InvalidPackage
+from catalogue import find_packages
+
+
+def triage_package(path, limits=None, full=False):
+    """ Checks the package path, returns a record with its path, whether it
+    is ok, the reason if not and the name of the extension if so """
+    record = {"path": path, "ok": False, "error": None, "name": None}
+    try:
+        config = check_package(path, limits, full)
+    except InvalidPackage as e:
+        record["error"] = str(e)
+    except (IOError, OSError) as e:
+        record["error"] = "Unable to read the package: %s" % e
+    else:
+        record["ok"] = True
+        record["name"] = config["name"]
+    return record
+
+
+def triage(paths, jobs=1, limits=None, full=False):
+    """ Yields the triage_package() records of the packages paths, in order,
+    checked by jobs processes """
+    check = functools.partial(triage_package, limits=limits, full=full)
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            # the quick checks take well under a millisecond, the packages
+            # go to the workers in chunks
+            for record in pool.imap(check, paths, 64):
+                yield record
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for path in paths:
+            yield check(path)
+
+
+def main(args=None):
+    import argparse
+    argparser = argparse.ArgumentParser(description="Check that Opera OEX "
+            "extensions can be converted, without converting them")
+    argparser.add_argument('paths', nargs='+', metavar='path',
+            help="An .oex file, an extracted package (a directory with a "
+                "config.xml) or a directory searched for .oex files")
+    argparser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+            help="Number of processes checking packages (default: 1)")
+    argparser.add_argument('--full', default=False, action='store_true',
+            help="Also check the CRCs and the encoding of the text files, "
+                "which reads the whole package")
+    argparser.add_argument('--json', default=False, action='store_true',
+            help="Print a JSON line per package")
+    argparser.add_argument('--max-package-size', type=int,
+            default=package_limits["size"] // (1024 * 1024), metavar='MB',
+            help="Packages whose files are larger than this uncompressed "
+                "are rejected (0 for no limit)")
+    argparser.add_argument('--max-entries', type=int,
+            default=package_limits["entries"], metavar='N',
+            help="Packages with more files than this are rejected (0 for no "
+                "limit)")
+    args = argparser.parse_args(args)
+
+    paths = []
+    for path in args.paths:
+        if os.path.isfile(os.path.join(path, "config.xml")):
+            paths.append(path)
+        else:
+            paths.extend(find_packages([path]))
+    limits = {"size": args.max_package_size * 1024 * 1024,
+              "entries": args.max_entries}
+    invalid = 0
+    for record in triage(paths, args.jobs, limits, args.full):
+        if not record["ok"]:
+            invalid += 1
+        if args.json:
+            print(json.dumps(record, sort_keys=True))
+        elif record["ok"]:
+            print("ok %s" % record["path"])
+        else:
+            print("invalid %s: %s" % (record["path"], record["error"]))
+    return 1 if invalid else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
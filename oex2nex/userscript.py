@@ -0,0 +1,121 @@
+#!python
+""" Parsing of the userscript metadata block of injected scripts and the
+conversion of their @include globs into extension match patterns """
+
+import re
+
+_block_start = re.compile(r"^\s*//\s*==UserScript==\s*$", re.M)
+_block_end = re.compile(r"^.*==/UserScript==.*$", re.M)
+_meta_line = re.compile(r"^\s*(?://)?\s*@([\w:.-]+)(?:[ \t]+(.*?))?\s*$")
+_url_glob = re.compile(r"^([^:/]+)://([^/]*)(/.*)?$")
+
+# Schemes a match pattern can name literally
+match_schemes = ("http", "https", "ftp", "file")
+
+
+def parse_metadata(script):
+    """
+    Returns the metadata of a userscript as a dict mapping each key (without
+    the @) to the list of its values in the order they appear, e.g.
+    {"include": ["http://example.com/*"], "exclude": []}. The block runs
+    from the // ==UserScript== line, or the start of the script if there
+    is none, to the ==/UserScript== line. Returns None for scripts without
+    a metadata block.
+    """
+    end = _block_end.search(script)
+    if end is None:
+        return None
+    start = _block_start.search(script, 0, end.start())
+    if start is None:
+        block = script[:end.start()]
+    else:
+        block = script[start.end():end.start()]
+    metadata = {"include": [], "exclude": []}
+    for line in block.splitlines():
+        m = _meta_line.match(line)
+        if m is None:
+            continue
+        metadata.setdefault(m.group(1), []).append(m.group(2) or "")
+    return metadata
+
+
+def glob_to_match(glob):
+    """
+    Returns a (pattern, exact) tuple for an @include glob, where pattern is
+    the narrowest match pattern covering the URLs the glob is meant for and
+    exact tells whether it matches the very same URLs. Patterns that are not
+    exact still need the glob next to them (as an include_glob) to filter
+    the pages further. Returns None if no pattern short of <all_urls> covers
+    the glob.
+
+    Globs only have the * wildcard and it matches across the parts of an
+    URL, so e.g. http://*/foo is only covered by http://*/*. A wildcard
+    subdomain (http://*.example.com/*) is taken to mean the domain and its
+    subdomains, like in a match pattern.
+    """
+    if glob == "*":
+        return ("<all_urls>", True)
+    m = _url_glob.match(glob)
+    if m is None:
+        return None
+    scheme, host, path = m.groups()
+    exact = True
+    if scheme not in match_schemes:
+        if scheme != "*":
+            return None
+        # *:// only covers http and https in a match pattern
+        exact = False
+    if scheme == "file":
+        if host or path is None:
+            return None
+        if "?" in path or "#" in path:
+            return ("file:///*", False)
+        return ("file://" + path, True)
+    if path is None or "?" in path or "#" in path:
+        # no literal path, or one the pattern could not match as written
+        path = "/*"
+        exact = False
+    if host == "*":
+        if not path.startswith("/*"):
+            path = "/*"
+            exact = False
+    elif "*" in host or ":" in host or not host:
+        hostname = host.split(":")[0]
+        if hostname.startswith("*."):
+            subdomains = hostname[2:]
+        else:
+            subdomains = hostname
+        if subdomains and "*" not in subdomains:
+            # with a port, or *.example.com
+            host = hostname
+            exact = False
+        else:
+            host = "*"
+            path = "/*"
+            exact = False
+    return ("%s://%s%s" % (scheme, host, path), exact)
+
+
+def content_script_matches(includes):
+    """
+    Returns the (matches, include_globs) manifest values of a content script
+    with the given @include globs. include_globs is empty when the match
+    patterns select exactly the same pages as the globs.
+    """
+    if not includes:
+        return (["<all_urls>"], [])
+    matches = []
+    all_exact = True
+    for glob in includes:
+        converted = glob_to_match(glob)
+        if converted is None:
+            return (["<all_urls>"], list(includes))
+        pattern, exact = converted
+        all_exact = all_exact and exact
+        if pattern not in matches:
+            matches.append(pattern)
+    if "<all_urls>" in matches:
+        matches = ["<all_urls>"]
+    if all_exact:
+        return (matches, [])
+    return (matches, list(includes))
@@ -0,0 +1,374 @@
+#!python
+"""
+A work queue in a shared directory, so batch conversions can be spread over
+several machines without a broker. The directory holds:
+
+  jobs/<id>.json     a package to convert, added by WorkQueue.add()
+  leases/<id>.lease  taken by the node converting the job, its mtime is
+                     renewed while it works and a lease older than
+                     lease_timeout is taken over by another node
+  done/<id>.json     the report of a finished job, the job is not run again
+  results/<name>-<id>.nex
+                     the converted packages, named after the input and
+                     the job, as inputs in different directories may
+                     share a name
+
+Files are created with O_EXCL or written to a temporary name and renamed, so
+nodes never see partial files and only one of them gets a lease.
+"""
+
+import os
+import json
+import time
+import errno
+import socket
+import hashlib
+import tempfile
+from batch import BatchRunner, STATUS_OK
+from metrics import BatchMetrics
+
+_subdirs = ("jobs", "leases", "done", "results")
+
+
+def _publish(path, data):
+    """ Writes data to path through a temporary file in the same directory,
+    so readers see either nothing or all of it """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+    fh = os.fdopen(fd, "wb")
+    fh.write(data)
+    fh.flush()
+    os.fsync(fh.fileno())
+    fh.close()
+    os.rename(tmp, path)
+
+
+def _read_json(path):
+    fh = open(path, "rb")
+    try:
+        return json.load(fh)
+    finally:
+        fh.close()
+
+
+class WorkQueue(object):
+    """
+    The queue in directory. Leases not renewed for lease_timeout seconds are
+    considered abandoned (their node died) and are taken over.
+    """
+    def __init__(self, directory, lease_timeout=600):
+        self.directory = directory
+        self.lease_timeout = lease_timeout
+        self.owner = "%s:%d" % (socket.gethostname(), os.getpid())
+        for subdir in _subdirs:
+            try:
+                os.makedirs(os.path.join(directory, subdir))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, subdir, name):
+        return os.path.join(self.directory, subdir, name)
+
+    def job_id(self, in_file):
+        return hashlib.sha1(os.path.abspath(in_file)).hexdigest()
+
+    def add(self, in_files):
+        """ Adds the packages in in_files (paths every node can read) to the
+        queue. Returns the number of jobs added """
+        added = 0
+        for in_file in in_files:
+            in_file = os.path.abspath(in_file)
+            job_id = self.job_id(in_file)
+            job_path = self._path("jobs", job_id + ".json")
+            if os.path.exists(job_path):
+                continue
+            name = os.path.splitext(os.path.basename(in_file.rstrip(os.sep)))
+            # the result name, with the job id unique in the queue
+            _publish(job_path, json.dumps({"file": in_file,
+                                           "name": "%s-%s" % (name[0],
+                                                              job_id)}))
+            added += 1
+        return added
+
+    def retry_failed(self):
+        """ Removes the reports of the jobs that did not convert, so they
+        are run again. Returns their number """
+        removed = 0
+        for job_id, report in self.reports().items():
+            if report["status"] != STATUS_OK:
+                try:
+                    os.unlink(self._path("done", job_id + ".json"))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def jobs(self):
+        """ Returns the ids of all jobs, sorted """
+        return sorted(name[:-5] for name in
+                      os.listdir(os.path.join(self.directory, "jobs"))
+                      if name.endswith(".json"))
+
+    def reports(self):
+        """ Returns a dict of the reports of the finished jobs by job id """
+        reports = {}
+        for name in os.listdir(os.path.join(self.directory, "done")):
+            if name.endswith(".json"):
+                try:
+                    reports[name[:-5]] = _read_json(
+                            self._path("done", name))
+                except (IOError, ValueError):
+                    pass
+        return reports
+
+    def pending(self):
+        """ Returns the ids of the jobs without a report """
+        done = set(name[:-5] for name in
+                   os.listdir(os.path.join(self.directory, "done")))
+        return [job_id for job_id in self.jobs() if job_id not in done]
+
+    def acquire(self, job_id):
+        """ Takes the lease of a job, taking over an abandoned lease. Returns
+        False if another node holds it """
+        lease = self._path("leases", job_id + ".lease")
+        for attempt in (0, 1):
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            else:
+                os.write(fd, self.owner)
+                os.close(fd)
+                return True
+            if attempt or not self._lease_expired(lease):
+                return False
+            owner = self._lease_owner(lease)
+            # Several nodes can see the expired lease, only one of them can
+            # rename it away
+            stale = "%s.%s.stale" % (lease, self.owner)
+            try:
+                os.rename(lease, stale)
+            except OSError:
+                return False
+            if (not self._lease_expired(stale)
+                    or self._lease_owner(stale) != owner):
+                # Another node took the lease over between the look and the
+                # rename, this is its new lease: put it back
+                self._put_back(stale, lease)
+                return False
+            os.unlink(stale)
+        return False
+
+    def _put_back(self, stale, lease):
+        """ Moves a lease renamed away by mistake back, unless a new lease
+        was taken in the meantime. Its node then loses the job, and does
+        not publish its result """
+        try:
+            os.link(stale, lease)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                # no hard links on this file system
+                try:
+                    os.rename(stale, lease)
+                except OSError:
+                    pass
+        try:
+            os.unlink(stale)
+        except OSError:
+            pass
+
+    def _lease_expired(self, lease):
+        try:
+            return time.time() - os.path.getmtime(lease) > self.lease_timeout
+        except OSError:
+            # released in the meantime, the job is probably done
+            return False
+
+    def _lease_owner(self, lease):
+        """ Returns the owner written in a lease file, None if there is no
+        such file """
+        try:
+            fh = open(lease, "rb")
+        except IOError:
+            return None
+        try:
+            return fh.read()
+        finally:
+            fh.close()
+
+    def holds(self, job_id):
+        """ Whether this node still holds the lease of job_id """
+        return (self._lease_owner(self._path("leases", job_id + ".lease"))
+                == self.owner)
+
+    def renew(self, job_id):
+        """ Marks the lease of job_id as in use """
+        try:
+            os.utime(self._path("leases", job_id + ".lease"), None)
+        except OSError:
+            pass
+
+    def release(self, job_id):
+        try:
+            os.unlink(self._path("leases", job_id + ".lease"))
+        except OSError:
+            pass
+
+    def finish(self, job_id, record):
+        """ Publishes the result and report of a job converted into
+        record["out"] and releases its lease. Results of a job whose lease
+        was taken over are dropped, the other node publishes its own """
+        if not self.holds(job_id):
+            if os.path.exists(record["out"]):
+                os.unlink(record["out"])
+            return None
+        job = _read_json(self._path("jobs", job_id + ".json"))
+        record = dict(record, node=self.owner)
+        if record["status"] == STATUS_OK:
+            result = self._path("results", job["name"] + ".nex")
+            os.rename(record["out"], result)
+            record["out"] = result
+        else:
+            if os.path.exists(record["out"]):
+                os.unlink(record["out"])
+            record["out"] = None
+        _publish(self._path("done", job_id + ".json"), json.dumps(record))
+        self.release(job_id)
+        return record
+
+    def work(self, runner, poll=5, progress=None):
+        """
+        Converts jobs with the BatchRunner runner until every job has a
+        report, waiting poll seconds between looks at the queue while the
+        remaining jobs are leased by other nodes. Returns a dict of the
+        number of jobs per status converted by this node.
+        """
+        counts = {}
+        running = {}
+
+        def next_task():
+            for job_id in self.pending():
+                if job_id in running or not self.acquire(job_id):
+                    continue
+                if os.path.exists(self._path("done", job_id + ".json")):
+                    # finished by another node since pending() looked
+                    self.release(job_id)
+                    continue
+                job = _read_json(self._path("jobs", job_id + ".json"))
+                out_file = self._path("results", ".%s.%s.nex"
+                                      % (job_id, os.getpid()))
+                running[job["file"]] = job_id
+                return (job["file"], out_file)
+            return None
+
+        def tick(tasks):
+            for (in_file, _out_file) in tasks:
+                self.renew(running[in_file])
+
+        def finished(record):
+            record = self.finish(running.pop(record["file"]), record)
+            if record is None:
+                return
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+            if progress:
+                progress(record)
+
+        while self.pending():
+            runner.process_tasks(next_task, finished, tick)
+            if self.pending():
+                time.sleep(poll)
+        return counts
+
+    def status(self):
+        """ Returns the number of jobs, of leased jobs and of reports per
+        status """
+        counts = {"jobs": len(self.jobs()),
+                  "leased": len([name for name in os.listdir(
+                      os.path.join(self.directory, "leases"))
+                      if name.endswith(".lease")])}
+        for report in self.reports().values():
+            counts[report["status"]] = counts.get(report["status"], 0) + 1
+        return counts
+
+
+def main(args=None):
+    import argparse
+    argparser = argparse.ArgumentParser(description="Convert Opera OEX "
+            "extensions on several machines through a queue in a shared "
+            "directory")
+    argparser.add_argument('queue', help="Queue directory, on a file system "
+            "all nodes share")
+    argparser.add_argument('--lease-timeout', type=float, default=600,
+            metavar='SECONDS', help="Leases not renewed for this long are "
+                "taken over by other nodes")
+    commands = argparser.add_subparsers(dest='command')
+    add = commands.add_parser('add', help="Add packages to the queue")
+    add.add_argument('in_files', nargs='+', metavar='in_file',
+            help="Path to an .oex file or an extracted extension, readable "
+                "by all nodes")
+    commands.add_parser('retry', help="Run the failed jobs again")
+    commands.add_parser('status', help="Show the state of the queue")
+    work = commands.add_parser('work', help="Convert jobs until the queue "
+            "is done")
+    work.add_argument('-j', '--jobs', type=int, default=None, metavar='N',
+            help="Number of worker processes (default: number of CPUs)")
+    work.add_argument('--timeout', type=float, default=300,
+            metavar='SECONDS', help="Time a single package may take before "
+                "its worker is killed (0 for no limit)")
+    work.add_argument('--max-memory', type=int, default=1024, metavar='MB',
+            help="Address space limit of a worker process (0 for no limit)")
+    work.add_argument('--tasks-per-worker', type=int, default=50,
+            metavar='N', help="Replace a worker process after it converted "
+                "this many packages (0 for never)")
+    work.add_argument('--poll', type=float, default=5, metavar='SECONDS',
+            help="Time between looks at jobs leased by other nodes")
+    work.add_argument('-t', '--trim-shims', default=False,
+            action='store_true', help="See convertor.py --trim-shims")
+    work.add_argument('-m', '--minify', default=False,
+            action='store_true', help="See convertor.py --minify")
+    work.add_argument('-b', '--bundle-inline', default=False,
+            action='store_true', help="See convertor.py --bundle-inline")
+    work.add_argument('-r', '--reproducible', default=False,
+            action='store_true', help="See convertor.py --reproducible")
+    work.add_argument('--metrics', default=None, metavar='FILE',
+            help="See batch.py --metrics, for the jobs of this node")
+    work.add_argument('--events', default=None, metavar='FILE',
+            help="See batch.py --events, for the jobs of this node")
+    args = argparser.parse_args(args)
+
+    queue = WorkQueue(args.queue, args.lease_timeout)
+    if args.command == 'add':
+        print("Added %d jobs" % queue.add(args.in_files))
+    elif args.command == 'retry':
+        print("Retrying %d jobs" % queue.retry_failed())
+    elif args.command == 'status':
+        print(", ".join("%d %s" % (n, state)
+                        for (state, n) in sorted(queue.status().items())))
+    else:
+        options = {"trim_shims": args.trim_shims, "minify": args.minify,
+                   "bundle_inline": args.bundle_inline,
+                   "reproducible": args.reproducible, "jobs": 1}
+        metrics = None
+        if args.metrics or args.events:
+            metrics = BatchMetrics(args.metrics, args.events)
+        runner = BatchRunner(os.path.join(args.queue, "results"), None,
+                             args.jobs, args.timeout,
+                             args.max_memory * 1024 * 1024,
+                             args.tasks_per_worker, options, metrics)
+
+        def progress(record):
+            print("%s %s%s" % (record["status"], record["file"],
+                               ": " + record["error"] if record["error"]
+                               else ""))
+        try:
+            counts = queue.work(runner, args.poll, progress)
+        finally:
+            if metrics is not None:
+                metrics.close()
+        print(", ".join("%d %s" % (n, status)
+                        for (status, n) in sorted(counts.items()))
+              or "Nothing converted by this node")
+
+if __name__ == "__main__":
+    main()
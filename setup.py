@@ -7,6 +7,6 @@ setup(
     packages=["oex2nex"],
     install_requires=("slimit >= 0.8.0", "html5lib"),
     package_data = {
-        "oex2nex": ["oex_shim/*"],
+        "oex2nex": ["oex_shim/*", "known_libraries.sha1"],
     }
 )